@@ -1,11 +1,12 @@
 from datetime import datetime
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, Date, ForeignKey, UniqueConstraint
+from sqlalchemy import create_engine, inspect, text, Column, Integer, String, Text, DateTime, Date, ForeignKey, UniqueConstraint, Index
 from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
 import os
 import pymysql
+from .migrations import run_migrations, verify_schema
 pymysql.install_as_MySQLdb()
 
 
@@ -19,7 +20,7 @@ class Period(Base):
     period_name = Column(String(50), unique=True, nullable=False)
     start_date = Column(DateTime, nullable=False)
     end_date = Column(DateTime, nullable=False)
-    status = Column(String(20), nullable=False)  # 报名中/进行中/已结束
+    status = Column(String(20), nullable=False, index=True)  # 报名中/进行中/已结束
     signup_link = Column(String(500))  # 新增：存储接龙链接
 
     signups = relationship(
@@ -37,6 +38,12 @@ class Signup(Base):
     introduction = Column(Text)
     goals = Column(Text)
     signup_time = Column(DateTime, default=datetime.now)
+    progress_summary = Column(Text)  # 滚动更新的进展摘要，代替完整打卡历史用于提示词
+    summary_checkin_count = Column(Integer)  # 摘要已覆盖到第几次打卡
+    # 冗余的打卡统计，打卡时在同一事务中更新，定期与 checkins 表对账
+    checkin_count = Column(Integer, nullable=False, default=0, server_default='0')
+    last_checkin_date = Column(Date)
+    current_streak = Column(Integer, nullable=False, default=0, server_default='0')  # 截至最后一次打卡的连续天数
 
     period = relationship("Period", back_populates="signups")
     checkins = relationship("Checkin", back_populates="signup")
@@ -57,6 +64,12 @@ class Checkin(Base):
 
     signup = relationship("Signup", back_populates="checkins")
 
+    # 同一人每天只能打卡一次；该索引同时服务按 signup_id 查重和按日期排序
+    __table_args__ = (
+        UniqueConstraint('signup_id', 'checkin_date', name='uq_checkins_signup_date'),
+        Index('ix_checkins_checkin_date', 'checkin_date'),
+    )
+
 
 class Certificate(Base):
     __tablename__ = 'certificate'
@@ -68,6 +81,55 @@ class Certificate(Base):
     period = relationship("Period", back_populates="certificates")
 
 
+class LeaderboardEntry(Base):
+    __tablename__ = 'leaderboard'
+
+    signup_id = Column(Integer, ForeignKey('signups.id', ondelete='CASCADE'), primary_key=True)
+    period_id = Column(Integer, ForeignKey('periods.id'), nullable=False)
+    nickname = Column(String(50), nullable=False)
+    checkin_count = Column(Integer, nullable=False, default=0)
+    last_checkin_date = Column(Date)
+    latest_checkin_id = Column(Integer)  # 最新一次打卡的 checkins.id
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+    # 排名顺序：打卡次数降序、报名ID升序，前N名和个人名次都走这个索引
+    __table_args__ = (Index('ix_leaderboard_rank', 'period_id', 'checkin_count', 'signup_id'),)
+
+
+class JobRun(Base):
+    __tablename__ = 'job_runs'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    job_name = Column(String(100), nullable=False)
+    period_id = Column(Integer, nullable=False, default=0)  # 与期数无关的任务为 0
+    run_date = Column(Date, nullable=False)  # 计划执行的日期
+    status = Column(String(20), nullable=False)  # running / completed / failed
+    owner = Column(String(100))  # 认领的进程：主机名:进程号
+    attempts = Column(Integer, nullable=False, default=1)
+    claimed_at = Column(DateTime, nullable=False, default=datetime.now)
+    finished_at = Column(DateTime)
+    error = Column(Text)
+
+    # 同一任务、同一期、同一天只能有一条记录，认领靠这个唯一约束保证原子性
+    __table_args__ = (UniqueConstraint('job_name', 'period_id', 'run_date', name='uq_job_runs_job_period_day'),)
+
+
+class ProcessedEvent(Base):
+    __tablename__ = 'processed_events'
+
+    event_key = Column(String(128), primary_key=True)  # 事件ID或消息ID，带类型前缀
+    created_at = Column(DateTime, default=datetime.now, nullable=False, index=True)
+
+
+class LLMResponseCacheEntry(Base):
+    __tablename__ = 'llm_response_cache'
+
+    cache_key = Column(String(64), primary_key=True)  # 请求参数的 sha256
+    mode = Column(String(20))
+    response = Column(Text, nullable=False)
+    created_at = Column(DateTime, default=datetime.now, nullable=False, index=True)
+
+
 # 数据库连接
 
 load_dotenv()
@@ -80,6 +142,27 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 def init_db():
     Base.metadata.create_all(engine)
+    add_missing_columns()
+    # create_all 不会给已存在的表加索引，由版本化迁移补齐并在启动时校验
+    run_migrations(engine)
+    verify_schema(engine)
+
+
+def add_missing_columns():
+    """为已存在的表补充模型中新增的列（create_all 不会修改已存在的表）"""
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(dialect=engine.dialect)}"
+                if column.server_default is not None:
+                    ddl += f" DEFAULT {column.server_default.arg}"
+                conn.execute(text(ddl))
 
 
 def get_db():
@@ -0,0 +1,164 @@
+import logging
+from datetime import datetime
+from typing import Callable, Collection, List, Optional, Sequence, Tuple
+from sqlalchemy import inspect, text, Column, Integer, String, Date, DateTime, MetaData, Table
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import IntegrityError
+from ..utils.checkin_stats import summarize_checkin_dates
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+_metadata = MetaData()
+
+# 已执行的迁移版本
+schema_migrations = Table(
+    'schema_migrations', _metadata,
+    Column('version', Integer, primary_key=True),
+    Column('name', String(100), nullable=False),
+    Column('applied_at', DateTime, nullable=False),
+)
+
+# 启动时校验的索引：(表名, 列, 是否唯一)
+REQUIRED_INDEXES: List[Tuple[str, Tuple[str, ...], bool]] = [
+    ('checkins', ('signup_id', 'checkin_date'), True),
+    ('checkins', ('checkin_date',), False),
+    ('signups', ('period_id', 'nickname'), True),
+    ('periods', ('status',), False),
+    ('job_runs', ('job_name', 'period_id', 'run_date'), True),
+]
+
+
+class MigrationError(Exception):
+    """迁移无法安全执行（例如已有数据违反要新增的唯一约束）"""
+
+
+def _has_index(conn: Connection, table: str, columns: Sequence[str], unique: bool) -> bool:
+    """表上是否已有列顺序相同的索引（唯一索引也满足普通索引的要求）"""
+    inspector = inspect(conn)
+    candidates = [
+        (tuple(index['column_names']), bool(index.get('unique')))
+        for index in inspector.get_indexes(table)
+    ]
+    candidates += [(tuple(constraint['column_names']), True) for constraint in inspector.get_unique_constraints(table)]
+    return any(cols == tuple(columns) and (is_unique or not unique) for cols, is_unique in candidates)
+
+
+def _ensure_index(conn: Connection, name: str, table: str, columns: Sequence[str], unique: bool = False):
+    if _has_index(conn, table, columns, unique):
+        logger.info(f"索引已存在，跳过: {table}({', '.join(columns)})")
+        return
+    kind = "UNIQUE INDEX" if unique else "INDEX"
+    conn.execute(text(f"CREATE {kind} {name} ON {table} ({', '.join(columns)})"))
+    logger.info(f"已创建索引 {name}: {table}({', '.join(columns)})")
+
+
+def _checkins_hot_path(conn: Connection):
+    """打卡热路径：按 (signup_id, checkin_date) 查重和按日期排序，同一人同一天只能有一条打卡"""
+    duplicates = conn.execute(text(
+        "SELECT signup_id, checkin_date, COUNT(*) FROM checkins "
+        "GROUP BY signup_id, checkin_date HAVING COUNT(*) > 1"
+    )).fetchall()
+    if duplicates:
+        sample = ", ".join(f"{row[0]}@{row[1]}" for row in duplicates[:10])
+        raise MigrationError(f"checkins 中有 {len(duplicates)} 组同一天的重复打卡，需先人工处理: {sample}")
+    _ensure_index(conn, 'uq_checkins_signup_date', 'checkins', ('signup_id', 'checkin_date'), unique=True)
+    _ensure_index(conn, 'ix_checkins_checkin_date', 'checkins', ('checkin_date',))
+
+
+def _signup_and_period_lookups(conn: Connection):
+    """按 (period_id, nickname) 查报名记录、按状态查当前期数"""
+    _ensure_index(conn, 'uq_signups_period_nickname', 'signups', ('period_id', 'nickname'), unique=True)
+    _ensure_index(conn, 'ix_periods_status', 'periods', ('status',))
+
+
+def _backfill_signup_counters(conn: Connection):
+    """为新增的报名打卡统计列（由 add_missing_columns 添加）按已有打卡记录回填"""
+    dates = {}
+    for signup_id, checkin_date in conn.execute(text("SELECT signup_id, checkin_date FROM checkins").columns(checkin_date=Date)):
+        dates.setdefault(signup_id, []).append(checkin_date)
+    rows = []
+    for signup_id, values in dates.items():
+        count, last_date, streak = summarize_checkin_dates(values)
+        rows.append({'id': signup_id, 'count': count, 'last_date': last_date, 'streak': streak})
+    if rows:
+        conn.execute(text(
+            "UPDATE signups SET checkin_count = :count, last_checkin_date = :last_date, current_streak = :streak "
+            "WHERE id = :id"
+        ), rows)
+    logger.info(f"已回填 {len(rows)} 条报名记录的打卡统计")
+
+
+def _build_leaderboard(conn: Connection):
+    """按已有打卡记录建立物化排行榜，升级前的打卡不会因为排行榜中已有新行而被忽略"""
+    conn.execute(text("DELETE FROM leaderboard"))
+    result = conn.execute(text(
+        "INSERT INTO leaderboard (signup_id, period_id, nickname, checkin_count, last_checkin_date, "
+        "latest_checkin_id, updated_at) "
+        "SELECT s.id, s.period_id, s.nickname, COUNT(c.id), MAX(c.checkin_date), MAX(c.id), :now "
+        "FROM signups s JOIN checkins c ON c.signup_id = s.id "
+        "GROUP BY s.id, s.period_id, s.nickname"
+    ), {'now': datetime.now()})
+    logger.info(f"已按打卡记录建立 {result.rowcount} 行排行榜")
+
+
+# 版本号只增不改，新迁移追加到末尾
+MIGRATIONS: List[Tuple[int, str, Callable[[Connection], None]]] = [
+    (1, 'checkins_hot_path_indexes', _checkins_hot_path),
+    (2, 'signup_and_period_lookup_indexes', _signup_and_period_lookups),
+    (3, 'backfill_signup_checkin_counters', _backfill_signup_counters),
+    (4, 'build_leaderboard_from_checkins', _build_leaderboard),
+]
+
+
+def run_migrations(engine: Engine, only: Optional[Collection[int]] = None) -> List[int]:
+    """
+    按版本顺序执行尚未执行的迁移，每个迁移在独立事务中执行并记录到 schema_migrations
+    某个迁移失败时停止，后续版本留到下次启动再执行；返回本次执行的版本号。
+    only 指定时只执行其中的版本（基准测试等只有部分表的库使用）
+    """
+    _metadata.create_all(engine)
+    with engine.connect() as conn:
+        applied = {row[0] for row in conn.execute(schema_migrations.select().with_only_columns(schema_migrations.c.version))}
+
+    done = []
+    for version, name, migrate in MIGRATIONS:
+        if version in applied or (only is not None and version not in only):
+            continue
+        logger.info(f"执行数据库迁移 {version}: {name}")
+        try:
+            with engine.begin() as conn:
+                migrate(conn)
+                conn.execute(schema_migrations.insert().values(version=version, name=name, applied_at=datetime.now()))
+        except IntegrityError as e:
+            # 多个进程同时启动时，其他进程可能已经记录了该版本
+            with engine.connect() as conn:
+                recorded = conn.execute(
+                    schema_migrations.select().where(schema_migrations.c.version == version)
+                ).first()
+            if recorded:
+                logger.info(f"迁移 {version} 已由其他进程执行")
+                continue
+            logger.error(f"数据库迁移 {version}（{name}）失败，后续迁移暂不执行: {str(e)}")
+            break
+        except Exception as e:
+            logger.error(f"数据库迁移 {version}（{name}）失败，后续迁移暂不执行: {str(e)}")
+            break
+        else:
+            done.append(version)
+    return done
+
+
+def verify_schema(engine: Engine) -> List[str]:
+    """校验热路径需要的索引是否都存在，返回缺失项的描述"""
+    missing = []
+    with engine.connect() as conn:
+        inspector = inspect(conn)
+        for table, columns, unique in REQUIRED_INDEXES:
+            if not inspector.has_table(table) or not _has_index(conn, table, columns, unique):
+                missing.append(f"{table}({', '.join(columns)}){' UNIQUE' if unique else ''}")
+    if missing:
+        logger.error(f"数据库缺少以下索引，查询性能和打卡去重会受影响: {missing}")
+    else:
+        logger.info("数据库索引校验通过")
+    return missing
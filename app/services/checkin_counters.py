@@ -0,0 +1,77 @@
+import logging
+from collections import defaultdict
+from datetime import date, timedelta
+from typing import Dict, Optional
+from sqlalchemy import case
+from sqlalchemy.orm import Session
+from ..models.database import Signup, Checkin
+from ..utils.checkin_stats import summarize_checkin_dates
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+
+class CheckinCounterService:
+    """
+    报名记录上的冗余打卡统计：打卡次数、最后打卡日期、连续打卡天数
+    打卡时在同一事务中原子更新，对账任务按 checkins 表修复偏差。不提交事务，由调用方统一提交
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def record_checkin(self, signup_id: int, checkin_date: date) -> int:
+        """
+        在打卡事务中原子地累加统计，返回累加后的打卡次数
+        连续天数必须在最后打卡日期之前赋值：MySQL 的 UPDATE 按顺序求值，后面的表达式会看到前面更新后的值。
+        次数在 UPDATE 之后从数据库重新读取：UPDATE 持有该行的锁，读到的是本事务累加后的值，不受缓存快照影响
+        """
+        self.db.query(Signup)\
+            .filter(Signup.id == signup_id)\
+            .update(
+                [
+                    (Signup.current_streak, case(
+                        (Signup.last_checkin_date == checkin_date - timedelta(days=1), Signup.current_streak + 1),
+                        else_=1
+                    )),
+                    (Signup.checkin_count, Signup.checkin_count + 1),
+                    (Signup.last_checkin_date, checkin_date),
+                ],
+                synchronize_session=False,
+                update_args={"preserve_parameter_order": True}
+            )
+        return self.db.query(Signup.checkin_count).filter(Signup.id == signup_id).scalar() or 0
+
+    def reconcile(self, period_id: Optional[int] = None) -> Dict[str, int]:
+        """
+        按 checkins 表重新计算统计，只更新不一致的报名记录
+        不传 period_id 时检查所有期数；返回 checked（检查数）和 repaired（修复数）
+        """
+        signups = self.db.query(Signup.id, Signup.checkin_count, Signup.last_checkin_date, Signup.current_streak)
+        checkins = self.db.query(Checkin.signup_id, Checkin.checkin_date)
+        if period_id is not None:
+            signups = signups.filter(Signup.period_id == period_id)
+            checkins = checkins.join(Signup, Signup.id == Checkin.signup_id).filter(Signup.period_id == period_id)
+
+        dates = defaultdict(list)
+        for signup_id, checkin_date in checkins:
+            dates[signup_id].append(checkin_date)
+
+        repairs = []
+        checked = 0
+        for row in signups:
+            checked += 1
+            count, last_date, streak = summarize_checkin_dates(dates.get(row.id, []))
+            if (row.checkin_count, row.last_checkin_date, row.current_streak) != (count, last_date, streak):
+                repairs.append({
+                    'id': row.id,
+                    'checkin_count': count,
+                    'last_checkin_date': last_date,
+                    'current_streak': streak,
+                })
+
+        if repairs:
+            self.db.bulk_update_mappings(Signup, repairs)
+            logger.warning(f"打卡统计对账修复 {len(repairs)} 条报名记录: {[r['id'] for r in repairs[:20]]}")
+        logger.info(f"打卡统计对账完成 - 检查: {checked}, 修复: {len(repairs)}")
+        return {'checked': checked, 'repaired': len(repairs)}
@@ -0,0 +1,107 @@
+import json
+import logging
+import re
+from typing import Dict, List, NamedTuple, Optional, Pattern, Tuple
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 打卡：#打卡 昵称 工作内容
+CHECKIN_PATTERN: Pattern = re.compile(r'#打卡\s+([\w-]+)\s+(.+)(?:\n|$)')
+# 排名公布：#N天打卡排名公布
+RANKING_PATTERN: Pattern = re.compile(r'#(\d+)天打卡排名公布')
+# 群里可以直接发送的排名公布天数
+RANKING_DAYS = (3, 7, 14, 21)
+# 新一期接龙卡片的标题
+SIGNUP_CARD_TITLE = "🌟本期目标制定"
+# 通过 API 发送的 @ 消息中未替换的提及占位符
+MENTION_PLACEHOLDER = "@_user_"
+
+
+class Route(NamedTuple):
+    """路由结果：MessageHandler 上的处理方法名，以及是否把消息文本作为第一个参数传入"""
+    handler: str
+    text: str
+    with_text: bool
+
+
+class CommandRouter:
+    """
+    文本命令路由表，命令在启动时注册一次，用到的正则都在模块加载时预编译
+    完全匹配的命令（去掉首尾空白后）查字典；前缀命令按首字符分桶，只检查同一个桶里的前缀，
+    完全匹配优先，因此 #打卡开始 不会被 #打卡 的前缀命令抢走。
+    不以 # 或 @ 开头的普通聊天在首字符查找时就被拒绝，不解析 JSON、不打开数据库会话
+    """
+
+    def __init__(self):
+        self._exact: Dict[str, Route] = {}
+        self._prefixes: Dict[str, List[Tuple[str, Route]]] = {}
+
+    def exact(self, command: str, handler: str, with_text: bool = False):
+        """注册完全匹配的命令"""
+        self._exact[command] = Route(handler, "", with_text)
+
+    def prefix(self, prefix: str, handler: str, with_text: bool = True):
+        """注册前缀命令，同一个桶内按注册顺序匹配"""
+        self._prefixes.setdefault(prefix[0], []).append((prefix, Route(handler, "", with_text)))
+
+    def route_text(self, text: str) -> Optional[Route]:
+        """匹配文本消息，不是命令时返回 None"""
+        stripped = text.strip()
+        if not stripped:
+            return None
+
+        route = self._exact.get(stripped)
+        if route:
+            return route._replace(text=text)
+
+        for prefix, route in self._prefixes.get(stripped[0], ()):
+            if stripped.startswith(prefix):
+                return route._replace(text=text)
+
+        # 通过 API 发送的 @ 消息，提及占位符不一定在开头
+        if MENTION_PLACEHOLDER in text:
+            return Route('handle_mention', text, True)
+        return None
+
+    def route(self, message_type: str, content: str) -> Optional[Route]:
+        """按消息类型路由；text 消息可以是纯文本，也可以是带 text 字段的 JSON"""
+        if message_type == "text":
+            if content.lstrip().startswith('{'):
+                try:
+                    payload = json.loads(content)
+                except json.JSONDecodeError:
+                    payload = None
+                if isinstance(payload, dict):
+                    content = payload.get("text", "")
+            return self.route_text(content)
+
+        if message_type == "interactive":
+            try:
+                title = json.loads(content).get("title", "").strip()
+            except (json.JSONDecodeError, AttributeError) as e:
+                logger.error(f"解析消息内容失败: {str(e)}")
+                return None
+            if title == SIGNUP_CARD_TITLE:
+                return Route('handle_signup_card', content, True)
+            logger.info(f"不是目标制定消息，标题为: {title}")
+        return None
+
+
+def build_default_router() -> CommandRouter:
+    """群内支持的全部命令"""
+    router = CommandRouter()
+    router.exact('#接龙结束', 'handle_signup_end')
+    router.exact('#活动结束', 'handle_activity_end')
+    router.exact('#打卡开始', 'handle_checkin_start')
+    router.exact('#最新打卡排名公布', 'handle_ranking_publish_latest')
+    router.exact('#排行榜重建', 'handle_leaderboard_rebuild')
+    for days in RANKING_DAYS:
+        router.exact(f'#{days}天打卡排名公布', 'handle_ranking_publish', with_text=True)
+    router.prefix('#打卡', 'handle_checkin')
+    router.prefix('@', 'handle_mention')
+    return router
+
+
+# 进程内共享的命令路由表
+command_router = build_default_router()
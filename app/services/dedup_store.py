@@ -0,0 +1,116 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from sqlalchemy.exc import IntegrityError
+from ..models.database import ProcessedEvent, SessionLocal
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+
+class DedupStore:
+    """
+    事件/消息去重存储
+    内存层为 LRU + TTL，查询和写入均为 O(1)，容量有上限；
+    可选的数据库层（processed_events 表）让多个机器人进程以及重启前后共享去重结果
+    """
+
+    def __init__(self, max_size: int = None, ttl_seconds: int = None, use_db: bool = None):
+        self.max_size = max_size or int(os.getenv("DEDUP_MAX_SIZE", "10000"))
+        self.ttl_seconds = ttl_seconds or int(os.getenv("DEDUP_TTL_SECONDS", "86400"))
+        if use_db is None:
+            use_db = os.getenv("DEDUP_DB_ENABLED", "false").lower() in ("1", "true", "yes")
+        self.use_db = use_db
+        # 每写入多少条记录清理一次数据库中的过期记录
+        self.db_cleanup_interval = int(os.getenv("DEDUP_DB_CLEANUP_INTERVAL", "1000"))
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> 过期时间（monotonic）
+        self._db_writes = 0
+
+    def seen(self, key: str) -> bool:
+        """
+        检查并标记：key 已处理过返回 True，否则记录下来并返回 False
+        """
+        if not key:
+            return False
+
+        if self._check_and_mark_memory(key):
+            return True
+
+        if self.use_db and self._check_and_mark_db(key):
+            return True
+
+        return False
+
+    def _check_and_mark_memory(self, key: str) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            expires_at = self._entries.get(key)
+            if expires_at is not None:
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    return True
+                del self._entries[key]
+
+            self._entries[key] = now + self.ttl_seconds
+
+            # 先清理队首的过期记录，再按 LRU 淘汰，保证内存占用有上限
+            while self._entries:
+                oldest_key, oldest_expires = next(iter(self._entries.items()))
+                if oldest_expires > now and len(self._entries) <= self.max_size:
+                    break
+                self._entries.popitem(last=False)
+        return False
+
+    def _check_and_mark_db(self, key: str) -> bool:
+        """在共享表中插入记录，主键冲突说明其他进程或重启前已经处理过"""
+        db = SessionLocal()
+        try:
+            now = datetime.now()
+            db.add(ProcessedEvent(event_key=key, created_at=now))
+            try:
+                db.commit()
+            except IntegrityError:
+                db.rollback()
+                existing = db.get(ProcessedEvent, key)
+                if existing and existing.created_at > now - timedelta(seconds=self.ttl_seconds):
+                    logger.info(f"共享去重表中已存在记录: {key}")
+                    return True
+                # 记录已过期，视为新事件并刷新时间
+                if existing:
+                    existing.created_at = now
+                    db.commit()
+                return False
+
+            self._db_writes += 1
+            if self.db_cleanup_interval > 0 and self._db_writes % self.db_cleanup_interval == 0:
+                self._cleanup_db(db)
+            return False
+        except Exception as e:
+            # 数据库不可用时只依赖内存层，不影响消息处理
+            logger.error(f"去重表读写失败，仅使用内存去重: {str(e)}")
+            db.rollback()
+            return False
+        finally:
+            db.close()
+
+    def _cleanup_db(self, db):
+        """删除数据库中的过期记录"""
+        cutoff = datetime.now() - timedelta(seconds=self.ttl_seconds)
+        deleted = db.query(ProcessedEvent)\
+            .filter(ProcessedEvent.created_at < cutoff)\
+            .delete(synchronize_session=False)
+        db.commit()
+        logger.info(f"清理过期去重记录 {deleted} 条")
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+# 进程内共享的去重存储
+event_dedup = DedupStore()
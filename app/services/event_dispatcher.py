@@ -0,0 +1,200 @@
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Hashable
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+
+class EventDispatcher:
+    """
+    事件分发器
+    长连接回调线程只负责把事件放入有界队列，由工作线程池异步处理，
+    避免一次缓慢的 AI 调用阻塞后续所有消息
+
+    事件按 key（通常是 chat_id）分组：同一个 key 的事件严格按提交顺序串行执行，
+    不同 key 之间并行执行。每个 key 每次只执行一个事件后就重新排到就绪队列末尾，
+    因此消息很多的群不会饿死其他群
+    """
+
+    def __init__(self, handler: Callable[[Any], None], worker_count: int = None, queue_size: int = None):
+        """
+        :param handler: 处理单个事件的函数，在工作线程中执行
+        :param worker_count: 工作线程数，默认读取环境变量 EVENT_WORKER_COUNT
+        :param queue_size: 队列容量，默认读取环境变量 EVENT_QUEUE_SIZE
+        """
+        self.handler = handler
+        self.worker_count = worker_count or int(os.getenv("EVENT_WORKER_COUNT", "8"))
+        self.queue_size = queue_size or int(os.getenv("EVENT_QUEUE_SIZE", "500"))
+        self.stats_log_interval = int(os.getenv("EVENT_STATS_LOG_INTERVAL", "100"))
+
+        # key -> 待处理事件队列；_ready 中存放可以被执行的 key
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._pending_count = 0
+        self._ready = queue.Queue()
+        self.workers = []
+        self.running = False
+
+        # 统计信息
+        self._counters = {
+            'submitted': 0,
+            'rejected': 0,
+            'completed': 0,
+            'failed': 0,
+        }
+        self._max_queue_depth = 0
+        self._stage_stats = {}
+
+    def start(self):
+        """启动工作线程"""
+        if self.running:
+            logger.warning("事件分发器已经在运行中")
+            return
+
+        self.running = True
+        for i in range(self.worker_count):
+            worker = threading.Thread(
+                target=self._worker_loop,
+                name=f"event-worker-{i}",
+                daemon=True
+            )
+            worker.start()
+            self.workers.append(worker)
+        logger.info(f"事件分发器已启动，工作线程数: {self.worker_count}, 队列容量: {self.queue_size}")
+
+    def stop(self, timeout: float = 5):
+        """停止工作线程，等待队列中已有的事件处理完毕"""
+        if not self.running:
+            return
+
+        self.running = False
+        for _ in self.workers:
+            # 放入哨兵，唤醒阻塞在 get 上的工作线程
+            self._ready.put(None)
+        for worker in self.workers:
+            worker.join(timeout=timeout)
+        self.workers = []
+        logger.info("事件分发器已停止")
+
+    def submit(self, event: Any, key: Hashable = None) -> bool:
+        """
+        提交事件，立即返回
+        :param key: 顺序键，相同 key 的事件串行执行；为空时不限制顺序
+        队列已满时拒绝该事件并返回 False，不阻塞回调线程
+        """
+        if key is None:
+            key = object()
+
+        with self._lock:
+            if self._pending_count >= self.queue_size:
+                self._counters['rejected'] += 1
+                logger.error(f"事件队列已满（容量 {self.queue_size}），丢弃事件")
+                return False
+
+            tasks = self._pending.get(key)
+            is_new_key = tasks is None
+            if is_new_key:
+                tasks = self._pending[key] = deque()
+            tasks.append((time.monotonic(), event))
+            self._pending_count += 1
+            self._counters['submitted'] += 1
+            self._max_queue_depth = max(self._max_queue_depth, self._pending_count)
+
+        # 该 key 没有在排队或执行中时才放入就绪队列，保证同一 key 同时只有一个线程在处理
+        if is_new_key:
+            self._ready.put(key)
+        return True
+
+    def _worker_loop(self):
+        """工作线程主循环"""
+        while True:
+            key = self._ready.get()
+            if key is None:
+                return
+
+            with self._lock:
+                enqueued_at, event = self._pending[key].popleft()
+                self._pending_count -= 1
+            self.record_stage('queue_wait', time.monotonic() - enqueued_at)
+
+            try:
+                with self.stage('total'):
+                    self.handler(event)
+                self._incr('completed')
+            except Exception as e:
+                self._incr('failed')
+                logger.error(f"事件处理失败: {str(e)}", exc_info=True)
+            finally:
+                with self._lock:
+                    has_more = bool(self._pending[key])
+                    if not has_more:
+                        del self._pending[key]
+                # 同一 key 还有事件时排到就绪队列末尾，让其他 key 先执行
+                if has_more:
+                    self._ready.put(key)
+
+            self._maybe_log_stats()
+
+    @contextmanager
+    def stage(self, name: str):
+        """统计某个处理阶段的耗时"""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record_stage(name, time.monotonic() - started)
+
+    def record_stage(self, name: str, seconds: float):
+        """记录阶段耗时"""
+        with self._lock:
+            stat = self._stage_stats.setdefault(name, {'count': 0, 'total': 0.0, 'max': 0.0})
+            stat['count'] += 1
+            stat['total'] += seconds
+            stat['max'] = max(stat['max'], seconds)
+
+    def _incr(self, counter: str):
+        with self._lock:
+            self._counters[counter] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取队列深度和各阶段耗时统计（秒）"""
+        with self._lock:
+            stages = {
+                name: {
+                    'count': stat['count'],
+                    'avg': stat['total'] / stat['count'] if stat['count'] else 0.0,
+                    'max': stat['max'],
+                }
+                for name, stat in self._stage_stats.items()
+            }
+            return {
+                'queue_depth': self._pending_count,
+                'active_keys': len(self._pending),
+                'max_queue_depth': self._max_queue_depth,
+                'workers': self.worker_count,
+                **self._counters,
+                'stages': stages,
+            }
+
+    def _maybe_log_stats(self):
+        """每处理一定数量的事件输出一次统计信息"""
+        with self._lock:
+            processed = self._counters['completed'] + self._counters['failed']
+        if self.stats_log_interval > 0 and processed % self.stats_log_interval == 0:
+            stats = self.get_stats()
+            stage_text = ", ".join(
+                f"{name}: avg {stat['avg']:.3f}s / max {stat['max']:.3f}s"
+                for name, stat in stats['stages'].items()
+            )
+            logger.info(
+                f"事件分发统计 - 队列深度: {stats['queue_depth']} (峰值 {stats['max_queue_depth']}), "
+                f"活跃会话: {stats['active_keys']}, "
+                f"已提交: {stats['submitted']}, 已完成: {stats['completed']}, "
+                f"失败: {stats['failed']}, 拒绝: {stats['rejected']}; {stage_text}"
+            )
@@ -1,17 +1,190 @@
 import logging
 import re
-from typing import List, Dict, Any
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import List, Dict, Any, Callable, Iterator, Optional, Tuple
 from urllib.parse import urlparse, parse_qs
 import requests
 import os
 from dotenv import load_dotenv
 from datetime import datetime
+from .feishu_transport import feishu_transport
 
 # 加载环境变量
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+# 多维表记录分页大小（接口上限为 500）
+BITABLE_PAGE_SIZE = int(os.getenv("BITABLE_PAGE_SIZE", "500"))
+
+# 接龙多维表中的列名
+FIELD_ROLE = "您想做什么角色？"
+FIELD_NICKNAME = "您的姓名/昵称"
+FIELD_FOCUS_AREA = "您计划在活动中开发的项目名称"
+FIELD_INTRODUCTION = "项目简介（100 字以内）"
+FIELD_GOALS = "预期 21 天内要达成的目标！目标会在社群中公示哦，一起加油！"
+FIELD_SIGNUP_TIME = "提交时间"
+# 缺少时无法同步的列；其余列缺少时只记录警告
+REQUIRED_SIGNUP_FIELDS = (FIELD_ROLE, FIELD_NICKNAME)
+OPTIONAL_SIGNUP_FIELDS = (FIELD_FOCUS_AREA, FIELD_INTRODUCTION, FIELD_GOALS, FIELD_SIGNUP_TIME)
+
+
+class TenantTokenCache:
+    """
+    进程内共享的 tenant_access_token 缓存
+    按飞书返回的 expire 计算过期时间，并提前一段时间刷新；
+    同一个应用的并发刷新只会发出一次请求，其余线程等待并复用结果。
+    统计口径：misses 是真正发出刷新请求的次数（刷新成功时与 refreshes 相等），
+    等待别的线程刷新后直接复用令牌的记为 coalesced
+    """
+
+    def __init__(self, refresh_ahead_seconds: int = None):
+        self.refresh_ahead_seconds = refresh_ahead_seconds if refresh_ahead_seconds is not None \
+            else int(os.getenv("FEISHU_TOKEN_REFRESH_AHEAD", "300"))
+        self._lock = threading.Lock()
+        self._refresh_locks = {}  # app_id -> 刷新锁
+        self._entries = {}  # app_id -> (token, 过期时间 monotonic)
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.refreshes = 0
+
+    def _get_valid(self, app_id: str):
+        entry = self._entries.get(app_id)
+        if entry and entry[1] - self.refresh_ahead_seconds > time.monotonic():
+            return entry[0]
+        return None
+
+    def get_token(self, app_id: str, fetcher: Callable[[], Tuple[str, int]]) -> str:
+        """
+        获取访问令牌
+        :param fetcher: 请求新令牌的函数，返回 (token, expire秒数)
+        """
+        with self._lock:
+            token = self._get_valid(app_id)
+            if token:
+                self.hits += 1
+                return token
+            refresh_lock = self._refresh_locks.setdefault(app_id, threading.Lock())
+
+        # single-flight：只有拿到刷新锁的线程去请求，其他线程等待后直接读取新令牌
+        with refresh_lock:
+            with self._lock:
+                token = self._get_valid(app_id)
+                if token:
+                    self.coalesced += 1
+                    return token
+                self.misses += 1
+
+            token, expire = fetcher()
+            with self._lock:
+                self._entries[app_id] = (token, time.monotonic() + expire)
+                self.refreshes += 1
+            logger.info(f"已刷新访问令牌，有效期 {expire} 秒")
+            return token
+
+    def invalidate(self, app_id: str, token: str = None):
+        """
+        使缓存的令牌失效
+        传入 token 时只有缓存中仍是该令牌才失效，避免并发收到 401 时重复刷新
+        """
+        with self._lock:
+            entry = self._entries.get(app_id)
+            if entry and (token is None or entry[0] == token):
+                del self._entries[app_id]
+
+    def get_stats(self) -> Dict[str, int]:
+        """获取缓存命中统计"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'refreshes': self.refreshes,
+            }
+
+
+# 进程内共享的令牌缓存，所有 FeishuService 实例复用
+token_cache = TenantTokenCache()
+
+
+class BitableMetaCache:
+    """
+    多维表元数据缓存
+    按 base_id 缓存表格列表和各表字段结构，带 TTL，也可以显式失效，
+    重复同步时只需要请求记录接口
+    """
+
+    def __init__(self, ttl_seconds: int = None):
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None \
+            else int(os.getenv("BITABLE_META_TTL", "3600"))
+        self._lock = threading.Lock()
+        self._entries = {}  # (base_id, 类型, table_id) -> (数据, 过期时间 monotonic)
+
+    def get(self, base_id: str, kind: str, loader: Callable[[], Any], table_id: str = None) -> Any:
+        """读取缓存，未命中或已过期时调用 loader 加载"""
+        key = (base_id, kind, table_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[1] > time.monotonic():
+                return entry[0]
+
+        value = loader()
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl_seconds)
+        return value
+
+    def invalidate(self, base_id: str = None):
+        """使指定多维表（不传则全部）的元数据失效"""
+        with self._lock:
+            if base_id is None:
+                self._entries.clear()
+            else:
+                for key in [key for key in self._entries if key[0] == base_id]:
+                    del self._entries[key]
+
+
+# 进程内共享的多维表元数据缓存
+bitable_meta_cache = BitableMetaCache()
+
+
+@lru_cache(maxsize=128)
+def _parse_base_url(url: str) -> Tuple[str, str]:
+    """解析多维表链接，结果按URL缓存"""
+    parsed_url = urlparse(url)
+    path_parts = parsed_url.path.split('/')
+    query_params = parse_qs(parsed_url.query)
+
+    # 查找base_id（从路径中查找最后一个非空部分）
+    base_id = None
+    for part in reversed(path_parts):
+        if part and len(part) > 20:  # base_id 通常较长
+            base_id = part
+            break
+
+    if not base_id:
+        raise ValueError("未在URL中找到base_id")
+
+    # 从查询参数中获取table_id
+    table_id = query_params.get('table', [None])[0]
+    if not table_id:
+        # 如果URL中没有table参数，尝试从路径中查找
+        for part in path_parts:
+            if part.startswith('tbl'):
+                table_id = part
+                break
+
+        # 如果仍然没有找到，使用默认值
+        if not table_id:
+            table_id = 'tblzscrkKqRba5r6'  # 使用默认的table_id
+
+    logger.info(f"从URL中提取到 base_id: {base_id}, table_id: {table_id}")
+    logger.debug(f"URL解析结果 - 路径部分: {path_parts}, 查询参数: {query_params}")
+    return base_id, table_id
+
 
 class FeishuService:
     def __init__(self):
@@ -24,8 +197,15 @@ class FeishuService:
                 "未找到飞书配置信息，请检查环境变量 FEISHU_APP_ID 和 FEISHU_APP_SECRET")
         self.access_token = None
 
-    def get_access_token(self) -> str:
-        """获取飞书访问令牌"""
+    def get_access_token(self, force_refresh: bool = False) -> str:
+        """获取飞书访问令牌，优先使用进程内缓存"""
+        if force_refresh and self.access_token:
+            token_cache.invalidate(self.app_id, self.access_token)
+        self.access_token = token_cache.get_token(self.app_id, self._request_access_token)
+        return self.access_token
+
+    def _request_access_token(self) -> Tuple[str, int]:
+        """请求新的飞书访问令牌，返回 (token, expire秒数)"""
         try:
             url = "https://open.feishu.cn/open-apis/auth/v3/tenant_access_token/internal"
             headers = {
@@ -35,13 +215,12 @@ class FeishuService:
                 "app_id": self.app_id,
                 "app_secret": self.app_secret
             }
-            response = requests.post(url, headers=headers, json=data)
+            response = feishu_transport.post(url, headers=headers, json=data)
             response.raise_for_status()
             result = response.json()
 
             if result.get("code") == 0:
-                self.access_token = result.get("tenant_access_token")
-                return self.access_token
+                return result.get("tenant_access_token"), int(result.get("expire", 7200))
             else:
                 raise Exception(f"获取访问令牌失败: {result.get('msg')}")
         except Exception as e:
@@ -51,162 +230,202 @@ class FeishuService:
     def extract_base_info(self, url: str) -> tuple:
         """从URL中提取多维表的base_id和table_id"""
         try:
-            logger.info(f"开始解析URL: {url}")
-            parsed_url = urlparse(url)
-            path_parts = parsed_url.path.split('/')
-            query_params = parse_qs(parsed_url.query)
-
-            # 查找base_id（从路径中查找最后一个非空部分）
-            base_id = None
-            for part in reversed(path_parts):
-                if part and len(part) > 20:  # base_id 通常较长
-                    base_id = part
-                    break
-
-            if not base_id:
-                raise ValueError("未在URL中找到base_id")
-
-            # 从查询参数中获取table_id
-            table_id = query_params.get('table', [None])[0]
-            if not table_id:
-                # 如果URL中没有table参数，尝试从路径中查找
-                for part in path_parts:
-                    if part.startswith('tbl'):
-                        table_id = part
-                        break
-                
-                # 如果仍然没有找到，使用默认值
-                if not table_id:
-                    table_id = 'tblzscrkKqRba5r6'  # 使用默认的table_id
-            
-            logger.info(f"从URL中提取到 base_id: {base_id}, table_id: {table_id}")
-            logger.info(f"URL解析结果 - 路径部分: {path_parts}")
-            logger.info(f"URL解析结果 - 查询参数: {query_params}")
-
-            return base_id, table_id
+            return _parse_base_url(url)
         except Exception as e:
             logger.error(f"解析URL时发生错误: {str(e)}")
             logger.error(f"URL: {url}")
-            logger.error(f"解析后的URL对象: {parsed_url}")
             raise
 
     def fetch_signup_data(self, signup_link: str) -> List[Dict[str, Any]]:
         """获取接龙数据，适配新多维表结构，筛选开发者角色"""
+        signup_data = list(self.iter_signup_data(signup_link))
+        logger.info(f"成功处理 {len(signup_data)} 条报名数据")
+        return signup_data
+
+    def iter_signup_data(self, signup_link: str) -> Iterator[Dict[str, Any]]:
+        """逐条产出接龙数据（遍历所有分页），调用方可以边获取边入库"""
         try:
             logger.info(f"开始获取接龙数据，链接: {signup_link}")
 
-            if not self.access_token:
-                logger.info("获取新的访问令牌")
-                self.get_access_token()
-
-            logger.info(f"使用访问令牌: {self.access_token[:10]}...")
-
             base_id, _ = self.extract_base_info(signup_link)
             logger.info(f"提取到的 base_id: {base_id}")
 
-            # 首先获取多维表的表格列表
-            list_url = f"https://open.feishu.cn/open-apis/bitable/v1/apps/{base_id}/tables"
-            headers = {
-                "Authorization": f"Bearer {self.access_token}",
-                "Content-Type": "application/json"
-            }
-            
-            logger.info(f"获取表格列表，URL: {list_url}")
-            list_response = requests.get(list_url, headers=headers)
-            list_result = list_response.json()
-            
-            if list_result.get("code") != 0:
-                error_msg = f"获取表格列表失败: {list_result.get('msg')} (错误码: {list_result.get('code')})"
-                logger.error(error_msg)
-                raise Exception(error_msg)
-            
-            tables = list_result.get("data", {}).get("items", [])
-            if not tables:
-                error_msg = "未找到任何表格"
-                logger.error(error_msg)
-                raise Exception(error_msg)
-            
-            # 使用第一个表格的ID
-            table_id = tables[0].get("table_id")
-            logger.info(f"使用第一个表格的ID: {table_id}")
+            table_id = self.get_first_table_id(base_id)
+            self.check_signup_fields(base_id, table_id)
 
-            # 构建API URL
-            url = f"https://open.feishu.cn/open-apis/bitable/v1/apps/{base_id}/tables/{table_id}/records"
-            params = {"page_size": 100}
+            for record in self.iter_bitable_records(base_id, table_id):
+                signup = self._parse_signup_record(record)
+                if signup:
+                    logger.info(f"添加报名记录 - 昵称: {signup['nickname']}, 项目: {signup['focus_area']}, 目标: {signup['goals']}")
+                    yield signup
+        except Exception as e:
+            logger.error(f"获取接龙数据时发生错误: {str(e)}", exc_info=True)
+            raise
 
-            logger.info(f"准备请求URL: {url}")
-            logger.info(f"请求参数: {params}")
+    def get_first_table_id(self, base_id: str) -> str:
+        """获取多维表中第一个表格的ID"""
+        tables = self.list_tables(base_id)
+        if not tables:
+            error_msg = "未找到任何表格"
+            logger.error(error_msg)
+            raise Exception(error_msg)
 
-            try:
-                response = requests.get(url, headers=headers, params=params)
-                logger.info(f"API响应状态码: {response.status_code}")
-                response_text = response.text
-                logger.info(f"API响应内容: {response_text[:500]}...")
-
-                if not response.ok:
-                    logger.error(f"API请求失败: 状态码 {response.status_code}")
-                    logger.error(f"错误响应: {response_text}")
-                    if response.status_code in [401, 403]:
-                        logger.info("检测到认证错误，尝试重新获取访问令牌")
-                        self.access_token = None
-                        self.get_access_token()
-                        headers["Authorization"] = f"Bearer {self.access_token}"
-                        response = requests.get(url, headers=headers, params=params)
-                        logger.info(f"重试请求状态码: {response.status_code}")
-                        response_text = response.text
-
-                result = response.json()
-            except requests.exceptions.RequestException as e:
-                logger.error(f"发送请求时发生错误: {str(e)}")
-                raise
-            except ValueError as e:
-                logger.error(f"解析JSON响应时发生错误: {str(e)}")
-                logger.error(f"原始响应内容: {response_text}")
-                raise
+        # 使用第一个表格的ID
+        table_id = tables[0].get("table_id")
+        logger.info(f"使用第一个表格的ID: {table_id}")
+        return table_id
 
-            if result.get("code") == 0:
-                records = result.get("data", {}).get("items", [])
-                logger.info(f"获取到 {len(records)} 条记录")
-
-                signup_data = []
-                for record in records:
-                    fields = record.get("fields", {})
-                    # 筛选角色为开发者
-                    role = fields.get("您想做什么角色？", "")
-                    if "开发者" not in str(role):
-                        continue
-                    nickname = fields.get("您的姓名/昵称", "").strip()
-                    focus_area = fields.get("您计划在活动中开发的项目名称", "").strip()
-                    introduction = fields.get("项目简介（100 字以内）", "").strip()
-                    goals = fields.get("预期 21 天内要达成的目标！目标会在社群中公示哦，一起加油！", "").strip()
-                    signup_time = fields.get("提交时间")
-                    # 处理提交时间为datetime对象
-                    if signup_time:
-                        try:
-                            # 飞书多维表一般为ISO格式
-                            signup_time = datetime.fromisoformat(signup_time.replace('Z', '+00:00'))
-                        except Exception:
-                            signup_time = datetime.now()
-                    else:
-                        signup_time = datetime.now()
-                    signup_data.append({
-                        "nickname": nickname,
-                        "focus_area": focus_area,
-                        "introduction": introduction,
-                        "goals": goals,
-                        "signup_time": signup_time
-                    })
-                    logger.info(f"添加报名记录 - 昵称: {nickname}, 项目: {focus_area}, 目标: {goals}")
-                logger.info(f"成功处理 {len(signup_data)} 条报名数据")
-                return signup_data
-            else:
-                error_msg = f"获取数据失败: {result.get('msg')} (错误码: {result.get('code')})"
+    def check_signup_fields(self, base_id: str, table_id: str):
+        """
+        同步前按（缓存的）字段结构检查接龙表的列名
+        表单改了列名时记录会按空值解析，缺少必需列时直接报错，而不是静默同步出空数据
+        """
+        names = {field.get("field_name") for field in self.get_table_fields(base_id, table_id)}
+        missing = [name for name in REQUIRED_SIGNUP_FIELDS if name not in names]
+        if missing:
+            # 字段结构可能刚被修改，清掉缓存，下次同步重新获取
+            bitable_meta_cache.invalidate(base_id)
+            error_msg = f"接龙表缺少必需的列: {missing}"
+            logger.error(error_msg)
+            raise Exception(error_msg)
+        missing = [name for name in OPTIONAL_SIGNUP_FIELDS if name not in names]
+        if missing:
+            logger.warning(f"接龙表缺少以下列，对应内容将为空: {missing}")
+
+    def list_tables(self, base_id: str) -> List[Dict[str, Any]]:
+        """获取多维表的表格列表（带缓存）"""
+        return bitable_meta_cache.get(base_id, 'tables', lambda: self._list_all(
+            f"https://open.feishu.cn/open-apis/bitable/v1/apps/{base_id}/tables", "获取表格列表失败"
+        ))
+
+    def get_table_fields(self, base_id: str, table_id: str) -> List[Dict[str, Any]]:
+        """获取表格的字段结构（带缓存）"""
+        return bitable_meta_cache.get(base_id, 'fields', lambda: self._list_all(
+            f"https://open.feishu.cn/open-apis/bitable/v1/apps/{base_id}/tables/{table_id}/fields", "获取字段列表失败"
+        ), table_id=table_id)
+
+    def _list_all(self, url: str, error_prefix: str) -> List[Dict[str, Any]]:
+        """请求元数据列表接口并遍历所有分页"""
+        logger.info(f"获取多维表元数据，URL: {url}")
+        items = []
+        page_token = None
+        while True:
+            params = {"page_size": 100}
+            if page_token:
+                params["page_token"] = page_token
+            result = self._get_json(url, params=params)
+            if result.get("code") != 0:
+                error_msg = f"{error_prefix}: {result.get('msg')} (错误码: {result.get('code')})"
                 logger.error(error_msg)
                 raise Exception(error_msg)
-        except Exception as e:
-            logger.error(f"获取接龙数据时发生错误: {str(e)}", exc_info=True)
+            data = result.get("data") or {}
+            items.extend(data.get("items") or [])
+            if not data.get("has_more"):
+                return items
+            page_token = data.get("page_token")
+
+    def iter_bitable_records(self, base_id: str, table_id: str, page_size: int = None) -> Iterator[Dict[str, Any]]:
+        """
+        遍历多维表的所有记录（按 has_more/page_token 翻页）
+        处理当前页的同时在后台预取下一页
+        """
+        page_size = page_size or BITABLE_PAGE_SIZE
+        url = f"https://open.feishu.cn/open-apis/bitable/v1/apps/{base_id}/tables/{table_id}/records"
+        logger.info(f"准备请求URL: {url}, 每页 {page_size} 条")
+
+        total = 0
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="bitable-prefetch") as executor:
+            future = executor.submit(self._get_records_page, base_id, url, page_size, None)
+            while future:
+                data = future.result()
+                items = data.get("items") or []
+                page_token = data.get("page_token") if data.get("has_more") else None
+
+                # 先发出下一页请求，再交出当前页的记录
+                future = executor.submit(self._get_records_page, base_id, url, page_size, page_token) if page_token else None
+
+                total += len(items)
+                logger.info(f"获取到 {len(items)} 条记录（累计 {total} 条）")
+                for item in items:
+                    yield item
+
+    def _get_records_page(self, base_id: str, url: str, page_size: int, page_token: str = None) -> Dict[str, Any]:
+        """获取一页记录，返回响应中的 data 部分"""
+        params = {"page_size": page_size}
+        if page_token:
+            params["page_token"] = page_token
+
+        result = self._get_json(url, params=params)
+        if result.get("code") != 0:
+            # 表格可能已被删除或调整，清除缓存的元数据，下次同步重新获取
+            bitable_meta_cache.invalidate(base_id)
+            error_msg = f"获取数据失败: {result.get('msg')} (错误码: {result.get('code')})"
+            logger.error(error_msg)
+            raise Exception(error_msg)
+        return result.get("data") or {}
+
+    def _get_json(self, url: str, params: Dict[str, Any] = None) -> Dict[str, Any]:
+        """带访问令牌发送 GET 请求并解析 JSON，认证失败时刷新令牌重试一次"""
+        self.get_access_token()
+        headers = {
+            "Authorization": f"Bearer {self.access_token}",
+            "Content-Type": "application/json"
+        }
+
+        response_text = ""
+        try:
+            response = feishu_transport.get(url, headers=headers, params=params)
+            response_text = response.text
+
+            if not response.ok:
+                logger.error(f"API请求失败: 状态码 {response.status_code}")
+                logger.error(f"错误响应: {response_text}")
+                if response.status_code in [401, 403]:
+                    logger.info("检测到认证错误，尝试重新获取访问令牌")
+                    self.get_access_token(force_refresh=True)
+                    headers["Authorization"] = f"Bearer {self.access_token}"
+                    response = feishu_transport.get(url, headers=headers, params=params)
+                    logger.info(f"重试请求状态码: {response.status_code}")
+                    response_text = response.text
+
+            return response.json()
+        except requests.exceptions.RequestException as e:
+            logger.error(f"发送请求时发生错误: {str(e)}")
+            raise
+        except ValueError as e:
+            logger.error(f"解析JSON响应时发生错误: {str(e)}")
+            logger.error(f"原始响应内容: {response_text}")
             raise
 
+    def _parse_signup_record(self, record: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """把多维表记录转换为报名数据，非开发者角色返回 None"""
+        fields = record.get("fields", {})
+        # 筛选角色为开发者
+        role = fields.get(FIELD_ROLE, "")
+        if "开发者" not in str(role):
+            return None
+        nickname = fields.get(FIELD_NICKNAME, "").strip()
+        focus_area = fields.get(FIELD_FOCUS_AREA, "").strip()
+        introduction = fields.get(FIELD_INTRODUCTION, "").strip()
+        goals = fields.get(FIELD_GOALS, "").strip()
+        signup_time = fields.get(FIELD_SIGNUP_TIME)
+        # 处理提交时间为datetime对象
+        if signup_time:
+            try:
+                # 飞书多维表一般为ISO格式
+                signup_time = datetime.fromisoformat(signup_time.replace('Z', '+00:00'))
+            except Exception:
+                signup_time = datetime.now()
+        else:
+            signup_time = datetime.now()
+        return {
+            "nickname": nickname,
+            "focus_area": focus_area,
+            "introduction": introduction,
+            "goals": goals,
+            "signup_time": signup_time
+        }
+
     def get_chat_id_for_period(self, period_id):
         """
         获取指定活动期数的聊天群ID
@@ -0,0 +1,87 @@
+import logging
+import os
+import random
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+
+# 加载环境变量
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+class FeishuTransport:
+    """
+    飞书 OpenAPI 的共享 HTTP 传输层
+    复用连接池保持长连接，统一设置超时，
+    遇到 429/5xx 或网络错误时按指数退避 + 随机抖动重试，并遵循飞书返回的限流头
+    """
+
+    RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+    # 飞书限流时返回的重置时间头（秒），以及标准的 Retry-After
+    RATE_LIMIT_HEADERS = ("x-ogw-ratelimit-reset", "Retry-After")
+
+    def __init__(self):
+        self.pool_size = int(os.getenv("FEISHU_HTTP_POOL_SIZE", "10"))
+        self.connect_timeout = float(os.getenv("FEISHU_HTTP_CONNECT_TIMEOUT", "5"))
+        self.read_timeout = float(os.getenv("FEISHU_HTTP_READ_TIMEOUT", "15"))
+        self.max_retries = int(os.getenv("FEISHU_HTTP_MAX_RETRIES", "3"))
+        self.backoff_base = float(os.getenv("FEISHU_HTTP_BACKOFF_BASE", "0.5"))
+        self.backoff_max = float(os.getenv("FEISHU_HTTP_BACKOFF_MAX", "30"))
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """
+        发送请求，必要时重试
+        重试用尽后返回最后一次响应；网络错误重试用尽后抛出异常
+        """
+        kwargs.setdefault("timeout", (self.connect_timeout, self.read_timeout))
+
+        attempt = 0
+        while True:
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = self._backoff_delay(attempt)
+                logger.warning(f"请求 {url} 失败: {str(e)}，{delay:.2f} 秒后重试（第 {attempt + 1} 次）")
+            else:
+                if response.status_code not in self.RETRY_STATUS_CODES or attempt >= self.max_retries:
+                    return response
+                delay = self._retry_delay(attempt, response)
+                logger.warning(f"请求 {url} 返回状态码 {response.status_code}，{delay:.2f} 秒后重试（第 {attempt + 1} 次）")
+
+            time.sleep(delay)
+            attempt += 1
+
+    def _backoff_delay(self, attempt: int) -> float:
+        """指数退避 + 全抖动"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _retry_delay(self, attempt: int, response: requests.Response) -> float:
+        """优先使用限流头给出的等待时间，否则使用指数退避"""
+        for header in self.RATE_LIMIT_HEADERS:
+            value = response.headers.get(header)
+            if value:
+                try:
+                    return min(self.backoff_max, max(0.0, float(value))) + random.uniform(0, self.backoff_base)
+                except ValueError:
+                    continue
+        return self._backoff_delay(attempt)
+
+
+# 进程内共享的传输层，所有 FeishuService 实例复用同一个连接池
+feishu_transport = FeishuTransport()
@@ -0,0 +1,106 @@
+import logging
+import os
+import socket
+from datetime import date, datetime, timedelta
+from typing import Set
+from dotenv import load_dotenv
+from sqlalchemy import or_, and_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from ..models.database import JobRun
+
+load_dotenv()
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 失败的执行最多尝试的次数（含第一次）
+JOB_RUN_MAX_ATTEMPTS = int(os.getenv("JOB_RUN_MAX_ATTEMPTS", "3"))
+# 认领后超过这个时间仍未完成，视为认领进程已崩溃，其他进程可以重新认领（分钟）
+JOB_RUN_STALE_MINUTES = int(os.getenv("JOB_RUN_STALE_MINUTES", "30"))
+
+# 当前进程的标识
+OWNER = f"{socket.gethostname()}:{os.getpid()}"
+
+
+class JobLedger:
+    """
+    定时任务执行记录（job_runs 表），按 (任务名, 期数, 日期) 保证每次计划执行只做一次
+    多个进程同时到点时，靠唯一约束只有一个能认领成功；失败或认领后崩溃的执行可以被重新认领。
+    不提交事务，由调用方统一提交；claim 可能回滚会话，需在会话中第一个调用
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def claim(self, job_name: str, period_id: int, run_date: date) -> bool:
+        """认领一次执行，返回是否认领成功；已完成、正在被其他进程执行或失败次数过多时返回 False"""
+        try:
+            self.db.add(JobRun(
+                job_name=job_name,
+                period_id=period_id,
+                run_date=run_date,
+                status='running',
+                owner=OWNER,
+                attempts=1,
+                claimed_at=datetime.now()
+            ))
+            self.db.flush()
+            return True
+        except IntegrityError:
+            self.db.rollback()
+
+        # 已有记录：只有失败的、或认领后长时间没有完成的才能重新认领，条件更新保证只有一个进程成功
+        now = datetime.now()
+        retaken = self.db.query(JobRun)\
+            .filter(
+                JobRun.job_name == job_name,
+                JobRun.period_id == period_id,
+                JobRun.run_date == run_date,
+                JobRun.attempts < JOB_RUN_MAX_ATTEMPTS,
+                or_(
+                    JobRun.status == 'failed',
+                    and_(JobRun.status == 'running',
+                         JobRun.claimed_at < now - timedelta(minutes=JOB_RUN_STALE_MINUTES))
+                )
+            )\
+            .update({
+                JobRun.status: 'running',
+                JobRun.owner: OWNER,
+                JobRun.attempts: JobRun.attempts + 1,
+                JobRun.claimed_at: now,
+                JobRun.finished_at: None,
+            }, synchronize_session=False)
+        return retaken == 1
+
+    def complete(self, job_name: str, period_id: int, run_date: date):
+        """标记执行完成"""
+        self._finish(job_name, period_id, run_date, 'completed', None)
+
+    def fail(self, job_name: str, period_id: int, run_date: date, error: str):
+        """标记执行失败，之后的补跑可以重新认领"""
+        self._finish(job_name, period_id, run_date, 'failed', error[:2000])
+
+    def completed_dates(self, job_name: str, period_id: int) -> Set[date]:
+        """某个任务在某一期已完成（或已放弃重试）的日期，补跑时跳过"""
+        rows = self.db.query(JobRun.run_date)\
+            .filter(
+                JobRun.job_name == job_name,
+                JobRun.period_id == period_id,
+                or_(JobRun.status == 'completed', JobRun.attempts >= JOB_RUN_MAX_ATTEMPTS)
+            )
+        return {row.run_date for row in rows}
+
+    def _finish(self, job_name: str, period_id: int, run_date: date, status: str, error):
+        self.db.query(JobRun)\
+            .filter(
+                JobRun.job_name == job_name,
+                JobRun.period_id == period_id,
+                JobRun.run_date == run_date,
+                JobRun.owner == OWNER
+            )\
+            .update({
+                JobRun.status: status,
+                JobRun.finished_at: datetime.now(),
+                JobRun.error: error,
+            }, synchronize_session=False)
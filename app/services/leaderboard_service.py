@@ -0,0 +1,168 @@
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from sqlalchemy import func, or_, and_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from ..models.database import Signup, Checkin, LeaderboardEntry
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+
+class LeaderboardService:
+    """
+    物化的打卡排行榜（leaderboard 表）
+    每次打卡在同一个事务里更新对应的一行，排名按 (打卡次数降序, 报名ID升序)，
+    前N名只读该期的排行榜行（ix_leaderboard_rank 的 period_id 范围），个人名次是在该索引上
+    统计排在前面的行数，都不再扫描 checkins 表。
+    升级前已有的打卡由迁移 4 一次性建表，之后由每天的对账任务逐行校验。不提交事务，由调用方统一提交
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def record_checkin(self, signup: Signup, checkin: Checkin):
+        """在打卡事务中累加报名者的打卡次数，checkin 需已 flush 以获得 id"""
+        updated = self.db.query(LeaderboardEntry)\
+            .filter(LeaderboardEntry.signup_id == signup.id)\
+            .update({
+                LeaderboardEntry.checkin_count: LeaderboardEntry.checkin_count + 1,
+                LeaderboardEntry.last_checkin_date: checkin.checkin_date,
+                LeaderboardEntry.latest_checkin_id: checkin.id,
+                LeaderboardEntry.updated_at: datetime.now(),
+            }, synchronize_session=False)
+        if not updated:
+            # 排行榜中还没有这个人：按 checkins 表中的实际记录（含本次）建行，不丢失升级前的打卡
+            count, last_date = self.db.query(func.count(Checkin.id), func.max(Checkin.checkin_date))\
+                .filter(Checkin.signup_id == signup.id)\
+                .one()
+            self.db.add(LeaderboardEntry(
+                signup_id=signup.id,
+                period_id=signup.period_id,
+                nickname=signup.nickname,
+                checkin_count=count,
+                last_checkin_date=last_date,
+                latest_checkin_id=checkin.id
+            ))
+
+    def top(self, period_id: int, limit: int = 10) -> List[Dict[str, Any]]:
+        """获取前 limit 名（只包含有打卡记录的报名者）"""
+        entries = self.db.query(LeaderboardEntry)\
+            .filter(LeaderboardEntry.period_id == period_id)\
+            .order_by(LeaderboardEntry.checkin_count.desc(), LeaderboardEntry.signup_id)\
+            .limit(limit)\
+            .all()
+        return [
+            {
+                'rank': rank,
+                'signup_id': entry.signup_id,
+                'nickname': entry.nickname,
+                'checkin_count': entry.checkin_count,
+                'last_checkin_date': entry.last_checkin_date,
+            }
+            for rank, entry in enumerate(entries, 1)
+        ]
+
+    def rank_of(self, period_id: int, signup_id: int) -> Optional[int]:
+        """
+        获取某位报名者的名次，没有打卡记录时返回 None
+        名次 = 打卡次数更多、或次数相同但报名ID更小的行数 + 1，两个范围条件都落在 ix_leaderboard_rank 上
+        """
+        entry = self.db.query(LeaderboardEntry.period_id, LeaderboardEntry.checkin_count)\
+            .filter(LeaderboardEntry.signup_id == signup_id)\
+            .first()
+        if not entry or entry.period_id != period_id:
+            return None
+        ahead = self.db.query(func.count(LeaderboardEntry.signup_id))\
+            .filter(LeaderboardEntry.period_id == period_id)\
+            .filter(or_(
+                LeaderboardEntry.checkin_count > entry.checkin_count,
+                and_(
+                    LeaderboardEntry.checkin_count == entry.checkin_count,
+                    LeaderboardEntry.signup_id < signup_id
+                )
+            ))\
+            .scalar()
+        return ahead + 1
+
+    def rebuild(self, period_id: int) -> Dict[str, int]:
+        """
+        从 checkins 表重新计算某期的排行榜，用于 #排行榜重建 和每天的对账
+        逐行修复而不是整期删除重建：只更新、补充或删除不一致的行，更新和删除都以读到的旧值为条件，
+        读取之后才提交的打卡已经由 record_checkin 计入，条件不成立时保留该行，不会被旧的统计覆盖。
+        返回 total（有打卡的报名者数）和 mismatched（修复的行数）
+        """
+        before = {
+            row.signup_id: (row.checkin_count, row.last_checkin_date, row.latest_checkin_id)
+            for row in self.db.query(
+                LeaderboardEntry.signup_id,
+                LeaderboardEntry.checkin_count,
+                LeaderboardEntry.last_checkin_date,
+                LeaderboardEntry.latest_checkin_id
+            ).filter(LeaderboardEntry.period_id == period_id)
+        }
+        stats = self.db.query(
+            Signup.id.label('signup_id'),
+            Signup.nickname,
+            func.count(Checkin.id).label('checkin_count'),
+            func.max(Checkin.checkin_date).label('last_checkin_date'),
+            func.max(Checkin.id).label('latest_checkin_id')
+        )\
+            .join(Checkin, Checkin.signup_id == Signup.id)\
+            .filter(Signup.period_id == period_id)\
+            .group_by(Signup.id, Signup.nickname)\
+            .all()
+        after = {
+            row.signup_id: (row.checkin_count, row.last_checkin_date, row.latest_checkin_id)
+            for row in stats
+        }
+
+        fixed = 0
+        for row in stats:
+            expected = after[row.signup_id]
+            current = before.get(row.signup_id)
+            if current == expected:
+                continue
+            if current is None:
+                fixed += self._insert_missing(period_id, row)
+                continue
+            fixed += self._unchanged_since(row.signup_id, current).update({
+                LeaderboardEntry.checkin_count: row.checkin_count,
+                LeaderboardEntry.last_checkin_date: row.last_checkin_date,
+                LeaderboardEntry.latest_checkin_id: row.latest_checkin_id,
+                LeaderboardEntry.updated_at: datetime.now(),
+            }, synchronize_session=False)
+
+        # 排行榜里有、checkins 表里已经没有打卡的行
+        for signup_id in set(before) - set(after):
+            fixed += self._unchanged_since(signup_id, before[signup_id]).delete(synchronize_session=False)
+
+        logger.info(f"重建期数 {period_id} 的排行榜，共 {len(after)} 人，修复 {fixed} 行")
+        return {'total': len(after), 'mismatched': fixed}
+
+    def _unchanged_since(self, signup_id: int, snapshot):
+        """仍是读取时的打卡次数和最新打卡的行；期间有新打卡时条件不成立"""
+        checkin_count, _, latest_checkin_id = snapshot
+        return self.db.query(LeaderboardEntry)\
+            .filter(
+                LeaderboardEntry.signup_id == signup_id,
+                LeaderboardEntry.checkin_count == checkin_count,
+                LeaderboardEntry.latest_checkin_id == latest_checkin_id
+            )
+
+    def _insert_missing(self, period_id: int, row) -> int:
+        """补充缺失的行；期间打卡已经由 record_checkin 建行时跳过"""
+        try:
+            with self.db.begin_nested():
+                self.db.add(LeaderboardEntry(
+                    signup_id=row.signup_id,
+                    period_id=period_id,
+                    nickname=row.nickname,
+                    checkin_count=row.checkin_count,
+                    last_checkin_date=row.last_checkin_date,
+                    latest_checkin_id=row.latest_checkin_id
+                ))
+            return 1
+        except IntegrityError:
+            return 0
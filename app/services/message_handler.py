@@ -1,144 +1,119 @@
 import json
-import re
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from ..models.database import Period, Signup, Checkin, Certificate
-from .openai_service import generate_ai_feedback, generate_ai_response
+from ..models.database import Period, Signup, Checkin, Certificate, SessionLocal
+from .openai_service import generate_ai_feedback, generate_ai_response, stream_ai_response, schedule_progress_summary_update
 from .feishu_service import FeishuService
+from .dedup_store import event_dedup
+from .signup_sync import SignupSyncer
+from .ranking_service import RankingService, generate_progress_summaries, generate_final_praises
+from .leaderboard_service import LeaderboardService
+from .checkin_counters import CheckinCounterService
+from .period_cache import period_cache
+from .command_router import command_router, Route, CHECKIN_PATTERN, RANKING_PATTERN
 import os
 import requests
-import time
 import random
 
 # 配置日志
 logger = logging.getLogger(__name__)
 
+# @机器人 时是否流式回复：先发占位消息，再随着 AI 输出逐步编辑
+STREAM_MENTION_REPLIES = os.getenv("STREAM_MENTION_REPLIES", "true").lower() in ("1", "true", "yes")
+
+# 打卡反馈的发送方式：
+#   edit     - 先立即回复“打卡成功 第N/21次”，AI 反馈生成后编辑这条回复
+#   followup - 先立即回复“打卡成功 第N/21次”，AI 反馈生成后另发一条消息
+#   sync     - 等 AI 反馈生成后一次性回复
+CHECKIN_FEEDBACK_MODE = os.getenv("CHECKIN_FEEDBACK_MODE", "edit").lower()
+# 后台生成并送达 AI 回复的线程池：打卡反馈和 @机器人 的流式回复都在这里执行，
+# 不占用按会话分发的事件工作线程，也不持有事件的数据库会话
+_feedback_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("CHECKIN_FEEDBACK_WORKERS", "4")),
+    thread_name_prefix="checkin-feedback"
+)
+
 
 class MessageHandler:
-    def __init__(self, db: Session):
+    def __init__(self, db: Session, replier=None):
         self.db = db
         self.feishu_service = FeishuService()
-        self._processed_messages = set()  # 用于存储已处理的消息ID
+        # 绑定到当前消息事件的回复器（见 reply_service.EventReplier），需要自行发送回复时使用
+        self.replier = replier
 
-    def handle_message(self, message_content: str, chat_id: str, message_type: str = "text", message_id: str = None) -> str:
-        """处理接收到的消息"""
+    def handle_message(self, message_content: str, chat_id: str, message_type: str = "text", message_id: str = None,
+                       route: Route = None) -> str:
+        """处理接收到的消息；调用方已经路由过时可以直接传入 route"""
         logger.info(f"开始处理消息，类型: {message_type}, ID: {message_id}")
-        
-        # 如果消息ID存在且已处理过，则跳过
-        if message_id:
-            if message_id in self._processed_messages:
-                logger.info(f"消息 {message_id} 已经处理过，跳过")
-                return None
-            self._processed_messages.add(message_id)
-            
-            # 保持集合大小在合理范围内，避免内存泄漏
-            if len(self._processed_messages) > 1000:
-                self._processed_messages.clear()
 
-        logger.info(f"消息内容: {message_content}")
+        route = route or command_router.route(message_type, message_content)
+        if not route:
+            logger.info("不是命令消息，跳过")
+            return None
 
-        if message_type == "interactive":
-            try:
-                content_json = json.loads(message_content)
-                title = content_json.get("title", "").strip()
-                logger.info(f"处理 interactive 消息，标题: {title}")
-
-                # 检查是否为接龙消息
-                if title == "🌟本期目标制定":
-                    logger.info("检测到目标制定标题")
-                    elements = content_json.get("elements", [])
-                    logger.info(f"消息元素: {elements}")
-                    
-                    # 检查是否包含接龙说明文本和参与人数文本
-                    has_signup_text = False
-                    has_participants_text = False
-                    has_link = False
-                    
-                    # 遍历所有元素组
-                    for element_group in elements:
-                        if isinstance(element_group, list):
-                            # 检查每个元素组中的文本元素
-                            for element in element_group:
-                                if element.get("tag") == "text":
-                                    text = element.get("text", "")
-                                    # 检查接龙说明文本
-                                    if "修改群昵称" in text and "自我介绍" in text and "本期目标" in text:
-                                        has_signup_text = True
-                                        logger.info("找到接龙说明文本")
-                                    # 检查参与人数文本
-                                    elif "当前" in text and "人参加群接龙" in text:
-                                        has_participants_text = True
-                                        logger.info(f"找到参与人数文本: {text}")
-                                # 检查链接元素
-                                elif element.get("tag") == "a" and element.get("href"):
-                                    has_link = True
-                                    logger.info("找到链接元素")
-                    
-                    logger.info(f"检查结果 - 接龙说明: {has_signup_text}, 参与人数: {has_participants_text}, 链接: {has_link}")
-                    
-                    # 只有在有接龙说明、有链接但没有参与人数时才创建新期数
-                    if has_link and not has_participants_text:
-                        logger.info("检测到新接龙消息，开始创建新期数")
-                        return self.create_new_period(chat_id, message_content)
-                    else:
-                        if has_participants_text:
-                            logger.info("检测到参与接龙消息，不进行处理")
-                        else:
-                            logger.info("消息格式不符合要求")
-                        return None
+        # 如果消息ID存在且已处理过，则跳过
+        if message_id and event_dedup.seen(f"message:{message_id}"):
+            logger.info(f"消息 {message_id} 已经处理过，跳过")
+            return None
+
+        logger.info(f"消息内容: {message_content}，处理方法: {route.handler}")
+        handler = getattr(self, route.handler)
+        if route.with_text:
+            return handler(route.text, chat_id)
+        return handler(chat_id)
+
+    def handle_signup_card(self, message_content: str, chat_id: str) -> str:
+        """处理标题为“🌟本期目标制定”的接龙卡片，新接龙时创建新期数"""
+        try:
+            content_json = json.loads(message_content)
+            logger.info("检测到目标制定标题")
+            elements = content_json.get("elements", [])
+            logger.info(f"消息元素: {elements}")
+            
+            # 检查是否包含接龙说明文本和参与人数文本
+            has_signup_text = False
+            has_participants_text = False
+            has_link = False
+            
+            # 遍历所有元素组
+            for element_group in elements:
+                if isinstance(element_group, list):
+                    # 检查每个元素组中的文本元素
+                    for element in element_group:
+                        if element.get("tag") == "text":
+                            text = element.get("text", "")
+                            # 检查接龙说明文本
+                            if "修改群昵称" in text and "自我介绍" in text and "本期目标" in text:
+                                has_signup_text = True
+                                logger.info("找到接龙说明文本")
+                            # 检查参与人数文本
+                            elif "当前" in text and "人参加群接龙" in text:
+                                has_participants_text = True
+                                logger.info(f"找到参与人数文本: {text}")
+                        # 检查链接元素
+                        elif element.get("tag") == "a" and element.get("href"):
+                            has_link = True
+                            logger.info("找到链接元素")
+            
+            logger.info(f"检查结果 - 接龙说明: {has_signup_text}, 参与人数: {has_participants_text}, 链接: {has_link}")
+            
+            # 只有在有接龙说明、有链接但没有参与人数时才创建新期数
+            if has_link and not has_participants_text:
+                logger.info("检测到新接龙消息，开始创建新期数")
+                return self.create_new_period(chat_id, message_content)
+            else:
+                if has_participants_text:
+                    logger.info("检测到参与接龙消息，不进行处理")
                 else:
-                    logger.info(f"不是目标制定消息，标题为: {title}")
-
-            except json.JSONDecodeError as e:
-                logger.error(f"解析消息内容失败: {str(e)}")
+                    logger.info("消息格式不符合要求")
                 return None
-            except Exception as e:
-                logger.error(f"处理消息时发生错误: {str(e)}")
-                return None
-        elif message_type == "text":
-            try:
-                # 尝试解析JSON内容
-                content_json = json.loads(message_content)
-                text_content = content_json.get("text", "")
-                
-                # 检查是否包含@机器人的标记
-                if "@_user_" in text_content:
-                    return self.handle_mention(text_content, chat_id)
-                elif message_content.strip() == '#接龙结束':
-                    return self.handle_signup_end(chat_id)
-                elif message_content.strip() == '#活动结束':
-                    return self.handle_activity_end(chat_id)
-                elif message_content.strip() == '#打卡开始':
-                    return self.handle_checkin_start(chat_id)
-                elif message_content.startswith('#打卡'):
-                    return self.handle_checkin(message_content, chat_id)
-                # 添加处理排名指令代码
-                elif message_content.strip() in ['#3天打卡排名公布', '#7天打卡排名公布', '#14天打卡排名公布', '#21天打卡排名公布']:
-                    return self.handle_ranking_publish(message_content, chat_id)
-                elif message_content.strip() == '#最新打卡排名公布':
-                    return self.handle_ranking_publish_latest(chat_id)
-            except json.JSONDecodeError:
-                # 如果不是JSON格式，直接处理原始文本
-                message_text = message_content.strip()
-                # 检查是否是@消息
-                if message_text.startswith("@"):
-                    return self.handle_mention(message_content, chat_id)
-                # 检查其他指令
-                elif message_text == '#接龙结束':
-                    return self.handle_signup_end(chat_id)
-                elif message_text == '#活动结束':
-                    return self.handle_activity_end(chat_id)
-                elif message_text == '#打卡开始':
-                    return self.handle_checkin_start(chat_id)
-                elif message_text.startswith('#打卡'):
-                    return self.handle_checkin(message_content, chat_id)
-                # 添加处理排名指令代码
-                elif message_text in ['#3天打卡排名公布', '#7天打卡排名公布', '#14天打卡排名公布', '#21天打卡排名公布']:
-                    return self.handle_ranking_publish(message_content, chat_id)
-                elif message_text == '#最新打卡排名公布':
-                    return self.handle_ranking_publish_latest(chat_id)
-        return None
+
+        except Exception as e:
+            logger.error(f"处理消息时发生错误: {str(e)}")
+            return None
 
     def create_new_period(self, chat_id: str, message_content: str) -> str:
         """创建新的活动期数"""
@@ -205,6 +180,7 @@ class MessageHandler:
                 )
                 self.db.add(new_period)
                 self.db.commit()
+                period_cache.invalidate()
                 logger.info(f"成功创建新期数: {period_name}")
 
                 return "本期接龙已开启，请大家踊跃报名！"
@@ -242,64 +218,21 @@ class MessageHandler:
                 return error_msg
 
             try:
-                # 从飞书多维表获取数据（已适配新结构）
+                # 从飞书多维表逐页获取数据（已适配新结构），边获取边入库
                 logger.info(f"开始从多维表获取数据: {current_period.signup_link}")
-                signup_data = self.feishu_service.fetch_signup_data(current_period.signup_link)
-                
-                if not signup_data:
+                signup_data = self.feishu_service.iter_signup_data(current_period.signup_link)
+
+                # 与已有报名记录做增量同步，不再整期删除后重新插入
+                summary = SignupSyncer(self.db).sync(current_period.id, signup_data)
+
+                if summary['fetched'] == 0:
                     error_msg = "接龙结束失败：未获取到有效的报名数据"
                     logger.error(error_msg)
+                    self.db.rollback()
                     return error_msg
 
-                # 清除当前期数的所有报名记录
-                self.db.query(Signup)\
-                    .filter(Signup.period_id == current_period.id)\
-                    .delete()
-                logger.info(f"已清除期数 {current_period.period_name} 的现有报名记录")
-
-                # 处理并添加新的报名记录
-                success_count = 0
-                developers = []
-                for record in signup_data:
-                    try:
-                        # 直接取新结构字段
-                        nickname = record.get('nickname', '').strip()
-                        focus_area = record.get('focus_area', '未知').strip()
-                        introduction = record.get('introduction', '').strip()  # 现在为项目介绍
-                        goals = record.get('goals', '').strip()
-                        signup_time = record.get('signup_time', datetime.now())
-
-                        if not nickname:
-                            logger.warning("跳过空昵称的记录")
-                            continue
-
-                        logger.info(f"处理报名记录 - 昵称: {nickname}, 项目: {focus_area}")
-                        logger.info(f"项目介绍: {introduction}")
-                        logger.info(f"目标: {goals}")
-
-                        # 创建新的报名记录
-                        signup = Signup(
-                            period_id=current_period.id,
-                            nickname=nickname,
-                            focus_area=focus_area,
-                            introduction=introduction,  # 现在为项目介绍
-                            goals=goals,
-                            signup_time=signup_time
-                        )
-                        self.db.add(signup)
-                        success_count += 1
-                        
-                        # 收集开发者信息用于总结
-                        developers.append({
-                            'nickname': nickname,
-                            'focus_area': focus_area
-                        })
-                        
-                        logger.info(f"成功添加报名记录: {nickname}")
-                    except Exception as e:
-                        logger.error(f"处理报名记录时出错: {str(e)}")
-                        continue
-
+                developers = summary['developers']
+                success_count = len(developers)
                 if success_count == 0:
                     error_msg = "接龙结束失败：没有成功添加任何报名记录"
                     logger.error(error_msg)
@@ -309,8 +242,10 @@ class MessageHandler:
                 # 更新活动状态为已结束
                 current_period.status = '进行中'
                 self.db.commit()
+                # 期数状态和报名名单都变了
+                period_cache.invalidate()
                 logger.info(f"成功更新活动期数 {current_period.period_name} 状态为进行中")
-                logger.info(f"总共处理了 {success_count} 条报名记录")
+                logger.info(f"总共处理了 {success_count} 条报名记录（新增 {summary['inserted']}，更新 {summary['updated']}，未变化 {summary['unchanged']}）")
 
                 # 生成报名统计信息
                 total_signups = len(developers)
@@ -367,8 +302,7 @@ class MessageHandler:
         logger.info(f"开始处理打卡消息: {message_content}")
         
         # 解析打卡信息
-        pattern = r'#打卡\s+([\w-]+)\s+(.+)(?:\n|$)'
-        match = re.search(pattern, message_content)
+        match = CHECKIN_PATTERN.search(message_content)
 
         if not match:
             error_msg = "📝 打卡格式不正确\n正确格式：#打卡 昵称 工作内容\n示例：#打卡 张三 完成了登录功能的开发"
@@ -389,21 +323,15 @@ class MessageHandler:
             logger.info(f"打卡内容过长: {len(content)}字")
             return error_msg
 
-        # 获取当前活动期数
-        current_period = self.db.query(Period)\
-            .filter(Period.status == '进行中')\
-            .first()
+        # 获取当前活动期数和报名记录（进程内缓存，命中时不查库）
+        current_period = period_cache.get_period(self.db, '进行中')
 
         if not current_period:
             error_msg = "⚠️ 当前没有进行中的活动期数，请等待新的活动开始"
             logger.info("打卡失败：没有进行中的活动期数")
             return error_msg
 
-        # 查找用户报名记录
-        signup = self.db.query(Signup)\
-            .filter(Signup.period_id == current_period.id)\
-            .filter(Signup.nickname == nickname)\
-            .first()
+        signup = period_cache.get_signup(self.db, current_period.id, nickname)
 
         if not signup:
             error_msg = f"⚠️ 未找到昵称为 {nickname} 的报名记录\n请先完成接龙或检查昵称是否正确"
@@ -411,79 +339,80 @@ class MessageHandler:
             return error_msg
 
         try:
-            # 检查是否重复打卡
+            # 检查是否重复打卡：读缓存的最后打卡日期，并发或跨进程的重复由唯一约束兜底
             today = datetime.now().date()
-            existing_checkin = self.db.query(Checkin)\
-                .filter(Checkin.signup_id == signup.id)\
-                .filter(Checkin.checkin_date == today)\
-                .first()
-            
-            if existing_checkin:
+            if signup.last_checkin_date == today:
                 error_msg = "⚠️ 您今天已经打过卡了，明天再来吧！"
                 logger.info(f"打卡失败：重复打卡 - {nickname}")
                 return error_msg
 
-            # 获取用户所有打卡记录
-            user_checkins = self.db.query(Checkin)\
-                .filter(Checkin.signup_id == signup.id)\
-                .order_by(Checkin.checkin_date)\
-                .all()
-
             # 创建打卡记录
             logger.info(f"创建打卡记录 - 用户: {nickname}, 内容长度: {len(content)}")
             checkin = Checkin(
                 signup_id=signup.id,
                 nickname=nickname,
                 checkin_date=today,
-                content=content,
-                checkin_count=len(user_checkins) + 1
+                content=content
             )
             
             try:
                 self.db.add(checkin)
+                self.db.flush()
+                # 排行榜和报名记录上的打卡统计与打卡记录在同一事务中更新；
+                # 打卡次数取报名记录累加后的值，不用缓存快照里可能过时的计数
+                checkin_count = CheckinCounterService(self.db).record_checkin(signup.id, today)
+                checkin.checkin_count = checkin_count
+                LeaderboardService(self.db).record_checkin(signup, checkin)
                 self.db.commit()
-                logger.info(f"打卡记录添加成功 - 用户: {nickname}, 第 {len(user_checkins) + 1} 次打卡")
+                period_cache.record_checkin(current_period.id, nickname, today, checkin_count)
+                logger.info(f"打卡记录添加成功 - 用户: {nickname}, 第 {checkin_count} 次打卡")
+            except IntegrityError:
+                # (signup_id, checkin_date) 唯一约束：并发的重复打卡只有一条能写入；缓存的名单已过时
+                self.db.rollback()
+                period_cache.invalidate(current_period.id)
+                logger.info(f"打卡失败：重复打卡（唯一约束） - {nickname}")
+                return "⚠️ 您今天已经打过卡了，明天再来吧！"
             except Exception as db_error:
                 logger.error(f"数据库更新失败: {str(db_error)}")
                 self.db.rollback()
                 return "❌ 打卡失败，请稍后重试"
 
-            # 生成打卡反馈
+            # 综合目标：项目名称、项目介绍、本期目标
+            combined_goals = f"项目名称：{signup.focus_area}\n项目介绍：{signup.introduction}\n本期目标：{signup.goals}"
+
+            # 两阶段回复：打卡记录已提交，先确认打卡，AI 反馈在后台生成后再送达
+            if CHECKIN_FEEDBACK_MODE in ("edit", "followup") and self.replier:
+                message_id = self.replier.send(f"✨ 打卡成功！\n📝 第 {checkin_count}/21 次打卡")
+                _feedback_executor.submit(
+                    _deliver_checkin_feedback, self.replier, message_id,
+                    signup.id, nickname, combined_goals, content, checkin_count
+                )
+                return None
+
+            # 生成打卡反馈：不在这里重试，AI接口慢或不可用时由截止时间和熔断器快速降级
             try:
                 logger.info(f"开始生成AI反馈 - 用户: {nickname}")
-                retry_count = 3  # 最大重试次数
-                ai_feedback = None
                 
-                # 综合目标：项目名称、项目介绍、本期目标
-                combined_goals = f"项目名称：{signup.focus_area}\n项目介绍：{signup.introduction}\n本期目标：{signup.goals}"
-                
-                while retry_count > 0:
-                    try:
-                        ai_feedback = generate_ai_feedback(
-                            db=self.db,
-                            signup_id=signup.id,
-                            nickname=nickname,
-                            goals=combined_goals,
-                            content=content,
-                            checkin_count=len(user_checkins) + 1
-                        )
-                        if ai_feedback:
-                            break
-                    except Exception as e:
-                        logger.error(f"生成AI反馈失败 (还剩{retry_count-1}次重试): {str(e)}")
-                        retry_count -= 1
-                        if retry_count > 0:
-                            # 短暂等待后重试
-                            time.sleep(1)
+                ai_feedback = generate_ai_feedback(
+                    db=self.db,
+                    signup_id=signup.id,
+                    nickname=nickname,
+                    goals=combined_goals,
+                    content=content,
+                    checkin_count=checkin_count
+                )
                 
+                # 后台把本次打卡合并进进展摘要，后续提示词不再拼接完整历史
+                schedule_progress_summary_update(signup.id, content, checkin_count)
+
                 if ai_feedback:
                     return ai_feedback
                 else:
-                    return f"✨ 打卡成功！\n📝 第 {len(user_checkins) + 1}/21 次打卡\n\n继续加油，你的每一步进展都很棒！ 🌟"
+                    return f"✨ 打卡成功！\n📝 第 {checkin_count}/21 次打卡\n\n继续加油，你的每一步进展都很棒！ 🌟"
                 
             except Exception as ai_error:
                 logger.error(f"AI反馈生成失败: {str(ai_error)}")
-                return f"✨ 打卡成功！\n📝 第 {len(user_checkins) + 1}/21 次打卡\n\n继续加油，你的每一步进展都很棒！ 🌟"
+                return f"✨ 打卡成功！\n📝 第 {checkin_count}/21 次打卡\n\n继续加油，你的每一步进展都很棒！ 🌟"
             
         except Exception as e:
             error_msg = f"打卡失败：{str(e)}"
@@ -505,149 +434,50 @@ class MessageHandler:
                 return error_msg
 
             try:
-                # 获取所有报名记录
-                signups = self.db.query(Signup)\
-                    .filter(Signup.period_id == current_period.id)\
-                    .all()
+                # 证书依据排行榜的打卡次数，发放前先按打卡记录重建一次，保证与 checkins 表一致
+                LeaderboardService(self.db).rebuild(current_period.id)
+                # 一次查询取出所有报名者的打卡次数和最新打卡内容，按报名顺序处理保证结果稳定
+                developer_stats = RankingService(self.db).get_period_stats(current_period.id)
+                developer_stats.sort(key=lambda dev: dev['signup_id'])
+
+                # 并发生成每位开发者的AI表扬语，单条超时使用默认表扬语
+                praises = generate_final_praises(developer_stats)
+
+                # 一次取出本期已有的证书，统一更新或创建后在同一个事务中提交
+                existing_certs = {
+                    cert.nickname: cert
+                    for cert in self.db.query(Certificate).filter(Certificate.period_id == current_period.id)
+                }
 
-                # 收集每个开发者的打卡统计和成果
-                developer_stats = []
                 qualified_developers = []  # 达标开发者
-                
-                for signup in signups:
-                    # 获取该开发者的所有打卡记录
-                    checkins = self.db.query(Checkin)\
-                        .filter(Checkin.signup_id == signup.id)\
-                        .order_by(Checkin.checkin_date)\
-                        .all()
-                    
-                    checkin_count = len(checkins)
-                    
+                for dev, praise in zip(developer_stats, praises):
+                    dev['praise'] = praise
                     # 检查是否达标（7次有效打卡）
-                    is_qualified = checkin_count >= 7
-                    
-                    # 生成开发者的AI表扬语
-                    praise = ""
-                    if checkin_count > 0:
-                        retry_count = 3  # 最大重试次数
-                        while retry_count > 0:
-                            try:
-                                # 综合目标：项目名称、项目介绍、本期目标
-                                combined_goals = f"项目名称：{signup.focus_area}\n项目介绍：{signup.introduction}\n本期目标：{signup.goals}"
-                                # 使用最后一次打卡内容生成表扬
-                                latest_checkin = checkins[-1]
-                                praise = generate_ai_feedback(
-                                    db=self.db,
-                                    signup_id=signup.id,
-                                    nickname=signup.nickname,
-                                    goals=combined_goals,
-                                    content=latest_checkin.content,
-                                    checkin_count=checkin_count,
-                                    is_final=True  # 标记这是结束总结
-                                )
-                                if praise:
-                                    praise = praise.split('\n\n')[-1]  # 只取AI反馈部分
-                                    break
-                            except Exception as e:
-                                logger.error(f"生成AI表扬失败 (还剩{retry_count-1}次重试): {str(e)}")
-                                retry_count -= 1
-                                if retry_count == 0:
-                                    praise = "很棒的表现！期待下次再见！"  # 默认表扬语
-                    
-                    # 构建更详细的证书内容，侧重分析而非简单拼接
-                    if checkin_count > 0:
-                        # 分析用户的目标和进展
-                        progress_percentage = (checkin_count/21*100)
-                        
-                        # 构建更有深度的证书内容
-                        if "前端" in signup.focus_area.lower() or "web" in signup.focus_area.lower():
-                            tech_area = "Web开发领域"
-                        elif "后端" in signup.focus_area.lower() or "java" in signup.focus_area.lower() or "python" in signup.focus_area.lower():
-                            tech_area = "后端开发领域"
-                        elif "运营" in signup.focus_area.lower() or "营销" in signup.focus_area.lower():
-                            tech_area = "运营领域"
-                        elif "设计" in signup.focus_area.lower() or "ui" in signup.focus_area.lower():
-                            tech_area = "设计领域"
-                        elif "算法" in signup.focus_area.lower() or "ai" in signup.focus_area.lower() or "数据" in signup.focus_area.lower():
-                            tech_area = "数据与AI领域"
-                        else:
-                            tech_area = "技术领域"
-                            
-                        # 构建证书内容
-                        cer_content = f"在为期21天的{current_period.period_name}学习活动中，{signup.nickname}在{tech_area}展现出了非凡的学习热情与专注度。"
-                        
-                        # 根据打卡次数生成不同评价
-                        if checkin_count >= 14:
-                            cer_content += f"完成了{checkin_count}/21次打卡，展现出卓越的坚持力与执行力，"
-                        elif checkin_count >= 7:
-                            cer_content += f"完成了{checkin_count}/21次打卡，表现出良好的学习习惯与自律精神，"
-                        else:
-                            cer_content += f"完成了{checkin_count}/21次打卡，迈出了技术成长的重要一步，"
-                        
-                        # 分析用户目标类型
-                        goal_keywords = f"{signup.focus_area} {signup.introduction} {signup.goals}".lower()
-                        if "学习" in goal_keywords or "掌握" in goal_keywords or "了解" in goal_keywords:
-                            goal_type = "技能提升"
-                        elif "开发" in goal_keywords or "完成" in goal_keywords or "实现" in goal_keywords:
-                            goal_type = "项目攻坚"
-                        elif "优化" in goal_keywords or "改进" in goal_keywords:
-                            goal_type = "系统优化"
-                        else:
-                            goal_type = "能力拓展"
-                            
-                        # 继续构建内容
-                        cer_content += f"在{goal_type}方面取得了实质性进展。"
-                        
-                        # 添加AI评语，但不单独标记为"导师评语"
-                        cer_content += f"\n\n{praise}"
-                        
-                        # 达标状态，不提及百分比
-                        if checkin_count >= 7:
-                            cer_content += f"\n\n🏆 恭喜达成本期活动达标要求！你的坚持与成长令人钦佩，期待未来技术之路上继续看到你的身影！"
-                        else:
-                            cer_content += f"\n\n💪 你已迈出了重要的几步！每一次打卡都是成长的见证，期待下一期活动中你的精彩表现！"
-                    else:
-                        cer_content = f"{current_period.period_name}活动期间，{signup.nickname}在{signup.focus_area}领域展现了学习的热情，"
-                        cer_content += "虽然尚未开始打卡记录，但技术成长是一场长期的马拉松。期待在下一次活动中，看到你的精彩表现与持续进步！"
+                    dev['is_qualified'] = dev['checkin_count'] >= 7
+                    cer_content = self._build_certificate_content(current_period.period_name, dev, praise)
 
                     # 存储证书数据
-                    try:
-                        # 先检查是否已存在
-                        existing_cert = self.db.query(Certificate).filter(
-                            Certificate.period_id == current_period.id,
-                            Certificate.nickname == signup.nickname
-                        ).first()
-                        
-                        if existing_cert:
-                            # 更新现有记录
-                            existing_cert.cer_content = cer_content
-                            logger.info(f"更新证书数据 - 用户: {signup.nickname}")
-                        else:
-                            # 创建新记录
-                            certificate = Certificate(
-                                period_id=current_period.id,
-                                nickname=signup.nickname,
-                                cer_content=cer_content
-                            )
-                            self.db.add(certificate)
-                            logger.info(f"创建证书数据 - 用户: {signup.nickname}")
-                    except Exception as cert_error:
-                        logger.error(f"存储证书数据失败: {str(cert_error)}", exc_info=True)
-                            
-                    developer_stats.append({
-                        'nickname': signup.nickname,
-                        'focus_area': signup.focus_area,
-                        'checkin_count': checkin_count,
-                        'is_qualified': is_qualified,
-                        'praise': praise
-                    })
-                    
-                    if is_qualified:
-                        qualified_developers.append(signup.nickname)
+                    existing_cert = existing_certs.get(dev['nickname'])
+                    if existing_cert:
+                        # 更新现有记录
+                        existing_cert.cer_content = cer_content
+                        logger.info(f"更新证书数据 - 用户: {dev['nickname']}")
+                    else:
+                        # 创建新记录
+                        self.db.add(Certificate(
+                            period_id=current_period.id,
+                            nickname=dev['nickname'],
+                            cer_content=cer_content
+                        ))
+                        logger.info(f"创建证书数据 - 用户: {dev['nickname']}")
+
+                    if dev['is_qualified']:
+                        qualified_developers.append(dev['nickname'])
 
                 # 更新活动状态为已结束
                 current_period.status = '已结束'
                 self.db.commit()
+                period_cache.invalidate()
                 logger.info(f"成功更新活动期数 {current_period.period_name} 状态为已结束")
 
                 # 构建响应消息
@@ -714,6 +544,67 @@ class MessageHandler:
             logger.error(f"处理活动结束时出错: {str(e)}")
             raise e
 
+    def _build_certificate_content(self, period_name: str, dev: dict, praise: str) -> str:
+        """根据打卡统计和AI表扬语构建证书内容"""
+        nickname = dev['nickname']
+        focus_area = dev['focus_area'] or ''
+        checkin_count = dev['checkin_count']
+
+        # 构建更详细的证书内容，侧重分析而非简单拼接
+        if checkin_count > 0:
+            # 构建更有深度的证书内容
+            if "前端" in focus_area.lower() or "web" in focus_area.lower():
+                tech_area = "Web开发领域"
+            elif "后端" in focus_area.lower() or "java" in focus_area.lower() or "python" in focus_area.lower():
+                tech_area = "后端开发领域"
+            elif "运营" in focus_area.lower() or "营销" in focus_area.lower():
+                tech_area = "运营领域"
+            elif "设计" in focus_area.lower() or "ui" in focus_area.lower():
+                tech_area = "设计领域"
+            elif "算法" in focus_area.lower() or "ai" in focus_area.lower() or "数据" in focus_area.lower():
+                tech_area = "数据与AI领域"
+            else:
+                tech_area = "技术领域"
+                
+            # 构建证书内容
+            cer_content = f"在为期21天的{period_name}学习活动中，{nickname}在{tech_area}展现出了非凡的学习热情与专注度。"
+            
+            # 根据打卡次数生成不同评价
+            if checkin_count >= 14:
+                cer_content += f"完成了{checkin_count}/21次打卡，展现出卓越的坚持力与执行力，"
+            elif checkin_count >= 7:
+                cer_content += f"完成了{checkin_count}/21次打卡，表现出良好的学习习惯与自律精神，"
+            else:
+                cer_content += f"完成了{checkin_count}/21次打卡，迈出了技术成长的重要一步，"
+            
+            # 分析用户目标类型
+            goal_keywords = f"{dev['focus_area']} {dev['introduction']} {dev['goals']}".lower()
+            if "学习" in goal_keywords or "掌握" in goal_keywords or "了解" in goal_keywords:
+                goal_type = "技能提升"
+            elif "开发" in goal_keywords or "完成" in goal_keywords or "实现" in goal_keywords:
+                goal_type = "项目攻坚"
+            elif "优化" in goal_keywords or "改进" in goal_keywords:
+                goal_type = "系统优化"
+            else:
+                goal_type = "能力拓展"
+                
+            # 继续构建内容
+            cer_content += f"在{goal_type}方面取得了实质性进展。"
+            
+            # 添加AI评语，但不单独标记为"导师评语"
+            cer_content += f"\n\n{praise}"
+            
+            # 达标状态，不提及百分比
+            if checkin_count >= 7:
+                cer_content += f"\n\n🏆 恭喜达成本期活动达标要求！你的坚持与成长令人钦佩，期待未来技术之路上继续看到你的身影！"
+            else:
+                cer_content += f"\n\n💪 你已迈出了重要的几步！每一次打卡都是成长的见证，期待下一期活动中你的精彩表现！"
+        else:
+            cer_content = f"{period_name}活动期间，{nickname}在{dev['focus_area']}领域展现了学习的热情，"
+            cer_content += "虽然尚未开始打卡记录，但技术成长是一场长期的马拉松。期待在下一次活动中，看到你的精彩表现与持续进步！"
+
+        return cer_content
+
     def handle_mention(self, message_content: str, chat_id: str) -> str:
         """处理@机器人的消息"""
         try:
@@ -741,6 +632,11 @@ class MessageHandler:
             
             logger.info(f"提取的实际内容: {actual_content}")
             
+            # 流式回复：交给后台线程，事件处理立即返回并释放数据库会话；消息由回复器直接发出，不再返回内容
+            if STREAM_MENTION_REPLIES and self.replier:
+                _feedback_executor.submit(_stream_mention_reply, self.replier, actual_content, self._mention_fallback)
+                return None
+
             # 使用DeepSeek API生成回复
             ai_response = generate_ai_response(actual_content)
             if ai_response:
@@ -748,106 +644,59 @@ class MessageHandler:
                 return ai_response
             else:
                 # 如果AI生成失败，使用预设回复
-                responses = [
-                    f"你好呀！有什么我能帮到你的吗？😊",
-                    f"嗨！我已经准备好为你服务啦！有什么需要帮忙的？✨",
-                    f"很高兴收到你的消息！请问有什么我可以协助你的？🌟"
-                ]
-                response = random.choice(responses)
-                
-                # 添加结束语，增加热情度
-                endings = [
-                    "如果还有其他问题，随时告诉我哦！",
-                    "希望我的回答对你有所帮助！",
-                    "期待与你有更多的交流！"
-                ]
-                response += f"\n\n{random.choice(endings)} 😄"
-                
-                logger.info(f"生成回复: {response}")
-                return response
+                return self._mention_fallback()
             
         except Exception as e:
             logger.error(f"处理@消息失败: {str(e)}", exc_info=True)
             return "抱歉，我好像遇到了点小问题，但我很乐意继续为你服务！请再试一次或换个方式提问吧！🙏"
 
+    def _mention_fallback(self) -> str:
+        """AI生成失败时的预设回复"""
+        responses = [
+            f"你好呀！有什么我能帮到你的吗？😊",
+            f"嗨！我已经准备好为你服务啦！有什么需要帮忙的？✨",
+            f"很高兴收到你的消息！请问有什么我可以协助你的？🌟"
+        ]
+        response = random.choice(responses)
+        
+        # 添加结束语，增加热情度
+        endings = [
+            "如果还有其他问题，随时告诉我哦！",
+            "希望我的回答对你有所帮助！",
+            "期待与你有更多的交流！"
+        ]
+        response += f"\n\n{random.choice(endings)} 😄"
+        
+        logger.info(f"生成回复: {response}")
+        return response
+
     def handle_ranking_publish(self, message_content: str, chat_id: str) -> str:
         """处理打卡排名公布请求"""
         try:
             logger.info(f"开始处理打卡排名公布请求: {message_content}")
             
             # 提取天数
-            days = None
-            if message_content.strip() in ['#3天打卡排名公布', '#7天打卡排名公布', '#14天打卡排名公布', '#21天打卡排名公布']:
-                days = int(message_content.strip().lstrip('#').split('天')[0])
-            else:
-                import re
-                match = re.match(r'#(\d+)天打卡排名公布', message_content.strip())
-                if match:
-                    days = int(match.group(1))
+            match = RANKING_PATTERN.match(message_content.strip())
+            days = int(match.group(1)) if match else None
             
             if not days:
                 return "排名公布失败：无效的天数"
             
             # 获取当前进行中的活动期数
-            current_period = self.db.query(Period)\
-                .filter(Period.status == '进行中')\
-                .first()
+            current_period = period_cache.get_period(self.db, '进行中')
                 
             if not current_period:
                 error_msg = "排名公布失败：没有正在进行的活动"
                 logger.info(error_msg)
                 return error_msg
                 
-            # 获取该期所有开发者的报名记录
-            signups = self.db.query(Signup)\
-                .filter(Signup.period_id == current_period.id)\
-                .all()
-                
-            # 收集每个开发者的打卡统计
-            developer_stats = []
-            
-            for signup in signups:
-                # 获取该开发者的所有打卡记录数量
-                checkin_count = self.db.query(Checkin)\
-                    .filter(Checkin.signup_id == signup.id)\
-                    .count()
-                # 获取开发者的最新打卡记录
-                latest_checkin = self.db.query(Checkin)\
-                    .filter(Checkin.signup_id == signup.id)\
-                    .order_by(Checkin.checkin_date.desc())\
-                    .first()
-                goal_feedback = "目标推进中"
-                if latest_checkin and checkin_count > 0:
-                    try:
-                        # 生成目标进度反馈，综合目标和打卡内容
-                        combined_goals = f"项目名称：{signup.focus_area}\n项目介绍：{signup.introduction}\n本期目标：{signup.goals}"
-                        feedback = generate_ai_feedback(
-                            db=self.db,
-                            signup_id=signup.id,
-                            nickname=signup.nickname,
-                            goals=combined_goals,
-                            content=latest_checkin.content,
-                            checkin_count=checkin_count,
-                            is_final=False,
-                            is_ranking=True
-                        )
-                        if feedback:
-                            goal_feedback = feedback.split('\n\n')[-1].strip()
-                        else:
-                            goal_feedback = "目标推进中"
-                    except Exception as e:
-                        logger.error(f"生成目标进度反馈失败: {str(e)}")
-                        goal_feedback = "目标推进中"
-                developer_stats.append({
-                    'nickname': signup.nickname,
-                    'focus_area': signup.focus_area,
-                    'checkin_count': checkin_count,
-                    'goal_feedback': goal_feedback
-                })
-                
-            # 按打卡次数排序（降序）
-            developer_stats.sort(key=lambda x: x['checkin_count'], reverse=True)
-            
+            # 从排行榜读取有打卡记录的前10名（已按打卡次数降序排列）
+            displayed = RankingService(self.db).get_top_stats(current_period.id, 10)
+
+            # 只为实际展示的前10名中的前5名并发生成目标进度简报
+            for dev, feedback in zip(displayed[:5], generate_progress_summaries(displayed[:5])):
+                dev['goal_feedback'] = feedback
+
             # 生成排名消息
             message_lines = [
                 f"✨ {current_period.period_name}期活动第{days}天打卡排行榜",
@@ -855,15 +704,11 @@ class MessageHandler:
             ]
             
             # 添加排名信息
-            top_count = 0
-            for i, dev in enumerate(developer_stats):
-                if i < 10 and dev['checkin_count'] > 0:
-                    message_lines.append(f"{i+1}. {dev['nickname']} ({dev['focus_area']}) - {dev['checkin_count']}次打卡")
-                    if i < 5 and dev['goal_feedback']:
-                        message_lines.append(f"   目标进度: {dev['goal_feedback']}")
-                    top_count += 1
-                else:
-                    break
+            top_count = len(displayed)
+            for i, dev in enumerate(displayed):
+                message_lines.append(f"{i+1}. {dev['nickname']} ({dev['focus_area']}) - {dev['checkin_count']}次打卡")
+                if i < 5 and dev.get('goal_feedback'):
+                    message_lines.append(f"   目标进度: {dev['goal_feedback']}")
             
             # 激励与表扬内容
             if top_count > 0:
@@ -891,9 +736,7 @@ class MessageHandler:
             logger.info("开始处理打卡开始指令")
             
             # 获取当前进行中的活动期数
-            current_period = self.db.query(Period)\
-                .filter(Period.status == '进行中')\
-                .first()
+            current_period = period_cache.get_period(self.db, '进行中')
                 
             if not current_period:
                 error_msg = "打卡开始失败：没有正在进行的活动期数"
@@ -987,9 +830,7 @@ class MessageHandler:
         try:
             logger.info("开始处理#最新打卡排名公布请求")
             # 获取当前进行中的活动期数
-            current_period = self.db.query(Period)\
-                .filter(Period.status == '进行中')\
-                .first()
+            current_period = period_cache.get_period(self.db, '进行中')
             if not current_period:
                 error_msg = "排名公布失败：没有正在进行的活动"
                 logger.info(error_msg)
@@ -1004,3 +845,68 @@ class MessageHandler:
             error_msg = f"最新排名公布失败：{str(e)}"
             logger.error(error_msg, exc_info=True)
             return "❌ 最新排名公布失败，请稍后重试或联系管理员"
+
+    def handle_leaderboard_rebuild(self, chat_id: str) -> str:
+        """从打卡记录重建当前期数的排行榜，并报告与重建前不一致的行数"""
+        try:
+            current_period = period_cache.get_period(self.db, '进行中')
+            if not current_period:
+                return "⚠️ 当前没有进行中的活动期数"
+
+            result = LeaderboardService(self.db).rebuild(current_period.id)
+            self.db.commit()
+            return (
+                f"✅ 已重建 {current_period.period_name} 期排行榜\n"
+                f"👥 有打卡记录的人数：{result['total']}\n"
+                f"🔍 与重建前不一致：{result['mismatched']} 行"
+            )
+        except Exception as e:
+            logger.error(f"重建排行榜失败: {str(e)}", exc_info=True)
+            self.db.rollback()
+            return "❌ 重建排行榜失败，请稍后重试"
+
+
+def _stream_mention_reply(replier, query: str, fallback):
+    """在后台线程中流式生成 @机器人 的回复，不访问数据库"""
+    try:
+        ai_response = replier.stream(stream_ai_response(query), fallback=fallback)
+        logger.info(f"AI流式回复: {ai_response}")
+    except Exception as e:
+        logger.error(f"流式回复失败: {str(e)}", exc_info=True)
+
+
+def _deliver_checkin_feedback(replier, message_id: str, signup_id: int, nickname: str, goals: str,
+                              content: str, checkin_count: int):
+    """
+    在后台线程中生成打卡的 AI 反馈并送达，使用独立的数据库会话
+    edit 模式编辑之前的确认回复（确认回复发送失败时改为新发一条），followup 模式只另发 AI 反馈部分
+    """
+    logger.info(f"后台生成AI反馈 - 用户: {nickname}")
+    db = SessionLocal()
+    try:
+        feedback = generate_ai_feedback(
+            db=db,
+            signup_id=signup_id,
+            nickname=nickname,
+            goals=goals,
+            content=content,
+            checkin_count=checkin_count
+        )
+    except Exception as e:
+        logger.error(f"AI反馈生成失败: {str(e)}", exc_info=True)
+        feedback = None
+    finally:
+        db.close()
+
+    # 后台把本次打卡合并进进展摘要，后续提示词不再拼接完整历史
+    schedule_progress_summary_update(signup_id, content, checkin_count)
+
+    if not feedback:
+        feedback = f"✨ 打卡成功！\n📝 第 {checkin_count}/21 次打卡\n\n继续加油，你的每一步进展都很棒！ 🌟"
+    try:
+        if CHECKIN_FEEDBACK_MODE == "followup":
+            replier.send(feedback.split('\n\n')[-1])
+        elif not message_id or not replier.update(message_id, feedback):
+            replier.send(feedback)
+    except Exception as e:
+        logger.error(f"发送AI反馈失败: {str(e)}", exc_info=True)
@@ -1,46 +1,438 @@
 from dotenv import load_dotenv
 import os
+import asyncio
+import importlib.util
 import httpx
 import json
+import hashlib
 import logging
-from typing import List
-from app.models.database import Signup, Checkin
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Iterator, List, Optional
+from app.models.database import Signup, Checkin, LLMResponseCacheEntry, SessionLocal
+from app.utils.concurrency import BackgroundEventLoop
+from app.utils.circuit_breaker import CircuitBreaker, CircuitOpenError
+from app.services.prompt_budget import estimate_tokens, get_budget, truncate_to_tokens, fit_history, token_usage
 from sqlalchemy.orm import Session
 
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
-# 创建自定义的 httpx 客户端
-http_client = httpx.Client(
-    timeout=30.0
-)
+# 异步 httpx 客户端的连接池配置，安装了 h2 时启用 HTTP/2
+LLM_HTTP_TIMEOUT = float(os.getenv("LLM_HTTP_TIMEOUT", "30"))
+LLM_HTTP_MAX_CONNECTIONS = int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", "20"))
+LLM_HTTP_MAX_KEEPALIVE = int(os.getenv("LLM_HTTP_MAX_KEEPALIVE", "10"))
+LLM_HTTP2 = importlib.util.find_spec("h2") is not None
+
+# 单次AI请求（含连接、等待和读取）的端到端截止时间（秒）
+LLM_REQUEST_DEADLINE = float(os.getenv("LLM_REQUEST_DEADLINE", "15"))
+
+
+def _new_breaker(name: str) -> CircuitBreaker:
+    return CircuitBreaker(
+        name,
+        window_size=int(os.getenv("LLM_BREAKER_WINDOW", "20")),
+        min_calls=int(os.getenv("LLM_BREAKER_MIN_CALLS", "5")),
+        failure_rate=float(os.getenv("LLM_BREAKER_FAILURE_RATE", "0.5")),
+        slow_call_seconds=float(os.getenv("LLM_BREAKER_SLOW_SECONDS", "10")),
+        slow_call_rate=float(os.getenv("LLM_BREAKER_SLOW_RATE", "0.5")),
+        open_seconds=float(os.getenv("LLM_BREAKER_OPEN_SECONDS", "30"))
+    )
+
+
+# AI接口熔断器：失败率或慢调用率过高时打开，打开期间直接使用降级文案
+llm_breaker = _new_breaker("deepseek")
+# 后台进展摘要使用独立的熔断器，摘要请求的失败和慢调用不会让用户可见的打卡反馈熔断
+summary_breaker = _new_breaker("deepseek-summary")
+
+# 所有LLM请求都在这个后台事件循环上执行，同步接口只是提交协程并等待结果
+llm_loop = BackgroundEventLoop(name="llm-loop")
+_async_client: Optional[httpx.AsyncClient] = None
+
+
+def _get_async_client() -> httpx.AsyncClient:
+    """在事件循环中懒加载共享的异步客户端"""
+    global _async_client
+    if _async_client is None:
+        _async_client = httpx.AsyncClient(
+            timeout=LLM_HTTP_TIMEOUT,
+            http2=LLM_HTTP2,
+            limits=httpx.Limits(
+                max_connections=LLM_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_HTTP_MAX_KEEPALIVE
+            )
+        )
+        logger.info(f"创建LLM异步客户端 - 最大连接数: {LLM_HTTP_MAX_CONNECTIONS}, HTTP/2: {LLM_HTTP2}")
+    return _async_client
+
 
 DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY")
 DEEPSEEK_API_ENDPOINT = os.getenv("DEEPSEEK_API_ENDPOINT", "https://aiproxy.gzg.sealos.run")
 DEEPSEEK_API_URL = f"{DEEPSEEK_API_ENDPOINT}/v1/chat/completions"
 
+DEEPSEEK_MODEL = "deepseek-chat"
+
 logger.info(f"使用 API 端点: {DEEPSEEK_API_URL}")
 
+FEEDBACK_SYSTEM_PROMPT = """你是一个超级活泼可爱的AI助手，善于分析用户的学习进展并给出鼓励。你的回复要既体现对用户目标和历史的关注，又保持轻松愉快的语气。"""
+MENTION_SYSTEM_PROMPT = """你是一个热情友好的飞书助手，喜欢用活泼的语气回答问题，善于理解用户真实需求并给予有价值的回应。"""
+SUMMARY_SYSTEM_PROMPT = """你是一个严谨的记录员，负责把用户的多次打卡内容压缩成简洁、客观的进展摘要。"""
+
+# 进展摘要的最大长度，以及 AI 不可用时每条打卡保留的字数
+SUMMARY_MAX_CHARS = int(os.getenv("PROGRESS_SUMMARY_MAX_CHARS", "400"))
+SUMMARY_ENTRY_CHARS = 60
+
+# @机器人 提示词模板（不含用户问题）大约占用的 token 数
+MENTION_TEMPLATE_TOKENS = 120
+
+# 后台更新进展摘要的线程池
+_summary_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="progress-summary")
+
+
+class LLMResponseCache:
+    """
+    LLM 回复缓存
+    以 (模型, 系统提示词, 用户提示词, temperature, 场景) 的哈希为键，
+    内存层为 LRU + TTL，可选的数据库层（llm_response_cache 表）在重启和多进程间共享
+    """
+
+    def __init__(self):
+        self.max_size = int(os.getenv("LLM_CACHE_SIZE", "1000"))
+        self.ttl_seconds = int(os.getenv("LLM_CACHE_TTL", "86400"))
+        self.use_db = os.getenv("LLM_CACHE_DB_ENABLED", "false").lower() in ("1", "true", "yes")
+        # 默认不缓存 @机器人 的闲聊回复，相同问题也希望得到不同回答；进展摘要每次输入都不同，也不缓存
+        self.modes = {
+            mode.strip() for mode in os.getenv("LLM_CACHE_MODES", "normal,final,ranking").split(",") if mode.strip()
+        }
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (回复, 过期时间 monotonic)
+        self.hits = 0
+        self.db_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(model: str, system_prompt: str, user_prompt: str, temperature: float, mode: str) -> str:
+        raw = json.dumps([model, system_prompt, user_prompt, temperature, mode], ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def enabled_for(self, mode: str) -> bool:
+        return self.max_size > 0 and mode in self.modes
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry:
+                if entry[1] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[0]
+                del self._entries[key]
+
+        if self.use_db:
+            value = self._db_get(key)
+            if value is not None:
+                self._remember(key, value)
+                with self._lock:
+                    self.db_hits += 1
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key: str, value: str, mode: str):
+        self._remember(key, value)
+        if self.use_db:
+            self._db_set(key, value, mode)
+
+    def _remember(self, key: str, value: str):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def _db_get(self, key: str) -> Optional[str]:
+        db = SessionLocal()
+        try:
+            entry = db.get(LLMResponseCacheEntry, key)
+            if entry and entry.created_at > datetime.now() - timedelta(seconds=self.ttl_seconds):
+                return entry.response
+            return None
+        except Exception as e:
+            logger.error(f"读取LLM缓存表失败: {str(e)}")
+            return None
+        finally:
+            db.close()
+
+    def _db_set(self, key: str, value: str, mode: str):
+        db = SessionLocal()
+        try:
+            db.merge(LLMResponseCacheEntry(cache_key=key, mode=mode, response=value, created_at=datetime.now()))
+            db.commit()
+        except Exception as e:
+            logger.error(f"写入LLM缓存表失败: {str(e)}")
+            db.rollback()
+        finally:
+            db.close()
+
+    def get_stats(self) -> dict:
+        """获取缓存命中统计"""
+        with self._lock:
+            total = self.hits + self.db_hits + self.misses
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'db_hits': self.db_hits,
+                'misses': self.misses,
+                'hit_ratio': (self.hits + self.db_hits) / total if total else 0.0,
+            }
+
+
+# 进程内共享的LLM回复缓存
+llm_cache = LLMResponseCache()
+
+
+async def _achat_completion(system_prompt: str, user_prompt: str, temperature: float, max_tokens: int, mode: str) -> str:
+    """
+    调用对话补全接口并返回回复内容，相同输入优先使用缓存
+    熔断器打开时抛出 CircuitOpenError，超过截止时间抛出 TimeoutError，由调用方使用降级文案
+    """
+    use_cache = llm_cache.enabled_for(mode)
+    if use_cache:
+        cache_key = llm_cache.make_key(DEEPSEEK_MODEL, system_prompt, user_prompt, temperature, mode)
+        # 启用数据库层时查缓存会访问数据库，放到线程中避免阻塞事件循环
+        cached = await asyncio.to_thread(llm_cache.get, cache_key) if llm_cache.use_db else llm_cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"命中LLM缓存（{mode}），命中率: {llm_cache.get_stats()['hit_ratio']:.2%}")
+            return cached
+
+    breaker = summary_breaker if mode == "summary" else llm_breaker
+    if not breaker.allow_request():
+        raise CircuitOpenError("AI接口熔断中，跳过请求")
+
+    estimated_tokens = estimate_tokens(system_prompt) + estimate_tokens(user_prompt)
+    started = time.monotonic()
+    try:
+        result = await asyncio.wait_for(
+            _post_completion(system_prompt, user_prompt, temperature, max_tokens),
+            timeout=LLM_REQUEST_DEADLINE
+        )
+    except asyncio.TimeoutError:
+        breaker.record_failure()
+        raise TimeoutError(f"AI接口请求超过 {LLM_REQUEST_DEADLINE:.0f} 秒")
+    except BaseException:
+        # 包括取消：半开状态下的探测名额也需要归还
+        breaker.record_failure()
+        raise
+    breaker.record_success(time.monotonic() - started)
+
+    token_usage.record(mode, estimated_tokens, (result.get('usage') or {}).get('prompt_tokens'))
+    content = result['choices'][0]['message']['content'].strip()
+    if use_cache and content:
+        if llm_cache.use_db:
+            await asyncio.to_thread(llm_cache.set, cache_key, content, mode)
+        else:
+            llm_cache.set(cache_key, content, mode)
+    return content
+
+
+def _completion_request(system_prompt: str, user_prompt: str, temperature: float, max_tokens: int, stream: bool = False) -> dict:
+    """对话补全接口的请求头和请求体"""
+    return {
+        "headers": {
+            "Authorization": f"Bearer {DEEPSEEK_API_KEY}",
+            "Content-Type": "application/json"
+        },
+        "json": {
+            "model": DEEPSEEK_MODEL,
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ],
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "stream": stream
+        }
+    }
+
+
+async def _post_completion(system_prompt: str, user_prompt: str, temperature: float, max_tokens: int) -> dict:
+    response = await _get_async_client().post(
+        DEEPSEEK_API_URL,
+        **_completion_request(system_prompt, user_prompt, temperature, max_tokens)
+    )
+
+    if response.status_code != 200:
+        raise Exception(f"API调用失败: {response.status_code} - {response.text}")
+    return response.json()
+
+
+async def _astream_completion(system_prompt: str, user_prompt: str, temperature: float, max_tokens: int, mode: str,
+                              on_delta: Callable[[str], None]) -> str:
+    """
+    以 SSE 流式调用对话补全接口，每收到一段新文本就调用 on_delta，返回完整回复
+    与非流式调用共用熔断器和截止时间；超过截止时间但已有输出时保留已生成的部分
+    """
+    if not llm_breaker.allow_request():
+        raise CircuitOpenError("AI接口熔断中，跳过请求")
+
+    estimated_tokens = estimate_tokens(system_prompt) + estimate_tokens(user_prompt)
+    started = time.monotonic()
+    parts = []
+    usage = {}
+
+    async def pump():
+        async with _get_async_client().stream(
+            "POST",
+            DEEPSEEK_API_URL,
+            **_completion_request(system_prompt, user_prompt, temperature, max_tokens, stream=True)
+        ) as response:
+            if response.status_code != 200:
+                body = await response.aread()
+                raise Exception(f"API调用失败: {response.status_code} - {body.decode('utf-8', errors='replace')}")
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                chunk = json.loads(data)
+                usage.update(chunk.get('usage') or {})
+                choices = chunk.get('choices') or []
+                delta = (choices[0].get('delta') or {}).get('content') if choices else None
+                if delta:
+                    parts.append(delta)
+                    on_delta(delta)
+
+    try:
+        await asyncio.wait_for(pump(), timeout=LLM_REQUEST_DEADLINE)
+    except asyncio.TimeoutError:
+        llm_breaker.record_failure()
+        if not parts:
+            raise TimeoutError(f"AI接口请求超过 {LLM_REQUEST_DEADLINE:.0f} 秒")
+        logger.warning(f"流式回复超过 {LLM_REQUEST_DEADLINE:.0f} 秒，使用已生成的部分")
+    except BaseException:
+        llm_breaker.record_failure()
+        raise
+    else:
+        llm_breaker.record_success(time.monotonic() - started)
+
+    token_usage.record(mode, estimated_tokens, usage.get('prompt_tokens'))
+    return "".join(parts).strip()
+
+
+def _chat_completion(system_prompt: str, user_prompt: str, temperature: float, max_tokens: int, mode: str) -> str:
+    """_achat_completion 的同步包装，在后台事件循环上执行"""
+    return llm_loop.run(_achat_completion(system_prompt, user_prompt, temperature, max_tokens, mode))
+
+
 def get_all_checkins(db: Session, signup_id: int) -> List[Checkin]:
     """获取用户所有的打卡记录"""
     return db.query(Checkin).filter(Checkin.signup_id == signup_id).order_by(Checkin.checkin_date).all()
 
-def generate_ai_feedback(db: Session, signup_id: int, nickname: str, goals: str, content: str, checkin_count: int, is_final: bool = False, is_ranking: bool = False) -> str:
-    """生成AI反馈，基于用户的所有打卡记录和目标"""
-    # 获取所有历史打卡记录
+
+def build_history(db: Session, signup_id: int, checkin_count: int, max_tokens: Optional[int] = None) -> str:
+    """
+    构建提示词中的历史打卡部分，历史只包含第 checkin_count 次之前的打卡，本次打卡在提示词中单独列出
+    进展摘要正好覆盖到上一次打卡时才使用；摘要缺失、落后，或已经合并了本次打卡（排名和活动结束时通常如此）
+    时读取完整打卡历史，避免本次打卡在提示词中重复出现。
+    指定 max_tokens 时截断摘要，或逐条截断并从最早的打卡开始丢弃
+    """
+    signup = db.get(Signup, signup_id)
+    if signup and signup.progress_summary and (signup.summary_checkin_count or 0) == checkin_count - 1:
+        summary = signup.progress_summary.strip()
+        if max_tokens is not None:
+            summary = truncate_to_tokens(summary, max_tokens)
+        return f"（截至第{signup.summary_checkin_count}次打卡的进展摘要）{summary}\n"
+
+    # 获取所有历史打卡记录，本次及之后的打卡不算历史
     all_checkins = get_all_checkins(db, signup_id)
-    
-    # 构建历史打卡内容字符串
-    history = ""
-    for i, checkin in enumerate(all_checkins, 1):
-        if i == len(all_checkins):  # 最新的打卡
-            continue
-        history += f"第{i}次打卡内容：{checkin.content}\n"
-    
-    # 根据不同场景调整提示词
-    if is_ranking:
-        prompt = f"""
+    entries = [
+        f"第{i}次打卡内容：{checkin.content}"
+        for i, checkin in enumerate(all_checkins[:checkin_count - 1], 1)
+    ]
+    if max_tokens is None:
+        return "".join(f"{entry}\n" for entry in entries)
+
+    history, _ = fit_history(entries, max_tokens)
+    return history
+
+
+def update_progress_summary(db: Session, signup_id: int, content: str, checkin_count: int) -> Optional[str]:
+    """
+    打卡后增量更新报名者的进展摘要：把上一版摘要和本次打卡合并成新的摘要
+    摘要缺失或落后时先用完整历史补齐；AI 调用失败时退化为截断拼接
+    """
+    signup = db.get(Signup, signup_id)
+    if not signup:
+        return None
+
+    if signup.progress_summary and (signup.summary_checkin_count or 0) == checkin_count - 1:
+        previous = signup.progress_summary
+    else:
+        previous, _ = fit_history(
+            [
+                f"第{i}次：{checkin.content}"
+                for i, checkin in enumerate(get_all_checkins(db, signup_id)[:checkin_count - 1], 1)
+            ],
+            get_budget("summary") // 2
+        )
+
+    prompt = f"""
+        以下是用户 {signup.nickname} 之前的进展摘要：
+        {previous or "（暂无）"}
+
+        第{checkin_count}次打卡内容：
+        {content}
+
+        请把本次打卡合并进摘要，输出新的进展摘要，要求：
+        1. 不超过{SUMMARY_MAX_CHARS // 2}字，只陈述事实，不加评价和emoji
+        2. 保留关键里程碑和已完成事项，按时间顺序概括
+        3. 只输出摘要本身
+        """
+    try:
+        summary = _chat_completion(SUMMARY_SYSTEM_PROMPT, prompt, temperature=0.3, max_tokens=300, mode="summary")
+    except Exception as e:
+        logger.error(f"生成进展摘要失败，使用截断拼接: {str(e)}")
+        summary = ""
+    if not summary:
+        summary = f"{previous}第{checkin_count}次：{content[:SUMMARY_ENTRY_CHARS]}\n"
+
+    # 超出长度时从最早的内容开始截掉
+    signup.progress_summary = summary[-SUMMARY_MAX_CHARS:]
+    signup.summary_checkin_count = checkin_count
+    db.commit()
+    logger.info(f"已更新进展摘要 - 用户: {signup.nickname}, 覆盖到第 {checkin_count} 次打卡")
+    return signup.progress_summary
+
+
+def schedule_progress_summary_update(signup_id: int, content: str, checkin_count: int):
+    """在后台线程中更新进展摘要，不阻塞打卡回复"""
+    def run():
+        db = SessionLocal()
+        try:
+            update_progress_summary(db, signup_id, content, checkin_count)
+        except Exception as e:
+            logger.error(f"更新进展摘要失败: {str(e)}", exc_info=True)
+            db.rollback()
+        finally:
+            db.close()
+
+    _summary_executor.submit(run)
+
+
+def _build_feedback_prompt(mode: str, nickname: str, goals: str, history: str, content: str, checkin_count: int) -> str:
+    """根据不同场景生成打卡反馈的提示词"""
+    if mode == "ranking":
+        return f"""
         用户 {nickname} 的学习情况：
         
         【报名目标】
@@ -64,8 +456,8 @@ def generate_ai_feedback(db: Session, signup_id: int, nickname: str, goals: str,
         - 项目部署完成40%，配置好Docker环境
         - Vue组件开发中，完成3个基础组件
         """
-    elif is_final:
-        prompt = f"""
+    if mode == "final":
+        return f"""
         用户 {nickname} 的学习情况：
         
         【报名目标】
@@ -88,8 +480,7 @@ def generate_ai_feedback(db: Session, signup_id: int, nickname: str, goals: str,
         - 🚀 Python基础学习目标完成70%，已掌握函数和类的使用，数据处理很扎实！
         - ⭐ 项目部署目标完成40%，成功配置了Docker环境，正在学习K8s！
         """
-    else:
-        prompt = f"""
+    return f"""
         用户 {nickname} 的学习情况：
         
         【报名目标】
@@ -111,52 +502,65 @@ def generate_ai_feedback(db: Session, signup_id: int, nickname: str, goals: str,
         🎉 从简单的outline到markdown，这可是社区网站功能管理的第一步呢！🌟 未来活动报名、数字名片都会从这里诞生哦！🦄
         """
 
+
+def _prepare_feedback_prompt(db: Session, signup_id: int, nickname: str, goals: str, content: str, checkin_count: int, mode: str) -> str:
+    """读取历史打卡并按场景的 token 预算生成反馈提示词"""
+    budget = get_budget(mode) - estimate_tokens(FEEDBACK_SYSTEM_PROMPT)
+    # 目标最多占预算的三分之一，剩余部分先留给模板和本次打卡，再分给历史打卡
+    goals = truncate_to_tokens(goals, budget // 3)
+    history_budget = max(0, budget - estimate_tokens(_build_feedback_prompt(mode, nickname, goals, "", content, checkin_count)))
+
+    # 历史打卡：优先使用进展摘要
+    history = build_history(db, signup_id, checkin_count, max_tokens=history_budget)
+    return _build_feedback_prompt(mode, nickname, goals, history, content, checkin_count)
+
+
+async def agenerate_ai_feedback(prompt: str, checkin_count: int, mode: str) -> Optional[str]:
+    """
+    用已经生成好的提示词请求AI反馈，只做网络请求，不访问数据库
+    排名简报生成失败（包括超时、熔断）时返回 None，由排行榜统一使用“目标推进中”
+    """
     try:
-        response = http_client.post(
-            DEEPSEEK_API_URL,
-            headers={
-                "Authorization": f"Bearer {DEEPSEEK_API_KEY}",
-                "Content-Type": "application/json"
-            },
-            json={
-                "model": "deepseek-chat",
-                "messages": [
-                    {
-                        "role": "system", 
-                        "content": """你是一个超级活泼可爱的AI助手，善于分析用户的学习进展并给出鼓励。你的回复要既体现对用户目标和历史的关注，又保持轻松愉快的语气。"""
-                    },
-                    {"role": "user", "content": prompt}
-                ],
-                "temperature": 0.8,
-                "max_tokens": 100
-            }
-        )
-        
-        if response.status_code == 200:
-            result = response.json()
-            ai_feedback = result['choices'][0]['message']['content'].strip()
-            
-            # 如果是排名反馈，直接返回生成的内容
-            if is_ranking:
-                return ai_feedback
-            
-            # 构建普通打卡反馈消息
-            return f"✨ 打卡成功！\n📝 第 {checkin_count}/21 次打卡\n\n{ai_feedback}"
-            
-        else:
-            raise Exception(f"API调用失败: {response.status_code} - {response.text}")
-            
+        ai_feedback = await _achat_completion(FEEDBACK_SYSTEM_PROMPT, prompt, temperature=0.8, max_tokens=100, mode=mode)
     except Exception as e:
         logger.error(f"生成AI反馈失败: {str(e)}")
-        if is_ranking:
-            return "项目进行中，持续推进"
-        else:
-            return f"✅ 打卡成功！\n📊 第 {checkin_count}/21 次打卡\n\n💪 继续加油，期待您的下次分享！"
+        return _fallback_feedback(checkin_count, mode)
 
-def generate_ai_response(query: str) -> str:
-    """生成AI回复"""
+    # 如果是排名反馈，直接返回生成的内容
+    if mode == "ranking":
+        return ai_feedback
+
+    # 构建普通打卡反馈消息
+    return f"✨ 打卡成功！\n📝 第 {checkin_count}/21 次打卡\n\n{ai_feedback}"
+
+
+def _fallback_feedback(checkin_count: int, mode: str) -> Optional[str]:
+    if mode == "ranking":
+        return None
+    return f"✅ 打卡成功！\n📊 第 {checkin_count}/21 次打卡\n\n💪 继续加油，期待您的下次分享！"
+
+
+def generate_ai_feedback(db: Session, signup_id: int, nickname: str, goals: str, content: str, checkin_count: int, is_final: bool = False, is_ranking: bool = False) -> Optional[str]:
+    """
+    生成AI反馈，基于用户的所有打卡记录和目标，提示词总长度受场景的 token 预算约束
+    会话不是线程安全的，提示词在调用方线程中用调用方的会话生成，只有 LLM 请求交给事件循环
+    """
+    mode = "ranking" if is_ranking else ("final" if is_final else "normal")
     try:
-        prompt = f"""
+        prompt = _prepare_feedback_prompt(db, signup_id, nickname, goals, content, checkin_count, mode)
+    except Exception as e:
+        logger.error(f"生成AI反馈失败: {str(e)}")
+        return _fallback_feedback(checkin_count, mode)
+    return llm_loop.run(agenerate_ai_feedback(prompt, checkin_count, mode))
+
+
+def _build_mention_prompt(query: str) -> str:
+    """生成@机器人回复的提示词，问题过长时截断，保证整段提示词不超过预算"""
+    query = truncate_to_tokens(
+        query,
+        get_budget("mention") - estimate_tokens(MENTION_SYSTEM_PROMPT) - MENTION_TEMPLATE_TOKENS
+    )
+    return f"""
         用户在飞书群里@了机器人，并发送了以下消息:
         "{query}"
         
@@ -167,33 +571,42 @@ def generate_ai_response(query: str) -> str:
         4. 适当使用emoji增加亲和力
         5. 整体控制在100字以内
         """
-        
-        response = http_client.post(
-            DEEPSEEK_API_URL,
-            headers={
-                "Authorization": f"Bearer {DEEPSEEK_API_KEY}",
-                "Content-Type": "application/json"
-            },
-            json={
-                "model": "deepseek-chat",
-                "messages": [
-                    {
-                        "role": "system", 
-                        "content": """你是一个热情友好的飞书助手，喜欢用活泼的语气回答问题，善于理解用户真实需求并给予有价值的回应。"""
-                    },
-                    {"role": "user", "content": prompt}
-                ],
-                "temperature": 0.8,
-                "max_tokens": 200
-            }
-        )
-        
-        if response.status_code == 200:
-            result = response.json()
-            return result['choices'][0]['message']['content'].strip()
-        else:
-            raise Exception(f"API调用失败: {response.status_code} - {response.text}")
+
+
+async def agenerate_ai_response(query: str) -> Optional[str]:
+    """生成AI回复"""
+    try:
+        prompt = _build_mention_prompt(query)
+        return await _achat_completion(MENTION_SYSTEM_PROMPT, prompt, temperature=0.8, max_tokens=200, mode="mention")
             
     except Exception as e:
         logger.error(f"生成AI回复失败: {str(e)}")
         return None
+
+
+def generate_ai_response(query: str) -> Optional[str]:
+    """agenerate_ai_response 的同步包装"""
+    return llm_loop.run(agenerate_ai_response(query))
+
+
+def stream_ai_response(query: str) -> Iterator[str]:
+    """
+    流式生成AI回复，在调用方线程中逐段产出新增的文本
+    生成在后台事件循环上进行；失败时在迭代结束前抛出异常
+    """
+    prompt = _build_mention_prompt(query)
+    chunks = queue.Queue()
+    done = object()
+
+    future = llm_loop.submit(
+        _astream_completion(MENTION_SYSTEM_PROMPT, prompt, temperature=0.8, max_tokens=200, mode="mention",
+                            on_delta=chunks.put)
+    )
+    future.add_done_callback(lambda _: chunks.put(done))
+
+    while True:
+        item = chunks.get()
+        if item is done:
+            break
+        yield item
+    future.result()
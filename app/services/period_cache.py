@@ -0,0 +1,152 @@
+import logging
+import os
+import threading
+import time
+from datetime import date, datetime
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+from dotenv import load_dotenv
+from sqlalchemy.orm import Session
+from ..models.database import Period, Signup
+
+load_dotenv()
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+
+class PeriodSnapshot(NamedTuple):
+    """期数的只读快照，可以跨数据库会话使用"""
+    id: int
+    period_name: str
+    start_date: datetime
+    end_date: datetime
+    status: str
+    signup_link: Optional[str]
+
+
+class SignupSnapshot(NamedTuple):
+    """报名记录的只读快照，打卡统计在打卡提交后同步更新"""
+    id: int
+    period_id: int
+    nickname: str
+    focus_area: Optional[str]
+    introduction: Optional[str]
+    goals: Optional[str]
+    checkin_count: int
+    last_checkin_date: Optional[date]
+
+
+class PeriodCache:
+    """
+    进程内的期数和报名名单缓存
+    按状态缓存期数（包括“没有该状态的期数”），按期数缓存 昵称 -> 报名记录 的名单。
+    创建期数、接龙结束、活动结束时显式失效，TTL 兜底处理其他进程或手工改库造成的变化
+    """
+
+    def __init__(self, ttl_seconds: float = None):
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else float(os.getenv("PERIOD_CACHE_TTL", "60"))
+        self._lock = threading.Lock()
+        self._periods: Dict[str, Tuple[Optional[PeriodSnapshot], float]] = {}
+        self._rosters: Dict[int, Tuple[Dict[str, SignupSnapshot], float]] = {}
+        self.hits = 0
+        self.misses = 0
+        # 期数变化（整体失效）时的回调，例如调度器据此调整排名任务
+        self._listeners: List[Callable[[], None]] = []
+
+    def get_period(self, db: Session, status: str = '进行中') -> Optional[PeriodSnapshot]:
+        """获取指定状态的期数，没有时返回 None"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._periods.get(status)
+            if entry and entry[1] > now:
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        period = db.query(Period).filter(Period.status == status).first()
+        snapshot = PeriodSnapshot(
+            period.id, period.period_name, period.start_date, period.end_date, period.status, period.signup_link
+        ) if period else None
+        with self._lock:
+            self._periods[status] = (snapshot, now + self.ttl_seconds)
+        return snapshot
+
+    def get_signup(self, db: Session, period_id: int, nickname: str) -> Optional[SignupSnapshot]:
+        """按昵称查找报名记录，名单未缓存时一次加载整期名单"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._rosters.get(period_id)
+            if entry and entry[1] > now:
+                self.hits += 1
+                return entry[0].get(nickname)
+            self.misses += 1
+
+        roster = {
+            row.nickname: SignupSnapshot(
+                row.id, row.period_id, row.nickname, row.focus_area, row.introduction, row.goals,
+                row.checkin_count or 0, row.last_checkin_date
+            )
+            for row in db.query(
+                Signup.id, Signup.period_id, Signup.nickname, Signup.focus_area, Signup.introduction,
+                Signup.goals, Signup.checkin_count, Signup.last_checkin_date
+            ).filter(Signup.period_id == period_id)
+        }
+        with self._lock:
+            self._rosters[period_id] = (roster, now + self.ttl_seconds)
+        logger.info(f"加载期数 {period_id} 的报名名单，共 {len(roster)} 人")
+        return roster.get(nickname)
+
+    def record_checkin(self, period_id: int, nickname: str, checkin_date: date, checkin_count: int):
+        """打卡提交后把数据库中累加后的打卡统计写回缓存，避免下次打卡再查库"""
+        with self._lock:
+            entry = self._rosters.get(period_id)
+            if not entry or nickname not in entry[0]:
+                return
+            signup = entry[0][nickname]
+            entry[0][nickname] = signup._replace(
+                checkin_count=checkin_count,
+                last_checkin_date=checkin_date
+            )
+
+    def add_listener(self, callback: Callable[[], None]):
+        """注册期数变化回调，在 invalidate() 清空全部缓存后调用"""
+        with self._lock:
+            self._listeners.append(callback)
+
+    def remove_listener(self, callback: Callable[[], None]):
+        with self._lock:
+            if callback in self._listeners:
+                self._listeners.remove(callback)
+
+    def invalidate(self, period_id: Optional[int] = None):
+        """清空缓存；指定 period_id 时只清空该期的名单"""
+        with self._lock:
+            if period_id is None:
+                self._periods.clear()
+                self._rosters.clear()
+                listeners = list(self._listeners)
+            else:
+                self._rosters.pop(period_id, None)
+                listeners = []
+        logger.info(f"期数缓存已失效{f'（期数 {period_id} 的名单）' if period_id is not None else ''}")
+        for callback in listeners:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"期数变化回调执行失败: {str(e)}", exc_info=True)
+
+    def get_stats(self) -> dict:
+        """获取缓存命中统计"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'periods': len(self._periods),
+                'rosters': len(self._rosters),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / total if total else 0.0,
+            }
+
+
+# 进程内共享的期数缓存
+period_cache = PeriodCache()
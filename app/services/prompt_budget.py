@@ -0,0 +1,117 @@
+import logging
+import math
+import os
+import threading
+from typing import Dict, List, Tuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 各场景提示词（含系统提示词）的 token 预算
+PROMPT_TOKEN_BUDGETS = {
+    'normal': int(os.getenv("PROMPT_TOKEN_BUDGET_NORMAL", "1200")),
+    'final': int(os.getenv("PROMPT_TOKEN_BUDGET_FINAL", "1500")),
+    'ranking': int(os.getenv("PROMPT_TOKEN_BUDGET_RANKING", "1500")),
+    'mention': int(os.getenv("PROMPT_TOKEN_BUDGET_MENTION", "600")),
+    'summary': int(os.getenv("PROMPT_TOKEN_BUDGET_SUMMARY", "1000")),
+}
+# 历史打卡中单条记录最多保留的字数
+HISTORY_ENTRY_MAX_CHARS = int(os.getenv("PROMPT_HISTORY_ENTRY_MAX_CHARS", "200"))
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗略估算 token 数
+    参考 DeepSeek 的换算：1 个中文字符约 0.6 token，1 个英文字符约 0.3 token
+    """
+    if not text:
+        return 0
+    cjk = sum(1 for ch in text if ord(ch) > 0x2E80)
+    return math.ceil(cjk * 0.6 + (len(text) - cjk) * 0.3)
+
+
+def get_budget(mode: str) -> int:
+    return PROMPT_TOKEN_BUDGETS.get(mode, PROMPT_TOKEN_BUDGETS['normal'])
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """把文本截断到不超过 max_tokens，超出时以省略号结尾"""
+    if not text or estimate_tokens(text) <= max_tokens:
+        return text or ""
+    if max_tokens <= 0:
+        return ""
+
+    # 二分查找能放下的最长前缀
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if estimate_tokens(text[:mid]) + 1 <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return text[:low] + "…"
+
+
+def fit_history(entries: List[str], max_tokens: int, entry_max_chars: int = None) -> Tuple[str, int]:
+    """
+    把历史打卡裁剪到预算内：先按条截断过长的内容，再从最早的记录开始丢弃
+    返回 (拼接后的历史, 丢弃的条数)
+    """
+    entry_max_chars = entry_max_chars or HISTORY_ENTRY_MAX_CHARS
+    entries = [
+        entry if len(entry) <= entry_max_chars else entry[:entry_max_chars] + "…"
+        for entry in entries
+    ]
+
+    kept = []
+    used = 0
+    # 从最新的记录往前累加，保证保留最近的进展
+    for entry in reversed(entries):
+        cost = estimate_tokens(entry) + 1
+        if used + cost > max_tokens:
+            break
+        kept.append(entry)
+        used += cost
+
+    dropped = len(entries) - len(kept)
+    if dropped:
+        logger.info(f"历史打卡超出预算（{max_tokens} tokens），丢弃最早的 {dropped} 条")
+    return "".join(f"{entry}\n" for entry in reversed(kept)), dropped
+
+
+class TokenUsageStats:
+    """按场景记录估算与实际的提示词 token 数"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, mode: str, estimated: int, actual: int = None):
+        with self._lock:
+            stat = self._stats.setdefault(mode, {'calls': 0, 'estimated': 0, 'actual': 0, 'actual_calls': 0})
+            stat['calls'] += 1
+            stat['estimated'] += estimated
+            if actual is not None:
+                stat['actual'] += actual
+                stat['actual_calls'] += 1
+        if actual is not None:
+            logger.info(f"提示词 token（{mode}）- 估算: {estimated}, 实际: {actual}")
+
+    def get_stats(self) -> Dict[str, Dict[str, float]]:
+        """获取各场景的平均估算/实际 token 数"""
+        with self._lock:
+            return {
+                mode: {
+                    'calls': stat['calls'],
+                    'avg_estimated': stat['estimated'] / stat['calls'] if stat['calls'] else 0.0,
+                    'avg_actual': stat['actual'] / stat['actual_calls'] if stat['actual_calls'] else 0.0,
+                }
+                for mode, stat in self._stats.items()
+            }
+
+
+# 进程内共享的 token 统计
+token_usage = TokenUsageStats()
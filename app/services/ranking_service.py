@@ -0,0 +1,208 @@
+import logging
+import os
+from typing import Any, Dict, List
+from dotenv import load_dotenv
+from sqlalchemy import func
+from sqlalchemy.orm import Session, aliased
+from ..models.database import Signup, Checkin, LeaderboardEntry, SessionLocal
+from ..utils.concurrency import map_with_deadline
+from .openai_service import generate_ai_feedback
+from .leaderboard_service import LeaderboardService
+
+load_dotenv()
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 排行榜进度简报的并发数和单条超时时间（秒）
+RANKING_AI_CONCURRENCY = int(os.getenv("RANKING_AI_CONCURRENCY", "5"))
+RANKING_AI_TIMEOUT = float(os.getenv("RANKING_AI_TIMEOUT", "20"))
+DEFAULT_PROGRESS_FEEDBACK = "目标推进中"
+
+# 活动结束时生成证书表扬语的并发数和单条超时时间（秒）
+ACTIVITY_END_AI_CONCURRENCY = int(os.getenv("ACTIVITY_END_AI_CONCURRENCY", "8"))
+ACTIVITY_END_AI_TIMEOUT = float(os.getenv("ACTIVITY_END_AI_TIMEOUT", "30"))
+DEFAULT_FINAL_PRAISE = "很棒的表现！期待下次再见！"
+
+
+class RankingService:
+    """打卡排名查询：排名公布只读排行榜前N名，活动结束时一条 SQL 取出整期所有报名者的打卡统计"""
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def get_period_stats(self, period_id: int) -> List[Dict[str, Any]]:
+        """
+        获取指定期数所有报名者的打卡次数、最后打卡日期和最新打卡内容，按打卡次数降序排列
+        打卡统计读自 leaderboard 表（打卡时在同一事务中维护），最新打卡通过 latest_checkin_id 关联，
+        没有打卡的报名者次数为 0
+        """
+        latest = aliased(Checkin)
+        checkin_count = func.coalesce(LeaderboardEntry.checkin_count, 0)
+
+        rows = self.db.query(
+            Signup.id,
+            Signup.nickname,
+            Signup.focus_area,
+            Signup.introduction,
+            Signup.goals,
+            checkin_count.label('checkin_count'),
+            LeaderboardEntry.last_checkin_date,
+            latest.content.label('latest_content')
+        )\
+            .outerjoin(LeaderboardEntry, LeaderboardEntry.signup_id == Signup.id)\
+            .outerjoin(latest, latest.id == LeaderboardEntry.latest_checkin_id)\
+            .filter(Signup.period_id == period_id)\
+            .order_by(checkin_count.desc(), Signup.id)\
+            .all()
+
+        logger.info(f"查询期数 {period_id} 的打卡统计，共 {len(rows)} 位报名者")
+        return [
+            {
+                'signup_id': row.id,
+                'nickname': row.nickname,
+                'focus_area': row.focus_area,
+                'introduction': row.introduction,
+                'goals': row.goals,
+                'checkin_count': row.checkin_count,
+                'last_checkin_date': row.last_checkin_date,
+                'latest_content': row.latest_content,
+            }
+            for row in rows
+        ]
+
+    def get_top_stats(self, period_id: int, limit: int = 10, include_idle: bool = False) -> List[Dict[str, Any]]:
+        """
+        获取前 limit 名的打卡统计和最新打卡内容，字段与 get_period_stats 相同
+        名次读自 LeaderboardService.top()，只补查这几个人的报名信息；
+        include_idle 为 True 且有打卡的人不足 limit 时，按报名顺序用没有打卡的报名者补足
+        """
+        top = LeaderboardService(self.db).top(period_id, limit)
+        latest = aliased(Checkin)
+        details = {}
+        if top:
+            rows = self.db.query(
+                Signup.id, Signup.focus_area, Signup.introduction, Signup.goals, latest.content.label('latest_content')
+            )\
+                .join(LeaderboardEntry, LeaderboardEntry.signup_id == Signup.id)\
+                .outerjoin(latest, latest.id == LeaderboardEntry.latest_checkin_id)\
+                .filter(Signup.id.in_([entry['signup_id'] for entry in top]))\
+                .all()
+            details = {row.id: row for row in rows}
+
+        stats = []
+        for entry in top:
+            detail = details[entry['signup_id']]
+            stats.append({
+                'signup_id': entry['signup_id'],
+                'nickname': entry['nickname'],
+                'focus_area': detail.focus_area,
+                'introduction': detail.introduction,
+                'goals': detail.goals,
+                'checkin_count': entry['checkin_count'],
+                'last_checkin_date': entry['last_checkin_date'],
+                'latest_content': detail.latest_content,
+            })
+
+        if include_idle and len(stats) < limit:
+            idle = self.db.query(Signup.id, Signup.nickname, Signup.focus_area, Signup.introduction, Signup.goals)\
+                .outerjoin(LeaderboardEntry, LeaderboardEntry.signup_id == Signup.id)\
+                .filter(Signup.period_id == period_id, LeaderboardEntry.signup_id.is_(None))\
+                .order_by(Signup.id)\
+                .limit(limit - len(stats))
+            stats.extend(
+                {
+                    'signup_id': row.id,
+                    'nickname': row.nickname,
+                    'focus_area': row.focus_area,
+                    'introduction': row.introduction,
+                    'goals': row.goals,
+                    'checkin_count': 0,
+                    'last_checkin_date': None,
+                    'latest_content': None,
+                }
+                for row in idle
+            )
+        return stats
+
+
+def generate_progress_summaries(rows: List[Dict[str, Any]]) -> List[str]:
+    """
+    为排行榜中需要展示简报的行并发生成项目进度总结，按输入顺序返回
+    调用方应先排好名次，只传入实际展示的行；单条超时或失败时使用“目标推进中”
+    """
+    return map_with_deadline(
+        _summarize_progress,
+        rows,
+        max_workers=RANKING_AI_CONCURRENCY,
+        timeout=RANKING_AI_TIMEOUT,
+        fallback=lambda row: DEFAULT_PROGRESS_FEEDBACK
+    )
+
+
+def generate_final_praises(rows: List[Dict[str, Any]]) -> List[str]:
+    """
+    活动结束时为每位开发者并发生成证书中的AI表扬语，按输入顺序返回
+    没有打卡记录的返回空字符串，单条超时或失败时使用默认表扬语
+    """
+    return map_with_deadline(
+        _final_praise,
+        rows,
+        max_workers=ACTIVITY_END_AI_CONCURRENCY,
+        timeout=ACTIVITY_END_AI_TIMEOUT,
+        fallback=lambda row: DEFAULT_FINAL_PRAISE if row['checkin_count'] > 0 else ""
+    )
+
+
+def _final_praise(row: Dict[str, Any]) -> str:
+    """生成单个开发者的结束总结，在工作线程中使用独立的数据库会话"""
+    if row['checkin_count'] <= 0 or not row['latest_content']:
+        return ""
+
+    # 综合目标：项目名称、项目介绍、本期目标
+    combined_goals = f"项目名称：{row['focus_area']}\n项目介绍：{row['introduction']}\n本期目标：{row['goals']}"
+    db = SessionLocal()
+    try:
+        # 使用最后一次打卡内容生成表扬
+        praise = generate_ai_feedback(
+            db=db,
+            signup_id=row['signup_id'],
+            nickname=row['nickname'],
+            goals=combined_goals,
+            content=row['latest_content'],
+            checkin_count=row['checkin_count'],
+            is_final=True  # 标记这是结束总结
+        )
+    finally:
+        db.close()
+
+    if praise:
+        return praise.split('\n\n')[-1]  # 只取AI反馈部分
+    return DEFAULT_FINAL_PRAISE
+
+
+def _summarize_progress(row: Dict[str, Any]) -> str:
+    """生成单个开发者的进度总结，在工作线程中使用独立的数据库会话"""
+    if not row['latest_content'] or row['checkin_count'] <= 0:
+        return DEFAULT_PROGRESS_FEEDBACK
+
+    # 综合目标：项目名称、项目介绍、本期目标
+    combined_goals = f"项目名称：{row['focus_area']}\n项目介绍：{row['introduction']}\n本期目标：{row['goals']}"
+    db = SessionLocal()
+    try:
+        feedback = generate_ai_feedback(
+            db=db,
+            signup_id=row['signup_id'],
+            nickname=row['nickname'],
+            goals=combined_goals,
+            content=row['latest_content'],
+            checkin_count=row['checkin_count'],
+            is_final=False,
+            is_ranking=True
+        )
+    finally:
+        db.close()
+
+    if feedback:
+        return feedback.split('\n\n')[-1].strip()
+    return DEFAULT_PROGRESS_FEEDBACK
@@ -0,0 +1,184 @@
+import json
+import logging
+import os
+import threading
+import time
+from typing import Callable, Iterable, Optional
+import lark_oapi as lark
+from lark_oapi.api.im.v1 import (
+    P2ImMessageReceiveV1,
+    CreateMessageRequest,
+    CreateMessageRequestBody,
+    ReplyMessageRequest,
+    ReplyMessageRequestBody,
+    UpdateMessageRequest,
+    UpdateMessageRequestBody,
+)
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 流式回复的占位文本、两次编辑的最小间隔（秒）和最少新增字数
+STREAM_PLACEHOLDER = "🤔 思考中…"
+STREAM_UPDATE_INTERVAL = float(os.getenv("REPLY_STREAM_INTERVAL", "1.0"))
+STREAM_MIN_CHARS = int(os.getenv("REPLY_STREAM_MIN_CHARS", "10"))
+# 飞书单条消息可编辑的次数有限，中间更新最多这么多次，最后一次完整内容另算
+STREAM_MAX_UPDATES = int(os.getenv("REPLY_STREAM_MAX_UPDATES", "15"))
+
+
+class ReplyService:
+    """
+    飞书消息回复：私聊使用 create 接口，群聊使用 reply 接口
+    支持先发占位消息，再随着 AI 输出分段编辑同一条消息
+    """
+
+    def __init__(self, client: lark.Client):
+        self.client = client
+        self._lock = threading.Lock()
+        self._ttfv_count = 0
+        self._ttfv_total = 0.0
+        self._ttfv_max = 0.0
+
+    def for_event(self, data: P2ImMessageReceiveV1) -> "EventReplier":
+        """绑定到某条消息事件的回复器，交给 MessageHandler 使用"""
+        return EventReplier(self, data)
+
+    def send(self, data: P2ImMessageReceiveV1, text: str) -> Optional[str]:
+        """发送回复消息，成功时返回新消息的 message_id"""
+        content = json.dumps({"text": text})
+        logger.info(f"准备发送回复: {content}")
+
+        if data.event.message.chat_type == "p2p":
+            logger.info("私聊消息，使用 create 接口发送")
+            request = (
+                CreateMessageRequest.builder()
+                .receive_id_type("chat_id")
+                .request_body(
+                    CreateMessageRequestBody.builder()
+                    .receive_id(data.event.message.chat_id)
+                    .msg_type("text")
+                    .content(content)
+                    .build()
+                )
+                .build()
+            )
+            # https://open.feishu.cn/document/uAjLw4CM/ukTMukTMukTM/reference/im-v1/message/create
+            response = self.client.im.v1.message.create(request)
+        else:
+            logger.info("群聊消息，使用 reply 接口发送")
+            request = (
+                ReplyMessageRequest.builder()
+                .message_id(data.event.message.message_id)
+                .request_body(
+                    ReplyMessageRequestBody.builder()
+                    .content(content)
+                    .msg_type("text")
+                    .build()
+                )
+                .build()
+            )
+            # https://open.feishu.cn/document/uAjLw4CM/ukTMukTMukTM/reference/im-v1/message/reply
+            response = self.client.im.v1.message.reply(request)
+
+        if not response.success():
+            logger.error(f"发送消息失败: {response.msg}, log_id: {response.get_log_id()}")
+            return None
+        logger.info("消息发送成功")
+        return response.data.message_id if response.data else None
+
+    def update(self, message_id: str, text: str) -> bool:
+        """编辑机器人已发送的文本消息"""
+        request = (
+            UpdateMessageRequest.builder()
+            .message_id(message_id)
+            .request_body(
+                UpdateMessageRequestBody.builder()
+                .msg_type("text")
+                .content(json.dumps({"text": text}))
+                .build()
+            )
+            .build()
+        )
+        # https://open.feishu.cn/document/server-docs/im-v1/message/update
+        response = self.client.im.v1.message.update(request)
+        if not response.success():
+            logger.error(f"编辑消息失败: {response.msg}, log_id: {response.get_log_id()}")
+            return False
+        return True
+
+    def stream(self, data: P2ImMessageReceiveV1, chunks: Iterable[str], fallback: Callable[[], str]) -> Optional[str]:
+        """
+        先回复占位消息，再把 chunks 产出的文本按节流间隔编辑进同一条消息
+        生成失败或没有任何输出时使用 fallback() 的文本；占位消息发送失败时退化为一次性发送
+        返回最终发送的文本
+        """
+        started = time.monotonic()
+        message_id = self.send(data, STREAM_PLACEHOLDER)
+
+        text = ""
+        shown = ""
+        updates = 0
+        last_update = float("-inf")
+        first_visible = None
+        try:
+            for delta in chunks:
+                text += delta
+                if not message_id or updates >= STREAM_MAX_UPDATES:
+                    continue
+                now = time.monotonic()
+                if now - last_update < STREAM_UPDATE_INTERVAL or len(text) - len(shown) < STREAM_MIN_CHARS:
+                    continue
+                if self.update(message_id, f"{text}…"):
+                    shown = text
+                    updates += 1
+                    last_update = now
+                    if first_visible is None:
+                        first_visible = now - started
+        except Exception as e:
+            logger.error(f"流式生成回复失败: {str(e)}")
+
+        text = text.strip() or fallback()
+        if message_id:
+            self.update(message_id, text)
+        else:
+            self.send(data, text)
+
+        self._record_ttfv(first_visible if first_visible is not None else time.monotonic() - started)
+        logger.info(f"流式回复完成 - 编辑次数: {updates + 1}, 长度: {len(text)}")
+        return text
+
+    def _record_ttfv(self, seconds: float):
+        with self._lock:
+            self._ttfv_count += 1
+            self._ttfv_total += seconds
+            self._ttfv_max = max(self._ttfv_max, seconds)
+        logger.info(f"流式回复首次可见耗时: {seconds:.2f} 秒")
+
+    def get_stats(self) -> dict:
+        """获取流式回复首次出现正文的平均和最大耗时（秒）"""
+        with self._lock:
+            return {
+                'streams': self._ttfv_count,
+                'avg_time_to_first_text': self._ttfv_total / self._ttfv_count if self._ttfv_count else 0.0,
+                'max_time_to_first_text': self._ttfv_max,
+            }
+
+
+class EventReplier:
+    """绑定到单条消息事件的回复器"""
+
+    def __init__(self, service: ReplyService, data: P2ImMessageReceiveV1):
+        self.service = service
+        self.data = data
+
+    def send(self, text: str) -> Optional[str]:
+        return self.service.send(self.data, text)
+
+    def update(self, message_id: str, text: str) -> bool:
+        return self.service.update(message_id, text)
+
+    def stream(self, chunks: Iterable[str], fallback: Callable[[], str]) -> Optional[str]:
+        return self.service.stream(self.data, chunks, fallback)
@@ -1,34 +1,67 @@
 import logging
+import os
 import threading
-import time
-from datetime import datetime, timedelta
-from sqlalchemy import func
-from sqlalchemy.orm import Session
-from ..models.database import Period, Signup, Checkin, get_db
-from .openai_service import generate_ai_feedback
+from datetime import date, datetime, timedelta
+from functools import partial
+from typing import Callable, List
+from dotenv import load_dotenv
+from ..models.database import get_db
+from .checkin_counters import CheckinCounterService
+from .leaderboard_service import LeaderboardService
+from .period_cache import period_cache
 from .feishu_service import FeishuService
+from .ranking_service import RankingService, generate_progress_summaries
+from .command_router import RANKING_DAYS
+from .job_ledger import JobLedger
+from ..utils.job_scheduler import JobScheduler, daily_at, every, once
+
+load_dotenv()
 
 # 配置日志
 logger = logging.getLogger(__name__)
 
+# 每天执行打卡统计对账的时间（小时）
+RECONCILE_HOUR = 4
+# 发布打卡排名的时间（小时）
+RANKING_HOUR = 21
+# 兜底同步期数的间隔（分钟）：其他进程或手工改库导致期数变化时，最迟在这个间隔内调整排名任务
+PERIOD_SYNC_MINUTES = 30
+# 错过的排名在计划时间之后多少小时内仍会补发（停机、发送失败后的重试）
+JOB_CATCHUP_HOURS = int(os.getenv("JOB_CATCHUP_HOURS", "12"))
+# 执行记录中的任务名
+RANKING_JOB = 'checkin_ranking'
+RECONCILE_JOB = 'checkin_counter_reconcile'
+# 执行定时任务的线程数
+SCHEDULER_WORKERS = int(os.getenv("SCHEDULER_WORKERS", "2"))
+
+
+def ranking_times(start_date: datetime) -> List[datetime]:
+    """某一期发布排名的时间：活动第3、7、14、21天的晚上9点"""
+    first_day = start_date.replace(hour=RANKING_HOUR, minute=0, second=0, microsecond=0)
+    return [first_day + timedelta(days=days - 1) for days in RANKING_DAYS]
+
+
 class TaskScheduler:
     def __init__(self, client):
         """初始化任务调度器"""
         self.client = client
         self.running = False
-        self.scheduler_thread = None
         self.feishu_service = FeishuService()
-        self.tasks = []
-        self.setup_tasks()
+        self.jobs = JobScheduler(max_workers=SCHEDULER_WORKERS, name="task-scheduler")
+        # 当前已调度排名任务的期数
+        self.ranking_period_id = None
+        self._sync_lock = threading.Lock()
 
     def setup_tasks(self):
         """设置定时任务"""
-        # 晚上9点发布打卡排名任务
-        self.tasks.append({
-            'name': 'checkin_ranking',
-            'func': self.publish_checkin_ranking,
-            'check_time': self.is_ranking_time
-        })
+        # 每天凌晨对账报名记录上的打卡统计；今天的对账时间已过但没有执行记录时立即补跑
+        self.jobs.add_job('checkin_counter_reconcile', self.run_daily_reconcile, daily_at(RECONCILE_HOUR))
+        if datetime.now().hour >= RECONCILE_HOUR:
+            self.jobs.add_job('checkin_counter_reconcile_catchup', self.run_daily_reconcile, once(datetime.now()))
+        # 定期兜底同步期数对应的排名任务，同时补发失败的排名
+        self.jobs.add_job('period_job_sync', self.sync_period_jobs, every(timedelta(minutes=PERIOD_SYNC_MINUTES)))
+        # 为当前进行中的期数添加晚上9点发布排名的任务（在工作线程中查库，启动时数据库不可用也不影响其他任务）
+        self.on_periods_changed()
 
     def start(self):
         """启动调度器"""
@@ -37,182 +70,169 @@ class TaskScheduler:
             return
 
         self.running = True
-        self.scheduler_thread = threading.Thread(target=self.run, daemon=True)
-        self.scheduler_thread.start()
+        self.setup_tasks()
+        period_cache.add_listener(self.on_periods_changed)
+        self.jobs.start()
         logger.info("任务调度器已启动")
 
     def stop(self):
         """停止调度器"""
         self.running = False
-        if self.scheduler_thread:
-            self.scheduler_thread.join(timeout=1)
+        period_cache.remove_listener(self.on_periods_changed)
+        self.jobs.stop()
         logger.info("任务调度器已停止")
 
-    def run(self):
-        """运行调度器主循环"""
-        logger.info("调度器开始运行")
-        
-        last_check = datetime.now() - timedelta(minutes=1)  # 确保首次检查会立即执行
-        
-        while self.running:
-            try:
-                now = datetime.now()
-                
-                # 每分钟检查一次是否有任务需要执行
-                if (now - last_check).total_seconds() >= 60:
-                    self.check_tasks()
-                    last_check = now
-                
-                # 短暂休眠以减少CPU占用
-                time.sleep(10)
-                
-            except Exception as e:
-                logger.error(f"调度器运行出错: {str(e)}", exc_info=True)
-                time.sleep(60)  # 出错后休眠一分钟再继续
-    
-    def check_tasks(self):
-        """检查并执行需要运行的任务"""
-        for task in self.tasks:
-            try:
-                if task['check_time']():
-                    logger.info(f"执行任务: {task['name']}")
-                    task['func']()
-            except Exception as e:
-                logger.error(f"执行任务 {task['name']} 出错: {str(e)}", exc_info=True)
+    def on_periods_changed(self):
+        """创建期数、接龙结束、活动结束后期数缓存整体失效，立即在工作线程中重新同步排名任务"""
+        self.jobs.add_job('period_job_sync_now', self.sync_period_jobs, once(datetime.now()))
 
-    def is_ranking_time(self):
+    def sync_period_jobs(self):
         """
-        检查当前是否是发布排名的时间
-        在活动期间的第3、7、14、21天的晚上9点（21:00-21:05）发布
+        按当前进行中的期数添加或删除排名任务
+        未到时间的排名按计划时间调度；已过时间、在补发窗口内且执行记录中没有完成的排名立即补发
         """
-        now = datetime.now()
-        
-        # 只在21:00-21:05之间触发
-        if now.hour != 21 or now.minute > 5:
-            return False
-            
-        # 获取数据库连接
         db = next(get_db())
         try:
-            # 获取当前进行中的活动期数
-            current_period = db.query(Period)\
-                .filter(Period.status == '进行中')\
-                .first()
-                
+            current_period = period_cache.get_period(db, '进行中')
+            period_id = current_period.id if current_period else None
+            done = JobLedger(db).completed_dates(RANKING_JOB, period_id) if current_period else set()
+        finally:
+            db.close()
+
+        with self._sync_lock:
+            if self.ranking_period_id not in (None, period_id):
+                for days in RANKING_DAYS:
+                    self.jobs.remove_job(f"{RANKING_JOB}:{self.ranking_period_id}:{days}")
+            self.ranking_period_id = period_id
             if not current_period:
-                logger.info("没有正在进行的活动，跳过排名发布")
-                return False
-                
-            # 计算活动进行的天数
-            days_passed = (now.date() - current_period.start_date.date()).days + 1
-            
-            # 检查是否是第3、7、14或21天
-            if days_passed in [3, 7, 14, 21]:
-                # 检查今天是否已经发布过排名（避免重复发送）
-                # 这里可以添加一个简单的状态检查，例如使用文件或数据库标记
-                # 为简化实现，我们假设在5分钟窗口内只会触发一次
-                logger.info(f"今天是活动第{days_passed}天，需要发布排名")
-                return True
-                
-            return False
-                
+                logger.info("没有正在进行的活动，不调度排名发布")
+                return
+
+            now = datetime.now()
+            scheduled = set(self.jobs.job_names())
+            for days, fire_at in zip(RANKING_DAYS, ranking_times(current_period.start_date)):
+                name = f"{RANKING_JOB}:{period_id}:{days}"
+                if fire_at.date() in done or name in scheduled:
+                    continue
+                if fire_at < now - timedelta(hours=JOB_CATCHUP_HOURS):
+                    logger.warning(f"第{days}天的排名（{fire_at:%Y-%m-%d %H:%M}）已超过补发窗口，不再发布")
+                    continue
+                if fire_at <= now:
+                    logger.info(f"第{days}天的排名（{fire_at:%Y-%m-%d %H:%M}）未发布，立即补发")
+                self.jobs.add_job(
+                    name,
+                    partial(self.run_job_once, RANKING_JOB, period_id, fire_at.date(),
+                            partial(self.publish_checkin_ranking, period_id, days)),
+                    once(fire_at)
+                )
+
+    def run_job_once(self, job_name: str, period_id: int, run_date: date, func: Callable[[], None]):
+        """在执行记录中认领 (任务名, 期数, 日期) 后执行，已被其他进程或之前的运行完成时跳过"""
+        db = next(get_db())
+        try:
+            claimed = JobLedger(db).claim(job_name, period_id, run_date)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        if not claimed:
+            logger.info(f"任务 {job_name}（期数 {period_id}，{run_date}）已执行过或正在由其他进程执行，跳过")
+            return
+
+        error = None
+        try:
+            func()
         except Exception as e:
-            logger.error(f"检查排名时间出错: {str(e)}", exc_info=True)
-            return False
+            error = str(e) or type(e).__name__
+            raise
+        finally:
+            db = next(get_db())
+            try:
+                ledger = JobLedger(db)
+                if error is None:
+                    ledger.complete(job_name, period_id, run_date)
+                else:
+                    ledger.fail(job_name, period_id, run_date, error)
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                logger.error(f"更新任务 {job_name} 的执行记录失败: {str(e)}", exc_info=True)
+            finally:
+                db.close()
+
+    def run_daily_reconcile(self):
+        """每天一次的打卡统计对账，通过执行记录保证多进程、补跑时不重复"""
+        self.run_job_once(RECONCILE_JOB, 0, datetime.now().date(), self.reconcile_checkin_counters)
+
+    def reconcile_checkin_counters(self):
+        """
+        按 checkins 表对账打卡时冗余维护的两份统计：
+        报名记录上的打卡次数、最后打卡日期和连续天数，以及进行中期数的排行榜（排名和证书读取的数据）
+        """
+        db = next(get_db())
+        try:
+            CheckinCounterService(db).reconcile()
+            current_period = period_cache.get_period(db, '进行中')
+            if current_period:
+                result = LeaderboardService(db).rebuild(current_period.id)
+                if result['mismatched']:
+                    logger.warning(f"排行榜对账修复期数 {current_period.id} 的 {result['mismatched']} 行")
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
         finally:
             db.close()
 
-    def publish_checkin_ranking(self):
-        """发布打卡排名"""
+    def publish_checkin_ranking(self, period_id: int = None, days_passed: int = None):
+        """
+        发布打卡排名；指定 period_id 时，只有该期仍在进行中才发布
+        补发时传入计划的天数 days_passed，标题仍显示原定的第N天；发送失败时抛出异常
+        """
         db = next(get_db())
         try:
             # 获取当前进行中的活动期数
-            current_period = db.query(Period)\
-                .filter(Period.status == '进行中')\
-                .first()
+            current_period = period_cache.get_period(db, '进行中')
                 
             if not current_period:
                 logger.info("没有正在进行的活动，跳过排名发布")
                 return
+            if period_id is not None and current_period.id != period_id:
+                logger.info(f"期数 {period_id} 已不在进行中，跳过排名发布")
+                return
                 
             # 计算活动进行的天数
-            now = datetime.now()
-            days_passed = (now.date() - current_period.start_date.date()).days + 1
+            if days_passed is None:
+                now = datetime.now()
+                days_passed = (now.date() - current_period.start_date.date()).days + 1
             
             logger.info(f"正在为{current_period.period_name}期活动第{days_passed}天生成排名")
             
-            # 获取该期所有开发者的报名记录
-            signups = db.query(Signup)\
-                .filter(Signup.period_id == current_period.id)\
-                .all()
-                
-            # 收集每个开发者的打卡统计
-            developer_stats = []
-            
-            for signup in signups:
-                # 获取该开发者的所有打卡记录数量
-                checkin_count = db.query(func.count(Checkin.id))\
-                    .filter(Checkin.signup_id == signup.id)\
-                    .scalar() or 0
-                    
-                developer_stats.append({
-                    'nickname': signup.nickname,
-                    'focus_area': signup.focus_area,
-                    'goals': signup.goals,
-                    'checkin_count': checkin_count,
-                    'signup_id': signup.id
-                })
-                
-            # 按打卡次数排序（降序）
-            developer_stats.sort(key=lambda x: x['checkin_count'], reverse=True)
+            # 从排行榜读取前10名，有打卡的人不足10名时用未打卡的报名者补足
+            top_developers = RankingService(db).get_top_stats(current_period.id, 10, include_idle=True)
             
             # 生成排名消息
-            top_developers = developer_stats[:10]  # 取前10名
             
             message_lines = [
                 f"✨ {current_period.period_name}期活动第{days_passed}天打卡排行榜",
                 f"📊 截至目前的打卡排名前10名：\n"
             ]
             
+            # 只为前5名中有打卡记录的开发者并发生成项目进度简报
+            summary_rows = [dev for dev in top_developers[:5] if dev['latest_content']]
+            progress_feedbacks = dict(zip(
+                (dev['signup_id'] for dev in summary_rows),
+                generate_progress_summaries(summary_rows)
+            ))
+            
             # 添加排名信息
             for i, dev in enumerate(top_developers):
+                message_lines.append(f"{i+1}. {dev['nickname']} ({dev['focus_area']}) - {dev['checkin_count']}次打卡")
                 if i < 5:  # 前5名显示项目进度
-                    # 获取该开发者的最新打卡记录
-                    latest_checkin = db.query(Checkin)\
-                        .filter(Checkin.signup_id == dev['signup_id'])\
-                        .order_by(Checkin.checkin_date.desc())\
-                        .first()
-                        
-                    # 生成进度反馈
-                    progress_feedback = ""
-                    if latest_checkin:
-                        try:
-                            # 使用与活动结束相同的反馈生成逻辑
-                            progress_feedback = generate_ai_feedback(
-                                db=db,
-                                signup_id=dev['signup_id'],
-                                nickname=dev['nickname'],
-                                goals=dev['goals'],
-                                content=latest_checkin.content,
-                                checkin_count=dev['checkin_count'],
-                                is_final=False,  # 非最终反馈
-                                is_ranking=True  # 标记这是排名反馈
-                            )
-                            
-                            # 只保留进度部分
-                            if progress_feedback:
-                                progress_feedback = progress_feedback.split('\n\n')[-1]
-                        except Exception as e:
-                            logger.error(f"生成进度反馈失败: {str(e)}")
-                            progress_feedback = "继续加油！"
-                    else:
-                        progress_feedback = "暂无打卡记录"
-                    
-                    message_lines.append(f"{i+1}. {dev['nickname']} ({dev['focus_area']}) - {dev['checkin_count']}次打卡")
+                    progress_feedback = progress_feedbacks.get(dev['signup_id'], "暂无打卡记录")
                     message_lines.append(f"   项目进度: {progress_feedback}")
-                else:
-                    # 后5名只显示基本信息
-                    message_lines.append(f"{i+1}. {dev['nickname']} ({dev['focus_area']}) - {dev['checkin_count']}次打卡")
             
             # 添加激励信息
             message_lines.extend([
@@ -228,15 +248,16 @@ class TaskScheduler:
             # 获取该期活动的聊天群ID
             chat_id = self.feishu_service.get_chat_id_for_period(current_period.id)
             if not chat_id:
-                logger.error("未找到活动对应的聊天群ID，无法发送排名消息")
-                return
+                raise RuntimeError("未找到活动对应的聊天群ID，无法发送排名消息")
                 
             # 发送消息
-            self.send_message_to_chat(chat_id, content)
+            if not self.send_message_to_chat(chat_id, content):
+                raise RuntimeError(f"排名消息发送到聊天群 {chat_id} 失败")
             logger.info(f"排名消息已发送到聊天群 {chat_id}")
             
         except Exception as e:
             logger.error(f"发布排名出错: {str(e)}", exc_info=True)
+            raise
         finally:
             db.close()
             
@@ -0,0 +1,122 @@
+import logging
+from datetime import datetime
+from typing import Any, Dict, Iterable
+from sqlalchemy.orm import Session
+from ..models.database import Signup
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 参与比较的字段：报名时间只在新增时写入，避免每次同步都被判定为变化
+COMPARED_FIELDS = ('focus_area', 'introduction', 'goals')
+
+
+def _normalize(value) -> str:
+    """数据库中的 None 和多维表中的空值都按空字符串比较，避免每次同步都被判定为变化"""
+    return (value or '').strip()
+
+
+class SignupSyncer:
+    """
+    报名数据增量同步
+    按 (period_id, nickname) 对比多维表记录和已有报名记录：
+    新增的批量插入，变化的批量更新，多维表中已不存在的只报告不删除
+    （删除报名会级联删除打卡记录）。不提交事务，由调用方统一提交
+    """
+
+    def __init__(self, db: Session, batch_size: int = 100):
+        self.db = db
+        self.batch_size = batch_size
+
+    def sync(self, period_id: int, records: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        同步报名记录，records 可以是边获取边产出的迭代器
+        返回同步统计：inserted/updated/unchanged/skipped 数量、removed 昵称列表和 developers 列表
+        """
+        existing = {
+            row.nickname: row
+            for row in self.db.query(
+                Signup.id, Signup.nickname, Signup.focus_area, Signup.introduction, Signup.goals
+            ).filter(Signup.period_id == period_id)
+        }
+
+        summary = {
+            'fetched': 0,
+            'inserted': 0,
+            'updated': 0,
+            'unchanged': 0,
+            'skipped': 0,
+            'removed': [],
+            'developers': [],
+        }
+        seen = set()
+        to_insert = []
+        to_update = []
+
+        for record in records:
+            summary['fetched'] += 1
+            nickname = (record.get('nickname') or '').strip()
+            if not nickname:
+                logger.warning("跳过空昵称的记录")
+                summary['skipped'] += 1
+                continue
+            if nickname in seen:
+                logger.warning(f"跳过重复昵称的记录: {nickname}")
+                summary['skipped'] += 1
+                continue
+            seen.add(nickname)
+
+            values = {
+                'focus_area': _normalize(record.get('focus_area')) or '未知',
+                'introduction': _normalize(record.get('introduction')),
+                'goals': _normalize(record.get('goals')),
+            }
+            summary['developers'].append({
+                'nickname': nickname,
+                'focus_area': values['focus_area']
+            })
+
+            current = existing.get(nickname)
+            if current is None:
+                to_insert.append({
+                    'period_id': period_id,
+                    'nickname': nickname,
+                    'signup_time': record.get('signup_time') or datetime.now(),
+                    **values
+                })
+                summary['inserted'] += 1
+            elif any(_normalize(getattr(current, field)) != values[field] for field in COMPARED_FIELDS):
+                to_update.append({'id': current.id, **values})
+                summary['updated'] += 1
+            else:
+                summary['unchanged'] += 1
+
+            # 分批写入，不必等所有分页都获取完
+            if len(to_insert) >= self.batch_size:
+                self._flush_inserts(to_insert)
+            if len(to_update) >= self.batch_size:
+                self._flush_updates(to_update)
+
+        self._flush_inserts(to_insert)
+        self._flush_updates(to_update)
+
+        summary['removed'] = sorted(set(existing) - seen)
+        if summary['removed']:
+            logger.warning(f"多维表中已不存在的报名记录 {len(summary['removed'])} 条（未删除）: {summary['removed'][:20]}")
+
+        logger.info(
+            f"报名同步完成 - 期数ID: {period_id}, 获取: {summary['fetched']}, 新增: {summary['inserted']}, "
+            f"更新: {summary['updated']}, 未变化: {summary['unchanged']}, 跳过: {summary['skipped']}, "
+            f"已移除: {len(summary['removed'])}"
+        )
+        return summary
+
+    def _flush_inserts(self, rows: list):
+        if rows:
+            self.db.bulk_insert_mappings(Signup, rows)
+            rows.clear()
+
+    def _flush_updates(self, rows: list):
+        if rows:
+            self.db.bulk_update_mappings(Signup, rows)
+            rows.clear()
@@ -0,0 +1,19 @@
+from datetime import date, timedelta
+from typing import Iterable, Optional, Tuple
+
+
+def summarize_checkin_dates(dates: Iterable[date]) -> Tuple[int, Optional[date], int]:
+    """
+    根据一个人的打卡日期计算 (打卡次数, 最后打卡日期, 连续打卡天数)
+    连续天数指截至最后一次打卡、逐日相连的天数
+    """
+    days = sorted(set(dates))
+    if not days:
+        return 0, None, 0
+
+    streak = 1
+    for previous, current in zip(reversed(days[:-1]), reversed(days)):
+        if current - previous != timedelta(days=1):
+            break
+        streak += 1
+    return len(days), days[-1], streak
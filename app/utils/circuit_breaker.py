@@ -0,0 +1,118 @@
+import logging
+import threading
+import time
+from collections import deque
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(Exception):
+    """熔断器处于打开状态，请求被直接拒绝"""
+
+
+class CircuitBreaker:
+    """
+    基于滑动窗口的熔断器
+    最近 window_size 次调用中失败率或慢调用率达到阈值时打开，打开期间直接拒绝请求；
+    open_seconds 后进入半开状态，放行少量探测请求，探测成功则关闭，失败则重新打开
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, window_size: int = 20, min_calls: int = 5, failure_rate: float = 0.5,
+                 slow_call_seconds: float = 10.0, slow_call_rate: float = 0.5, open_seconds: float = 30.0,
+                 half_open_max_calls: int = 1):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+        self.half_open_max_calls = half_open_max_calls
+
+        self._lock = threading.Lock()
+        self._window = deque(maxlen=window_size)  # (是否失败, 是否慢调用)
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._half_open_calls = 0
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._refresh_state()
+            return self._state
+
+    def allow_request(self) -> bool:
+        """判断是否放行本次请求；放行后必须调用 record_success 或 record_failure"""
+        with self._lock:
+            self._refresh_state()
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.HALF_OPEN and self._half_open_calls < self.half_open_max_calls:
+                self._half_open_calls += 1
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self, latency: float):
+        slow = latency >= self.slow_call_seconds
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                if slow:
+                    self._open(f"探测请求过慢（{latency:.1f} 秒）")
+                else:
+                    self._close()
+                return
+            self._window.append((False, slow))
+            self._check_thresholds()
+
+    def record_failure(self):
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._open("探测请求失败")
+                return
+            self._window.append((True, False))
+            self._check_thresholds()
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            self._refresh_state()
+            calls = len(self._window)
+            return {
+                'state': self._state,
+                'calls': calls,
+                'failures': sum(1 for failed, _ in self._window if failed),
+                'slow_calls': sum(1 for _, slow in self._window if slow),
+                'rejected': self.rejected,
+            }
+
+    def _refresh_state(self):
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._state = self.HALF_OPEN
+            self._half_open_calls = 0
+            logger.info(f"熔断器 {self.name} 进入半开状态，放行探测请求")
+
+    def _check_thresholds(self):
+        if self._state != self.CLOSED or len(self._window) < self.min_calls:
+            return
+        calls = len(self._window)
+        failures = sum(1 for failed, _ in self._window if failed)
+        slow_calls = sum(1 for _, slow in self._window if slow)
+        if failures / calls >= self.failure_rate:
+            self._open(f"失败率 {failures}/{calls}")
+        elif slow_calls / calls >= self.slow_call_rate:
+            self._open(f"慢调用率 {slow_calls}/{calls}")
+
+    def _open(self, reason: str):
+        self._state = self.OPEN
+        self._opened_at = time.monotonic()
+        logger.warning(f"熔断器 {self.name} 打开（{reason}），{self.open_seconds:.0f} 秒内直接使用降级结果")
+
+    def _close(self):
+        self._state = self.CLOSED
+        self._window.clear()
+        logger.info(f"熔断器 {self.name} 探测成功，恢复关闭状态")
@@ -0,0 +1,94 @@
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, Awaitable, Callable, Iterable, List, Optional
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+
+def map_with_deadline(func: Callable[[Any], Any], items: Iterable[Any], max_workers: int,
+                      timeout: float, fallback: Callable[[Any], Any]) -> List[Any]:
+    """
+    有界并发地执行 func(item)，按输入顺序返回结果
+    每一项从开始执行起最多等待 timeout 秒，超时或出错时使用 fallback(item) 的结果；
+    超时的线程无法被中断，会在后台自然结束，但不会再阻塞调用方
+    """
+    items = list(items)
+    results = [None] * len(items)
+    if not items:
+        return results
+
+    started = {}
+
+    def run(index: int, item: Any) -> Any:
+        started[index] = time.monotonic()
+        return func(item)
+
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(items))))
+    try:
+        futures = {executor.submit(run, i, item): i for i, item in enumerate(items)}
+        pending = set(futures)
+        while pending:
+            # 等到最早开始的那一项到期，或者有任务完成
+            now = time.monotonic()
+            deadlines = [started[futures[f]] + timeout for f in pending if futures[f] in started]
+            wait_time = max(0.0, min(deadlines) - now) if deadlines else timeout
+            done, pending = wait(pending, timeout=wait_time, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                index = futures[future]
+                try:
+                    results[index] = future.result()
+                except Exception as e:
+                    logger.error(f"并发任务执行失败: {str(e)}")
+                    results[index] = fallback(items[index])
+
+            now = time.monotonic()
+            expired = {f for f in pending if futures[f] in started and started[futures[f]] + timeout <= now}
+            for future in expired:
+                index = futures[future]
+                logger.warning(f"并发任务超时（{timeout} 秒），使用默认结果")
+                results[index] = fallback(items[index])
+            pending -= expired
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    return results
+
+
+class BackgroundEventLoop:
+    """
+    在独立的守护线程中运行一个 asyncio 事件循环
+    供同步代码提交协程并等待结果，多个调用方共享同一个循环和其上的异步连接池
+    """
+
+    def __init__(self, name: str = "async-loop"):
+        self.name = name
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name=self.name, daemon=True).start()
+            return self._loop
+
+    def submit(self, coro: Awaitable[Any]) -> Future:
+        """提交协程，立即返回 concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro: Awaitable[Any], timeout: Optional[float] = None) -> Any:
+        """提交协程并阻塞等待结果；不能在该循环自身的线程中调用"""
+        loop = self.loop
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            raise RuntimeError("不能在后台事件循环线程中同步等待协程")
+        return self.submit(coro).result(timeout)
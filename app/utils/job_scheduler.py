@@ -0,0 +1,188 @@
+import heapq
+import itertools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 计算下一次触发时间：传入当前时间，返回下一次触发的时间，None 表示不再触发
+Schedule = Callable[[datetime], Optional[datetime]]
+
+# 最长一次睡眠的秒数：系统时钟被调整后，最迟在这个时间内按新的时钟重新计算
+MAX_SLEEP_SECONDS = 300
+
+
+def daily_at(hour: int, minute: int = 0) -> Schedule:
+    """每天固定时间触发"""
+    def next_run(after: datetime) -> datetime:
+        candidate = after.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        return candidate if candidate > after else candidate + timedelta(days=1)
+    return next_run
+
+
+def every(interval: timedelta) -> Schedule:
+    """按固定间隔触发"""
+    return lambda after: after + interval
+
+
+def once(at: datetime) -> Schedule:
+    """只在指定时间触发一次，时间已过时立即触发"""
+    pending = [True]
+    def next_run(after: datetime) -> Optional[datetime]:
+        if not pending[0]:
+            return None
+        pending[0] = False
+        return max(at, after)
+    return next_run
+
+
+class _Job(NamedTuple):
+    name: str
+    func: Callable[[], None]
+    schedule: Schedule
+    generation: int
+
+
+class JobScheduler:
+    """
+    基于最小堆的定时任务调度器
+    堆中按下一次触发时间排列，调度线程只睡到堆顶任务到期（或被添加/删除任务唤醒），
+    到期的任务提交到工作线程池执行，一个慢任务不会推迟其他任务。
+    删除或替换任务时不从堆中移除旧条目，而是靠 generation 判断条目是否失效。
+    同一个任务上一次还没执行完时，本次触发会被跳过
+    """
+
+    def __init__(self, max_workers: int = 2, name: str = "scheduler"):
+        self.name = name
+        self._jobs: Dict[str, _Job] = {}
+        self._heap: List[Tuple[datetime, int, str, int]] = []
+        self._running_jobs = set()
+        self._seq = itertools.count()
+        self._generations = itertools.count(1)
+        self._cond = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{name}-worker")
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = False
+
+    def add_job(self, name: str, func: Callable[[], None], schedule: Schedule,
+                now: Optional[datetime] = None) -> Optional[datetime]:
+        """添加或替换任务，返回首次触发时间（没有未来的触发时间时不添加）"""
+        now = now or datetime.now()
+        fire_at = schedule(now)
+        with self._cond:
+            if fire_at is None:
+                self._jobs.pop(name, None)
+                logger.info(f"任务 {name} 没有待触发的时间，不再调度")
+                return None
+            job = _Job(name, func, schedule, next(self._generations))
+            self._jobs[name] = job
+            heapq.heappush(self._heap, (fire_at, next(self._seq), name, job.generation))
+            self._cond.notify()
+        logger.info(f"已调度任务 {name}，下次执行时间: {fire_at:%Y-%m-%d %H:%M:%S}")
+        return fire_at
+
+    def remove_job(self, name: str) -> bool:
+        """删除任务，已经在执行的那一次不受影响"""
+        with self._cond:
+            removed = self._jobs.pop(name, None) is not None
+            self._cond.notify()
+        if removed:
+            logger.info(f"已删除任务 {name}")
+        return removed
+
+    def job_names(self) -> List[str]:
+        with self._cond:
+            return list(self._jobs)
+
+    def next_run_times(self) -> Dict[str, datetime]:
+        """每个任务的下一次触发时间"""
+        with self._cond:
+            result = {}
+            for fire_at, _, name, generation in sorted(self._heap):
+                job = self._jobs.get(name)
+                if job and job.generation == generation and name not in result:
+                    result[name] = fire_at
+            return result
+
+    def start(self):
+        with self._cond:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stopped = False
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 1):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self._thread:
+            self._thread.join(timeout=timeout)
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._stopped:
+                    return
+                due = self._pop_due()
+            if due is not None:
+                self._dispatch(*due)
+
+    def _pop_due(self) -> Optional[Tuple[_Job, datetime]]:
+        """在持有锁时调用：等到堆顶任务到期并弹出；中途被唤醒或条目已失效时返回 None"""
+        if not self._heap:
+            self._cond.wait()
+            return None
+
+        fire_at, _, name, generation = self._heap[0]
+        job = self._jobs.get(name)
+        if not job or job.generation != generation:
+            heapq.heappop(self._heap)
+            return None
+
+        now = datetime.now()
+        delay = (fire_at - now).total_seconds()
+        if delay > 0:
+            self._cond.wait(min(delay, MAX_SLEEP_SECONDS))
+            return None
+
+        # 从当前时间计算下一次，停机或积压期间错过的多次触发不会连续补跑
+        heapq.heappop(self._heap)
+        try:
+            next_at = job.schedule(max(fire_at, now))
+        except Exception as e:
+            logger.error(f"计算任务 {name} 的下次执行时间出错，不再调度: {str(e)}", exc_info=True)
+            next_at = None
+        if next_at is not None:
+            heapq.heappush(self._heap, (next_at, next(self._seq), name, generation))
+        else:
+            del self._jobs[name]
+        return job, fire_at
+
+    def _dispatch(self, job: _Job, fire_at: datetime):
+        with self._cond:
+            if job.name in self._running_jobs:
+                logger.warning(f"任务 {job.name} 上一次还未执行完，跳过 {fire_at:%Y-%m-%d %H:%M:%S} 的触发")
+                return
+            self._running_jobs.add(job.name)
+        logger.info(f"执行任务: {job.name}（计划时间 {fire_at:%Y-%m-%d %H:%M:%S}）")
+        try:
+            self._executor.submit(self._execute, job)
+        except RuntimeError:
+            # 调度器正在停止，线程池已关闭
+            with self._cond:
+                self._running_jobs.discard(job.name)
+
+    def _execute(self, job: _Job):
+        try:
+            job.func()
+        except Exception as e:
+            logger.error(f"执行任务 {job.name} 出错: {str(e)}", exc_info=True)
+        finally:
+            with self._cond:
+                self._running_jobs.discard(job.name)
@@ -63,7 +63,9 @@ CREATE TABLE `checkins` (
   `checkin_count` int(11) DEFAULT NULL,
   `created_at` datetime DEFAULT CURRENT_TIMESTAMP,
   PRIMARY KEY (`id`),
+  UNIQUE KEY `uq_checkins_signup_date` (`signup_id`,`checkin_date`),
   KEY `fk_checkin_signup` (`signup_id`),
+  KEY `ix_checkins_checkin_date` (`checkin_date`),
   CONSTRAINT `fk_checkin_signup` FOREIGN KEY (`signup_id`) REFERENCES `signups` (`id`) ON DELETE CASCADE
 ) ENGINE=InnoDB AUTO_INCREMENT=13 DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 /*!40101 SET character_set_client = @saved_cs_client */;
@@ -78,6 +80,93 @@ INSERT INTO `checkins` VALUES (10,3,'张三','2025-04-27','用cursor搭建了vue
 /*!40000 ALTER TABLE `checkins` ENABLE KEYS */;
 UNLOCK TABLES;
 
+--
+-- Table structure for table `job_runs`
+--
+
+DROP TABLE IF EXISTS `job_runs`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!40101 SET character_set_client = utf8 */;
+CREATE TABLE `job_runs` (
+  `id` int(11) NOT NULL AUTO_INCREMENT,
+  `job_name` varchar(100) COLLATE utf8mb4_unicode_ci NOT NULL,
+  `period_id` int(11) NOT NULL,
+  `run_date` date NOT NULL,
+  `status` varchar(20) COLLATE utf8mb4_unicode_ci NOT NULL,
+  `owner` varchar(100) COLLATE utf8mb4_unicode_ci DEFAULT NULL,
+  `attempts` int(11) NOT NULL,
+  `claimed_at` datetime NOT NULL,
+  `finished_at` datetime DEFAULT NULL,
+  `error` text COLLATE utf8mb4_unicode_ci,
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `uq_job_runs_job_period_day` (`job_name`,`period_id`,`run_date`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
+--
+-- Table structure for table `leaderboard`
+--
+
+DROP TABLE IF EXISTS `leaderboard`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!40101 SET character_set_client = utf8 */;
+CREATE TABLE `leaderboard` (
+  `signup_id` int(11) NOT NULL,
+  `period_id` int(11) NOT NULL,
+  `nickname` varchar(50) COLLATE utf8mb4_unicode_ci NOT NULL,
+  `checkin_count` int(11) NOT NULL,
+  `last_checkin_date` date DEFAULT NULL,
+  `latest_checkin_id` int(11) DEFAULT NULL,
+  `updated_at` datetime DEFAULT NULL,
+  PRIMARY KEY (`signup_id`),
+  KEY `ix_leaderboard_rank` (`period_id`,`checkin_count`,`signup_id`),
+  CONSTRAINT `leaderboard_ibfk_1` FOREIGN KEY (`signup_id`) REFERENCES `signups` (`id`) ON DELETE CASCADE,
+  CONSTRAINT `leaderboard_ibfk_2` FOREIGN KEY (`period_id`) REFERENCES `periods` (`id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
+--
+-- Dumping data for table `leaderboard`
+--
+
+LOCK TABLES `leaderboard` WRITE;
+/*!40000 ALTER TABLE `leaderboard` DISABLE KEYS */;
+INSERT INTO `leaderboard` VALUES (2,1,'李四',1,'2025-04-27',11,'2025-04-27 22:11:15'),(3,1,'张三',1,'2025-04-27',10,'2025-04-27 22:09:15'),(4,1,'王五',1,'2025-04-27',12,'2025-04-27 22:12:14');
+/*!40000 ALTER TABLE `leaderboard` ENABLE KEYS */;
+UNLOCK TABLES;
+
+--
+-- Table structure for table `llm_response_cache`
+--
+
+DROP TABLE IF EXISTS `llm_response_cache`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!40101 SET character_set_client = utf8 */;
+CREATE TABLE `llm_response_cache` (
+  `cache_key` varchar(64) COLLATE utf8mb4_unicode_ci NOT NULL,
+  `mode` varchar(20) COLLATE utf8mb4_unicode_ci DEFAULT NULL,
+  `response` text COLLATE utf8mb4_unicode_ci NOT NULL,
+  `created_at` datetime NOT NULL,
+  PRIMARY KEY (`cache_key`),
+  KEY `ix_llm_response_cache_created_at` (`created_at`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
+--
+-- Table structure for table `processed_events`
+--
+
+DROP TABLE IF EXISTS `processed_events`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!40101 SET character_set_client = utf8 */;
+CREATE TABLE `processed_events` (
+  `event_key` varchar(128) COLLATE utf8mb4_unicode_ci NOT NULL,
+  `created_at` datetime NOT NULL,
+  PRIMARY KEY (`event_key`),
+  KEY `ix_processed_events_created_at` (`created_at`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
 --
 -- Temporary table structure for view `period_stats`
 --
@@ -109,7 +198,8 @@ CREATE TABLE `periods` (
   `status` varchar(20) COLLATE utf8mb4_unicode_ci NOT NULL,
   `signup_link` varchar(500) COLLATE utf8mb4_unicode_ci DEFAULT NULL,
   PRIMARY KEY (`id`),
-  UNIQUE KEY `period_name` (`period_name`)
+  UNIQUE KEY `period_name` (`period_name`),
+  KEY `ix_periods_status` (`status`)
 ) ENGINE=InnoDB AUTO_INCREMENT=2 DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 /*!40101 SET character_set_client = @saved_cs_client */;
 
@@ -123,6 +213,31 @@ INSERT INTO `periods` VALUES (1,'2025-04','2025-04-24 21:58:21','2025-05-27 21:5
 /*!40000 ALTER TABLE `periods` ENABLE KEYS */;
 UNLOCK TABLES;
 
+--
+-- Table structure for table `schema_migrations`
+--
+
+DROP TABLE IF EXISTS `schema_migrations`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!40101 SET character_set_client = utf8 */;
+CREATE TABLE `schema_migrations` (
+  `version` int(11) NOT NULL,
+  `name` varchar(100) COLLATE utf8mb4_unicode_ci NOT NULL,
+  `applied_at` datetime NOT NULL,
+  PRIMARY KEY (`version`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
+--
+-- Dumping data for table `schema_migrations`
+--
+
+LOCK TABLES `schema_migrations` WRITE;
+/*!40000 ALTER TABLE `schema_migrations` DISABLE KEYS */;
+INSERT INTO `schema_migrations` VALUES (1,'checkins_hot_path_indexes','2025-04-27 22:00:00'),(2,'signup_and_period_lookup_indexes','2025-04-27 22:00:00'),(3,'backfill_signup_checkin_counters','2025-04-27 22:00:00'),(4,'build_leaderboard_from_checkins','2025-04-27 22:00:00');
+/*!40000 ALTER TABLE `schema_migrations` ENABLE KEYS */;
+UNLOCK TABLES;
+
 --
 -- Table structure for table `signups`
 --
@@ -138,6 +253,11 @@ CREATE TABLE `signups` (
   `introduction` text COLLATE utf8mb4_unicode_ci,
   `goals` text COLLATE utf8mb4_unicode_ci,
   `signup_time` datetime DEFAULT CURRENT_TIMESTAMP,
+  `progress_summary` text COLLATE utf8mb4_unicode_ci,
+  `summary_checkin_count` int(11) DEFAULT NULL,
+  `checkin_count` int(11) NOT NULL DEFAULT '0',
+  `last_checkin_date` date DEFAULT NULL,
+  `current_streak` int(11) NOT NULL DEFAULT '0',
   PRIMARY KEY (`id`),
   UNIQUE KEY `period_nickname` (`period_id`,`nickname`),
   CONSTRAINT `fk_signup_period` FOREIGN KEY (`period_id`) REFERENCES `periods` (`id`) ON DELETE CASCADE
@@ -150,7 +270,7 @@ CREATE TABLE `signups` (
 
 LOCK TABLES `signups` WRITE;
 /*!40000 ALTER TABLE `signups` DISABLE KEYS */;
-INSERT INTO `signups` VALUES (2,1,'李四','java','java开发经验，热爱开源','完成一个开源组件库的开发','2025-04-24 22:02:38'),(3,1,'张三','前端','前端开发经验，热爱开源','完成一个购物网站的开发','2025-04-24 22:02:38'),(4,1,'王五','运营','小红书博主','达到1k粉丝量','2025-04-24 22:02:38');
+INSERT INTO `signups` VALUES (2,1,'李四','java','java开发经验，热爱开源','完成一个开源组件库的开发','2025-04-24 22:02:38',NULL,NULL,1,'2025-04-27',1),(3,1,'张三','前端','前端开发经验，热爱开源','完成一个购物网站的开发','2025-04-24 22:02:38',NULL,NULL,1,'2025-04-27',1),(4,1,'王五','运营','小红书博主','达到1k粉丝量','2025-04-24 22:02:38',NULL,NULL,1,'2025-04-27',1);
 /*!40000 ALTER TABLE `signups` ENABLE KEYS */;
 UNLOCK TABLES;
 
@@ -7,6 +7,10 @@ import logging
 from app.services.message_handler import MessageHandler
 from app.models.database import init_db, get_db
 from app.services.scheduler import TaskScheduler
+from app.services.event_dispatcher import EventDispatcher
+from app.services.dedup_store import event_dedup
+from app.services.reply_service import ReplyService
+from app.services.command_router import command_router
 
 # 配置日志
 logging.basicConfig(level=logging.INFO,
@@ -19,6 +23,8 @@ load_dotenv()
 # 获取配置
 FEISHU_APP_ID = os.getenv("FEISHU_APP_ID")
 FEISHU_APP_SECRET = os.getenv("FEISHU_APP_SECRET")
+# 打卡消息是否按 群+昵称 排序（默认按群排序，同一个群内的消息严格串行）
+CHECKIN_ORDER_BY_NICKNAME = os.getenv("CHECKIN_ORDER_BY_NICKNAME", "false").lower() in ("1", "true", "yes")
 
 if not all([FEISHU_APP_ID, FEISHU_APP_SECRET]):
     raise ValueError(
@@ -38,35 +44,48 @@ except Exception as e:
 
 
 def do_p2_im_message_receive_v1(data: P2ImMessageReceiveV1) -> None:
+    """长连接回调：只做入队，去重和实际处理交给事件分发器的工作线程"""
     try:
-        # 检查是否已经处理过该消息
-        message_id = data.event.message.message_id
         event_id = data.header.event_id
-        
-        # 使用Redis或内存缓存来存储已处理的消息ID
-        processed_events = getattr(do_p2_im_message_receive_v1, 'processed_events', set())
-        if event_id in processed_events:
-            logger.info(f"事件 {event_id} 已经处理过，跳过")
-            return
-        
-        # 添加到已处理集合
-        processed_events.add(event_id)
-        setattr(do_p2_im_message_receive_v1, 'processed_events', processed_events)
-        
-        # 如果集合太大，清理一下
-        if len(processed_events) > 1000:
-            processed_events.clear()
-        
-        logger.info("收到新消息")
-        res_content = ""
-        message_type = data.event.message.message_type
-        logger.info(f"消息类型: {message_type}")
-
-        # 使用消息处理器处理消息
-        db = next(get_db())
-        handler = MessageHandler(db)
-        logger.info("开始处理消息...")
+        if not event_dispatcher.submit(data, key=resolve_order_key(data)):
+            logger.error(f"事件 {event_id} 入队失败，消息未处理")
+    except Exception as e:
+        logger.error(f"接收消息事件失败: {str(e)}", exc_info=True)
+
+
+def resolve_order_key(data: P2ImMessageReceiveV1) -> str:
+    """
+    计算事件的顺序键：同一个键的消息串行处理，不同键之间并行处理
+    默认使用 chat_id，保证 #接龙结束 等命令先于后续打卡执行；
+    开启 CHECKIN_ORDER_BY_NICKNAME 后，打卡消息按 chat_id+昵称 排序，
+    同一群内不同人的打卡可以并行，但不再与该群的其他命令保证先后顺序
+    """
+    chat_id = data.event.message.chat_id
+    if not CHECKIN_ORDER_BY_NICKNAME or data.event.message.message_type != "text":
+        return chat_id
+
+    try:
+        text = json.loads(data.event.message.content).get("text", "").strip()
+    except (ValueError, AttributeError):
+        return chat_id
+
+    if text.startswith('#打卡'):
+        parts = text.split(maxsplit=2)
+        if len(parts) >= 2 and parts[0] == '#打卡':
+            return f"{chat_id}:{parts[1]}"
+    return chat_id
 
+
+def process_message_event(data: P2ImMessageReceiveV1) -> None:
+    """在工作线程中处理接收到的消息事件"""
+    message_id = data.event.message.message_id
+
+    logger.info("收到新消息")
+    res_content = ""
+    message_type = data.event.message.message_type
+    logger.info(f"消息类型: {message_type}")
+
+    with event_dispatcher.stage('decode'):
         if message_type == "text":
             content_json = json.loads(data.event.message.content)
             res_content = content_json.get("text", "")
@@ -86,61 +105,45 @@ def do_p2_im_message_receive_v1(data: P2ImMessageReceiveV1) -> None:
             res_content = data.event.message.content
             logger.info(f"消息内容: {res_content}")
 
-        response = handler.handle_message(
-            res_content, 
-            data.event.message.chat_id, 
-            message_type,
-            message_id
-        )
+    # 普通聊天占群消息的大多数，不是命令时不打开数据库会话
+    with event_dispatcher.stage('route'):
+        route = command_router.route(message_type, res_content)
+    if not route:
+        logger.info("不是命令消息，跳过")
+        return
+
+    # 飞书在重连后可能重复投递事件，只对命令消息去重（开启 DEDUP_DB_ENABLED 时去重会写库）
+    event_id = data.header.event_id
+    if event_dedup.seen(f"event:{event_id}"):
+        logger.info(f"事件 {event_id} 已经处理过，跳过")
+        return
+
+    # 使用消息处理器处理消息
+    replier = reply_service.for_event(data)
+    db = next(get_db())
+    try:
+        handler = MessageHandler(db, replier=replier)
+        logger.info("开始处理消息...")
+
+        with event_dispatcher.stage('handle'):
+            response = handler.handle_message(
+                res_content, 
+                data.event.message.chat_id, 
+                message_type,
+                message_id,
+                route=route
+            )
         logger.info(f"消息处理结果: {response}")
+    finally:
+        db.close()
+
+    if response:
+        with event_dispatcher.stage('reply'):
+            replier.send(response)
 
-        if response:
-            content = json.dumps({"text": response})
-            logger.info(f"准备发送回复: {content}")
-
-            if data.event.message.chat_type == "p2p":
-                logger.info("私聊消息，使用 create 接口发送")
-                request = (
-                    CreateMessageRequest.builder()
-                    .receive_id_type("chat_id")
-                    .request_body(
-                        CreateMessageRequestBody.builder()
-                        .receive_id(data.event.message.chat_id)
-                        .msg_type("text")
-                        .content(content)
-                        .build()
-                    )
-                    .build()
-                )
-                # 使用OpenAPI发送消息
-                # Use send OpenAPI to send messages
-                # https://open.feishu.cn/document/uAjLw4CM/ukTMukTMukTM/reference/im-v1/message/create
-                response = client.im.v1.message.create(request)
-            else:
-                logger.info("群聊消息，使用 reply 接口发送")
-                request = (
-                    ReplyMessageRequest.builder()
-                    .message_id(message_id)
-                    .request_body(
-                        ReplyMessageRequestBody.builder()
-                        .content(content)
-                        .msg_type("text")
-                        .build()
-                    )
-                    .build()
-                )
-                # 使用OpenAPI回复消息
-                # Reply to messages using send OpenAPI
-                # https://open.feishu.cn/document/uAjLw4CM/ukTMukTMukTM/reference/im-v1/message/reply
-                response = client.im.v1.message.reply(request)
-
-            if not response.success():
-                logger.error(
-                    f"发送消息失败: {response.msg}, log_id: {response.get_log_id()}")
-            else:
-                logger.info("消息发送成功")
-    except Exception as e:
-        logger.error(f"消息处理失败: {str(e)}", exc_info=True)
+
+# 创建事件分发器，工作线程数和队列容量可通过 EVENT_WORKER_COUNT / EVENT_QUEUE_SIZE 配置
+event_dispatcher = EventDispatcher(process_message_event)
 
 
 # 注册事件回调
@@ -156,6 +159,8 @@ event_handler = (
 # Create LarkClient object for requesting OpenAPI, and create LarkWSClient object for receiving events using long connection.
 client = lark.Client.builder().app_id(
     FEISHU_APP_ID).app_secret(FEISHU_APP_SECRET).build()
+# 回复消息（含流式编辑）统一走 ReplyService，私聊用 create 接口，群聊用 reply 接口
+reply_service = ReplyService(client)
 wsClient = lark.ws.Client(
     FEISHU_APP_ID,
     FEISHU_APP_SECRET,
@@ -176,6 +181,9 @@ def main():
         task_scheduler = TaskScheduler(client)
         task_scheduler.start()
         logger.info("任务调度器已启动")
+
+        # 启动事件分发器
+        event_dispatcher.start()
         
         #  启动长连接，并注册事件处理器。
         #  Start long connection and register event handler.
@@ -185,6 +193,7 @@ def main():
         # 如果启动失败，确保关闭调度器
         if task_scheduler:
             task_scheduler.stop()
+        event_dispatcher.stop()
         raise
 
 
@@ -1,5 +1,16 @@
 import logging
-from app.services.feishu_service import FeishuService
+import threading
+import time
+from datetime import date, datetime
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from app.models.database import Base, Period, Signup, Checkin, LeaderboardEntry
+from app.services.feishu_service import FeishuService, TenantTokenCache
+from app.services.leaderboard_service import LeaderboardService
+from app.services.checkin_counters import CheckinCounterService
+from app.services.signup_sync import SignupSyncer
+from app.services import openai_service, ranking_service
 
 # 配置日志
 logging.basicConfig(
@@ -31,5 +42,157 @@ def test_fetch_signup_data():
         return False
 
 
+
+def _memory_sessionmaker():
+    """独立的内存 SQLite 会话工厂，不依赖 DATABASE_URL；所有线程共用同一个连接"""
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    return sessionmaker(bind=engine)
+
+
+def _memory_session():
+    return _memory_sessionmaker()()
+
+
+def test_leaderboard_rank_of():
+    db = _memory_session()
+    db.add_all([
+        Period(id=1, period_name="1", start_date=datetime.now(), end_date=datetime.now(), status="进行中"),
+        Period(id=2, period_name="2", start_date=datetime.now(), end_date=datetime.now(), status="已结束"),
+    ])
+    # 期数1：报名2和3都是3次，报名ID小的排前面；报名5属于另一期
+    counts = {1: (1, 1), 2: (1, 3), 3: (1, 3), 4: (1, 5), 5: (2, 9)}
+    for signup_id, (period_id, count) in counts.items():
+        db.add(Signup(id=signup_id, period_id=period_id, nickname=f"user{signup_id}"))
+        db.add(LeaderboardEntry(signup_id=signup_id, period_id=period_id, nickname=f"user{signup_id}",
+                                checkin_count=count, last_checkin_date=date.today()))
+    db.add(Signup(id=6, period_id=1, nickname="user6"))
+    db.commit()
+
+    leaderboard = LeaderboardService(db)
+    assert [leaderboard.rank_of(1, signup_id) for signup_id in (4, 2, 3, 1)] == [1, 2, 3, 4]
+    assert [entry['signup_id'] for entry in leaderboard.top(1)] == [4, 2, 3, 1]
+    # 没有打卡记录、或不属于该期时没有名次
+    assert leaderboard.rank_of(1, 6) is None
+    assert leaderboard.rank_of(1, 5) is None
+    assert leaderboard.rank_of(2, 5) == 1
+
+
+def test_ranking_summary_llm_timeout():
+    async def timeout(*args, **kwargs):
+        raise TimeoutError("LLM 请求超时")
+
+    original = openai_service._achat_completion, ranking_service.SessionLocal
+    openai_service._achat_completion = timeout
+    ranking_service.SessionLocal = _memory_sessionmaker()
+    try:
+        row = {
+            'signup_id': 1, 'nickname': 'user1', 'focus_area': '打卡机器人', 'introduction': '飞书群打卡',
+            'goals': '完成排行榜', 'latest_content': '完成了排名公布', 'checkin_count': 2
+        }
+        # LLM 超时时排行榜使用统一的默认简报，而不是打卡回复的兜底文案
+        assert ranking_service.generate_progress_summaries([row]) == [ranking_service.DEFAULT_PROGRESS_FEEDBACK]
+    finally:
+        openai_service._achat_completion, ranking_service.SessionLocal = original
+
+
+def test_build_history_skips_summary_covering_latest():
+    db = _memory_session()
+    db.add(Signup(id=1, period_id=1, nickname="user1", progress_summary="第1次：搭好框架\n第2次：完成登录\n",
+                  summary_checkin_count=2))
+    db.add_all([
+        Checkin(signup_id=1, nickname="user1", checkin_date=date(2025, 1, day), content=content, checkin_count=day)
+        for day, content in ((1, "搭好框架"), (2, "完成登录"))
+    ])
+    db.commit()
+
+    # 排名时摘要已经合并了第2次打卡，历史只取第1次，最新打卡不重复出现
+    assert openai_service.build_history(db, 1, 2) == "第1次打卡内容：搭好框架\n"
+    # 第3次打卡时摘要正好覆盖之前的打卡
+    assert openai_service.build_history(db, 1, 3).startswith("（截至第2次打卡的进展摘要）")
+
+
+def test_leaderboard_rebuild_repairs_rows():
+    db = _memory_session()
+    db.add(Period(id=1, period_name="1", start_date=datetime.now(), end_date=datetime.now(), status="进行中"))
+    for signup_id in (1, 2, 3):
+        db.add(Signup(id=signup_id, period_id=1, nickname=f"user{signup_id}"))
+    db.add_all([
+        Checkin(id=1, signup_id=1, nickname="user1", checkin_date=date(2025, 1, 1), content="a", checkin_count=1),
+        Checkin(id=2, signup_id=1, nickname="user1", checkin_date=date(2025, 1, 2), content="b", checkin_count=2),
+        Checkin(id=3, signup_id=2, nickname="user2", checkin_date=date(2025, 1, 1), content="c", checkin_count=1),
+    ])
+    # 报名1的次数少记一次，报名2缺行，报名3没有打卡却有行
+    db.add_all([
+        LeaderboardEntry(signup_id=1, period_id=1, nickname="user1", checkin_count=1,
+                         last_checkin_date=date(2025, 1, 1), latest_checkin_id=1),
+        LeaderboardEntry(signup_id=3, period_id=1, nickname="user3", checkin_count=1,
+                         last_checkin_date=date(2025, 1, 1), latest_checkin_id=None),
+    ])
+    db.commit()
+
+    leaderboard = LeaderboardService(db)
+    assert leaderboard.rebuild(1) == {'total': 2, 'mismatched': 3}
+    db.commit()
+    assert [(entry['signup_id'], entry['checkin_count']) for entry in leaderboard.top(1)] == [(1, 2), (2, 1)]
+    # 已经一致时不再修改任何行
+    assert leaderboard.rebuild(1) == {'total': 2, 'mismatched': 0}
+
+
+def test_checkin_counter_returns_updated_count():
+    db = _memory_session()
+    # 缓存快照里是 2 次，其他进程已经把数据库中的次数累加到 3
+    db.add(Signup(id=1, period_id=1, nickname="user1", checkin_count=3, last_checkin_date=date(2025, 1, 2),
+                  current_streak=3))
+    db.commit()
+
+    assert CheckinCounterService(db).record_checkin(1, date(2025, 1, 3)) == 4
+    db.commit()
+    signup = db.get(Signup, 1)
+    assert (signup.checkin_count, signup.current_streak) == (4, 4)
+
+
+def test_token_cache_single_flight_stats():
+    cache = TenantTokenCache(refresh_ahead_seconds=0)
+    start = threading.Barrier(8)
+
+    def fetcher():
+        time.sleep(0.1)
+        return "token", 7200
+
+    def worker():
+        start.wait()
+        assert cache.get_token("app", fetcher) == "token"
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    cache.get_token("app", fetcher)
+
+    # 并发的 8 个请求只刷新一次，等待刷新后复用令牌的不算未命中
+    stats = cache.get_stats()
+    assert stats['misses'] == stats['refreshes'] == 1
+    assert stats['hits'] + stats['coalesced'] == 8
+
+
+def test_signup_sync_treats_none_as_empty():
+    db = _memory_session()
+    db.add(Signup(id=1, period_id=1, nickname="user1", focus_area="打卡机器人", introduction=None, goals="完成排行榜"))
+    db.commit()
+
+    records = [{'nickname': "user1", 'focus_area': "打卡机器人", 'introduction': "", 'goals': " 完成排行榜 "}]
+    summary = SignupSyncer(db).sync(1, records)
+    assert (summary['updated'], summary['unchanged']) == (0, 1)
+
+
 if __name__ == "__main__":
     test_fetch_signup_data()
+    test_leaderboard_rank_of()
+    test_ranking_summary_llm_timeout()
+    test_build_history_skips_summary_covering_latest()
+    test_leaderboard_rebuild_repairs_rows()
+    test_checkin_counter_returns_updated_count()
+    test_token_cache_single_flight_stats()
+    test_signup_sync_treats_none_as_empty()